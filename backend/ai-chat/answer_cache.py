@@ -0,0 +1,107 @@
+'''
+Кэш ответов на повторяющиеся вопросы. Ключ - нормализованный вопрос и
+версия корпуса, которую file-upload увеличивает при каждом изменении файлов,
+поэтому устаревший ответ никогда не отдаётся. Первый уровень - LRU с TTL в
+памяти тёплого экземпляра функции, второй (ANSWER_CACHE_DB=1) - таблица
+answer_cache, общая для всех экземпляров.
+'''
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+CACHE_SIZE = int(os.environ.get('ANSWER_CACHE_SIZE', '512'))
+CACHE_TTL_SECONDS = float(os.environ.get('ANSWER_CACHE_TTL_SECONDS', '300'))
+CACHE_DB_ENABLED = os.environ.get('ANSWER_CACHE_DB') in ('1', 'true')
+
+CachedAnswer = Tuple[str, List[Dict[str, Any]]]
+
+def normalize_question(question: str) -> str:
+    """Регистр и пробелы не меняют ответ ни в одном из режимов поиска"""
+    return ' '.join(question.lower().split())
+
+def corpus_version(cursor) -> int:
+    cursor.execute("SELECT value FROM settings WHERE key = 'corpus_version'")
+    row = cursor.fetchone()
+    return int(row['value']) if row and row['value'] else 0
+
+class AnswerCache:
+    def __init__(self, max_size: int = CACHE_SIZE, ttl: float = CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.db_hits = 0
+        self._version: Optional[int] = None
+        self._entries: 'OrderedDict[str, Tuple[float, CachedAnswer]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_version(self, version: int) -> None:
+        # Ответы старой версии корпуса больше не понадобятся
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def get(self, version: int, question: str) -> Optional[CachedAnswer]:
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(question)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._entries[question]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(question)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, version: int, question: str, answer: CachedAnswer) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._check_version(version)
+            self._entries[question] = (time.monotonic(), answer)
+            self._entries.move_to_end(question)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def record_db_hit(self) -> None:
+        with self._lock:
+            self.db_hits += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'dbHits': self.db_hits,
+                'hitRate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'size': len(self._entries),
+                'maxSize': self.max_size,
+                'ttlSeconds': self.ttl,
+                'corpusVersion': self._version,
+                'dbTier': CACHE_DB_ENABLED
+            }
+
+def load_shared(cursor, version: int, question: str) -> Optional[CachedAnswer]:
+    """Второй уровень: ответ, сохранённый другим экземпляром функции"""
+    cursor.execute(
+        """SELECT answer, images FROM answer_cache
+           WHERE corpus_version = %s AND question = %s
+             AND created_at > NOW() - make_interval(secs => %s)""",
+        (version, question, CACHE_TTL_SECONDS)
+    )
+    row = cursor.fetchone()
+    return (row['answer'], row['images'] or []) if row else None
+
+def store_shared(cursor, version: int, question: str, answer: CachedAnswer) -> None:
+    cursor.execute(
+        """INSERT INTO answer_cache (corpus_version, question, answer, images)
+           VALUES (%s, %s, %s, %s::jsonb)
+           ON CONFLICT (corpus_version, question)
+           DO UPDATE SET answer = EXCLUDED.answer, images = EXCLUDED.images, created_at = NOW()""",
+        (version, question, answer[0], json.dumps(answer[1]))
+    )
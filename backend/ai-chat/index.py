@@ -1,195 +1,381 @@
 import json
 import os
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, NamedTuple, Tuple
 import psycopg2
 from psycopg2.extras import RealDictCursor
-import requests
+from db import connection
+from text_index import query_terms
+from ranking import CorpusStats, Posting, bm25f_scores, top_documents, term_idfs, best_lines, fuse_rankings
+from search import MAX_ANSWER_LINES, NOT_FOUND_ANSWER, prepared_search_answer, build_query_plan
+from kb_snapshot import KnowledgeBaseSnapshot, is_image_file
+from answer_cache import AnswerCache, CACHE_DB_ENABLED, corpus_version, normalize_question, load_shared, store_shared
+from embedding import embed
+from semantic import load_embedding_index, semantic_lines
+from tokens import AUTH_SECRET, verify_access_token
+from quota import Quota, TokenBucket, consume_message
+from timing import count, instrument, stage
+from responses import CORS_HEADERS, dumps, json_response, negotiated, preflight
+from llm import LLM_TOP_K, LLMError, build_messages, generate, pack_context, sse_body
 
-def is_image_file(file_name: str) -> bool:
-    """Check if file is an image based on extension"""
-    image_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.svg')
-    return file_name.lower().endswith(image_extensions)
+MAX_ANSWER_CHUNKS = 5
+MAX_ANSWER_IMAGES = 3
+SEARCH_MODEL = "Умный поиск по документам"
+GENERATED_MODEL = "Языковая модель по документам"
 
-def extract_text_from_file(file_content: bytes, file_name: str) -> str:
-    file_lower = file_name.lower()
+MODE_KEYWORD = 'keyword'
+MODE_SEMANTIC = 'semantic'
+MODE_HYBRID = 'hybrid'
+SEARCH_MODES = (MODE_KEYWORD, MODE_SEMANTIC, MODE_HYBRID)
+DEFAULT_SEARCH_MODE = os.environ.get('SEARCH_MODE', MODE_KEYWORD)
+
+# Живут, пока жив экземпляр функции
+answer_cache = AnswerCache()
+kb_snapshot = KnowledgeBaseSnapshot()
+anonymous_limiter = TokenBucket()
+
+class IndexedAnswer(NamedTuple):
+    text: str
+    described: List[int]
+    # Найденные фрагменты в порядке рейтинга - контекст для языковой модели
+    chunks: List[str]
+
+def keyword_scores(cursor, question: str, stats: CorpusStats) -> Tuple[Dict[Tuple[int, int], float], Dict[str, float]]:
+    """BM25F-оценки фрагментов с термами запроса и idf этих термов"""
+    terms = query_terms(question)
+    scores: Dict[Tuple[int, int], float] = {}
+    doc_freq: Dict[str, int] = {}
+    if terms:
+        cursor.execute("SELECT term, doc_freq FROM search_terms WHERE term = ANY(%s)", (terms,))
+        doc_freq = {row['term']: row['doc_freq'] for row in cursor.fetchall()}
+        
+        if doc_freq:
+            cursor.execute(
+                """SELECT p.term, p.file_id, p.chunk_no, p.tf, c.term_count
+                   FROM search_postings p
+                   JOIN document_chunks c ON c.file_id = p.file_id AND c.chunk_no = p.chunk_no
+                   WHERE p.term = ANY(%s)""",
+                (list(doc_freq),)
+            )
+            postings = cursor.fetchall()
+            count('rows_read', len(postings))
+            scores = bm25f_scores((Posting(**row) for row in postings), doc_freq, stats)
+    return scores, term_idfs(doc_freq, stats)
+
+def indexed_search_answer(cursor, question: str, mode: str = MODE_KEYWORD, version: int = 0,
+                          chunk_limit: int = MAX_ANSWER_CHUNKS) -> Optional[IndexedAnswer]:
+    """Поиск по индексу фрагментов: BM25F по инвертированному индексу (keyword),
+    близость эмбеддингов (semantic) или слияние обоих рейтингов (hybrid).
+    Возвращает ответ, id файлов, чьё описание совпало с запросом, и до chunk_limit
+    лучших фрагментов, или None, если индекс ещё не построен"""
+    cursor.execute("SELECT doc_count, total_terms, desc_count, desc_terms FROM search_stats WHERE id = 1")
+    stats_row = cursor.fetchone()
+    if not stats_row or not stats_row['doc_count']:
+        return None
+    stats = CorpusStats(**stats_row)
     
-    if is_image_file(file_name):
-        return f"[Изображение: {file_name}]"
+    query_vector = None
+    hits = []
+    if mode != MODE_KEYWORD:
+        embeddings = load_embedding_index(cursor, version)
+        # Пока эмбеддинги не посчитаны, семантический режим работает как keyword
+        if len(embeddings):
+            query_vector = embed(question)
+            hits = embeddings.search(query_vector)
+        elif mode == MODE_SEMANTIC:
+            mode = MODE_KEYWORD
     
-    if file_lower.endswith('.txt'):
-        return file_content.decode('utf-8', errors='ignore')
+    scores: Dict[Tuple[int, int], float] = {}
+    term_idf: Dict[str, float] = {}
+    if mode != MODE_SEMANTIC:
+        scores, term_idf = keyword_scores(cursor, question, stats)
     
-    elif file_lower.endswith('.json'):
-        try:
-            data = json.loads(file_content.decode('utf-8'))
-            return json.dumps(data, indent=2, ensure_ascii=False)
-        except:
-            return file_content.decode('utf-8', errors='ignore')
+    if not scores and not hits:
+        return IndexedAnswer(NOT_FOUND_ANSWER, [], [])
     
-    elif file_lower.endswith(('.pdf', '.doc', '.docx')):
-        return f"[Содержимое файла {file_name}]\n\n{file_content.decode('utf-8', errors='ignore')[:5000]}"
+    rankings = []
+    # Фрагмент 0 - описание файла
+    described: List[int] = []
+    if scores:
+        rankings.append(top_documents(scores, chunk_limit))
+        described.extend(key[0] for key in top_documents(scores, len(scores)) if key[1] == 0)
+    if hits:
+        rankings.append([key for key, _ in hits[:chunk_limit]])
+        described.extend(key[0] for key, _ in hits if key[1] == 0)
     
-    else:
-        return file_content.decode('utf-8', errors='ignore')[:10000]
-
-def simple_search_answer(question: str, knowledge_base: str, descriptions: list) -> str:
-    """Улучшенный поиск по ключевым словам с учетом описаний файлов"""
-    question_lower = question.lower()
-    kb_lower = knowledge_base.lower()
+    ranked: List[Tuple[int, int]] = fuse_rankings(rankings)[:chunk_limit]
     
-    # Ключевые слова для поиска
-    words = [w.strip('?.,!') for w in question_lower.split() if len(w) > 3]
+    cursor.execute(
+        """SELECT c.file_id, c.chunk_no, c.content FROM document_chunks c
+           JOIN unnest(%s::int[], %s::int[]) AS k(file_id, chunk_no)
+             ON c.file_id = k.file_id AND c.chunk_no = k.chunk_no""",
+        ([key[0] for key in ranked], [key[1] for key in ranked])
+    )
+    chunk_rows = cursor.fetchall()
+    count('rows_read', len(chunk_rows))
+    count('chars_read', sum(len(row['content']) for row in chunk_rows))
+    contents = {(row['file_id'], row['chunk_no']): row['content'] for row in chunk_rows}
+    chunks = [contents[key] for key in ranked if key in contents]
+    # Извлечённый ответ строится из тех же фрагментов, что и без генерации
+    answer_chunks = chunks[:MAX_ANSWER_CHUNKS]
     
-    # Разбиваем базу знаний на предложения
-    sentences = knowledge_base.split('\n')
+    line_rankings = []
+    if scores:
+        line_rankings.append(best_lines(answer_chunks, term_idf, MAX_ANSWER_LINES))
+    if query_vector is not None:
+        line_rankings.append(semantic_lines(answer_chunks, query_vector, MAX_ANSWER_LINES))
+    lines = fuse_rankings(line_rankings)[:MAX_ANSWER_LINES]
+    return IndexedAnswer("\n\n".join(lines) if lines else NOT_FOUND_ANSWER, list(dict.fromkeys(described)), chunks)
+
+def load_image_refs(cursor, file_ids: List[int]) -> list:
+    """Ссылки на изображения вместо base64: байты отдаёт file-upload по id,
+    hash служит версией URL и ETag"""
+    if not file_ids:
+        return []
     
-    # Находим релевантные предложения
-    relevant = []
-    for sentence in sentences:
-        if len(sentence.strip()) < 10:
+    cursor.execute(
+        "SELECT id, file_name, file_type, file_size, content_hash FROM files WHERE id = ANY(%s)",
+        (file_ids,)
+    )
+    rows = {row['id']: row for row in cursor.fetchall()}
+    refs = []
+    for file_id in file_ids:
+        row = rows.get(file_id)
+        if not row or not is_image_file(row['file_name']):
             continue
-        sentence_lower = sentence.lower()
-        score = sum(1 for word in words if word in sentence_lower)
-        
-        # Увеличиваем вес, если совпадает с описанием
-        for desc in descriptions:
-            if desc and any(word in desc.lower() for word in words):
-                score += 2
-        
-        if score > 0:
-            relevant.append((score, sentence.strip()))
-    
-    # Сортируем по релевантности
-    relevant.sort(reverse=True, key=lambda x: x[0])
-    
-    if not relevant:
-        # Попробуем найти в описаниях
-        desc_matches = [desc for desc in descriptions if desc and any(word in desc.lower() for word in words)]
-        if desc_matches:
-            return "Информация по вашему запросу:\n\n" + "\n\n".join(desc_matches)
-        return "К сожалению, я не нашёл информацию по вашему вопросу в загруженных документах."
-    
-    # Берём топ-5 самых релевантных предложений
-    answer_parts = [s[1] for s in relevant[:7]]
-    answer = "\n\n".join(answer_parts)
-    
-    return answer
+        refs.append({
+            'id': row['id'],
+            'name': row['file_name'],
+            'mimeType': row['file_type'] or 'image/jpeg',
+            'size': row['file_size'],
+            'hash': row['content_hash']
+        })
+        if len(refs) >= MAX_ANSWER_IMAGES:
+            break
+    return refs
+
+def get_access_token(event: Dict[str, Any], body: Dict[str, Any]) -> str:
+    """Токен доступа из Authorization: Bearer, X-Auth-Token или тела запроса"""
+    headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    authorization = headers.get('authorization') or ''
+    if authorization.lower().startswith('bearer '):
+        return authorization[7:].strip()
+    return body.get('access_token') or headers.get('x-auth-token') or ''
+
+def client_address(event: Dict[str, Any]) -> Optional[str]:
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    return identity.get('sourceIp') or None
+
+def too_many_requests(retry_after: int, error: str, quota: Optional[Quota] = None) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {'error': error, 'retryAfter': retry_after}
+    if quota is not None:
+        payload['quota'] = quota.as_dict()
+    return json_response(429, payload, {'Access-Control-Expose-Headers': 'Retry-After', 'Retry-After': str(retry_after)})
+
+def event_stream(deltas: List[str], final: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    """Ответ в формате text/event-stream: куски текста, затем итоговое событие"""
+    with stage('encode'):
+        body = sse_body(deltas, final, dumps)
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'text/event-stream; charset=utf-8', 'Cache-Control': 'no-cache',
+                    **CORS_HEADERS, **headers},
+        'isBase64Encoded': False,
+        'body': body
+    }
 
+@instrument('ai-chat')
+@negotiated
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: AI chat - DeepSeek/OpenRouter с автоматическим fallback
-    Args: event с httpMethod, body (message, file_id)
+    Business: AI chat - поиск по документам; с generate ответ пишет языковая модель
+              (DeepSeek/OpenRouter с автоматическим fallback) по найденным фрагментам
+    Args: event с httpMethod, body (message, file_id, mode: keyword | semantic | hybrid,
+          generate, stream), необязательным токеном доступа (Authorization: Bearer)
+          для учёта дневной квоты; токены проверяются по AUTH_SECRET, общему с auth
           context с request_id
-    Returns: HTTP response с ответом от AI
+    Returns: HTTP response с ответом от AI; со stream - text/event-stream
     '''
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+        return preflight('GET, POST, OPTIONS', 'Content-Type, Authorization, X-Auth-Token')
+    
+    if method == 'GET':
+        # Счётчики кэша ответов и снимка базы знаний этого экземпляра
+        return json_response(200, {'cache': answer_cache.stats(), 'knowledgeBase': kb_snapshot.stats()})
     
     if method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+        return json_response(405, {'error': 'Method not allowed'})
     
     body_data = json.loads(event.get('body', '{}'))
     user_message: str = body_data.get('message', '')
     file_id: Optional[int] = body_data.get('file_id')
+    mode: str = body_data.get('mode') or DEFAULT_SEARCH_MODE
+    use_llm = bool(body_data.get('generate'))
+    stream = bool(body_data.get('stream'))
     
     if not user_message:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'error': 'Message is required'})
-        }
+        return json_response(400, {'error': 'Message is required'})
+    
+    if mode not in SEARCH_MODES:
+        return json_response(400, {'error': f"mode must be one of: {', '.join(SEARCH_MODES)}"})
+    
+    access_token = get_access_token(event, body_data)
+    if access_token and not AUTH_SECRET:
+        return json_response(500, {'error': 'AUTH_SECRET not configured'})
+    claims = verify_access_token(access_token) if access_token else None
+    if access_token and claims is None:
+        return json_response(401, {'error': 'Invalid or expired token'})
+    
+    address = client_address(event)
+    if claims is None and address is not None:
+        # Анонимов ограничивает экземпляр функции, не трогая БД; без адреса клиента
+        # общий на всех bucket ограничивал бы всех сразу
+        allowed, retry_after = anonymous_limiter.take(address)
+        if not allowed:
+            return too_many_requests(retry_after, 'Слишком много запросов, попробуйте позже')
     
     database_url = os.environ.get('DATABASE_URL')
     
-    knowledge_base = ""
     image_files = []
-    descriptions = []
+    ai_response = None
+    cache_status = 'MISS'
+    quota: Optional[Quota] = None
+    # Фрагменты для языковой модели; генерация идёт уже после возврата соединения в пул
+    context_chunks: List[str] = []
+    cache_key = ''
+    version = 0
     
-    # Загружаем ВСЕ файлы как базу знаний
     if database_url:
         try:
-            conn = psycopg2.connect(database_url)
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            
-            cursor.execute("SELECT file_name, file_data, file_type, description FROM files ORDER BY id DESC LIMIT 10")
-            files = cursor.fetchall()
-            
-            if files:
-                knowledge_base = "\n\n=== БАЗА ЗНАНИЙ ===\n"
-                for file_record in files:
-                    file_content = bytes(file_record['file_data'])
-                    file_name = file_record['file_name']
-                    file_description = file_record.get('description', '')
-                    
-                    if file_description:
-                        descriptions.append(file_description)
+            with connection(database_url) as conn:
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                
+                if claims is not None:
+                    # Проверка и списание квоты одним UPDATE; фиксируется только вместе с ответом,
+                    # без ответа release() откатывает списание
+                    with stage('quota'):
+                        quota = consume_message(cursor, claims['sub'])
+                    if quota is None:
+                        cursor.close()
+                        return json_response(401, {'error': 'User not found'})
+                    if not quota.allowed:
+                        cursor.close()
+                        return too_many_requests(quota.retry_after, 'Дневной лимит сообщений исчерпан', quota)
+                    cursor.execute("SAVEPOINT answer")
+                
+                def rollback() -> None:
+                    # Ошибка поиска или кэша не должна отменять списанную квоту
+                    if quota is not None:
+                        cursor.execute("ROLLBACK TO SAVEPOINT answer")
+                    else:
+                        conn.rollback()
+                
+                with stage('cache'):
+                    version = corpus_version(cursor)
+                    cache_key = f"{'llm:' if use_llm else ''}{mode}:{normalize_question(user_message)}"
+                    cached = answer_cache.get(version, cache_key)
+                    # Сгенерированные ответы хранит только кэш экземпляра
+                    if cached is None and CACHE_DB_ENABLED and not use_llm:
+                        try:
+                            cached = load_shared(cursor, version, cache_key)
+                        except psycopg2.Error:
+                            rollback()
+                        if cached is not None:
+                            answer_cache.record_db_hit()
+                            answer_cache.put(version, cache_key, cached)
+                
+                if cached is not None:
+                    ai_response, image_files = cached
+                    cache_status = 'HIT'
+                else:
+                    matched_images: List[int] = []
+                    try:
+                        with stage('search'):
+                            indexed = indexed_search_answer(cursor, user_message, mode, version,
+                                                            LLM_TOP_K if use_llm else MAX_ANSWER_CHUNKS)
+                    except psycopg2.Error:
+                        rollback()
+                        indexed = None
                     
-                    # Separate images from text
-                    if is_image_file(file_name):
-                        import base64
-                        image_files.append({
-                            'name': file_name,
-                            'base64': base64.b64encode(file_content).decode('utf-8'),
-                            'mimeType': file_record.get('file_type', 'image/jpeg')
-                        })
-                        # Add description to knowledge base for images
-                        if file_description:
-                            knowledge_base += f"\n--- Файл: {file_name} [ИЗОБРАЖЕНИЕ] ---\n{file_description}\n"
-                        else:
-                            knowledge_base += f"\n--- Файл: {file_name} [ИЗОБРАЖЕНИЕ] ---\n"
+                    if indexed is not None:
+                        ai_response, matched_images, context_chunks = indexed
                     else:
-                        file_text = extract_text_from_file(file_content, file_name)
-                        if file_description:
-                            knowledge_base += f"\n--- Файл: {file_name} ---\nОписание: {file_description}\n{file_text[:5000]}\n"
-                        else:
-                            knowledge_base += f"\n--- Файл: {file_name} ---\n{file_text[:5000]}\n"
-            
-            cursor.close()
-            conn.close()
+                        # Линейный поиск остаётся для баз, где индекс ещё не построен
+                        with stage('kb_snapshot'):
+                            knowledge = kb_snapshot.get(cursor)
+                        if knowledge.text:
+                            with stage('linear_search'):
+                                ai_response = prepared_search_answer(user_message, knowledge.prepared, knowledge.descriptions)
+                                matched_images = [
+                                    image_id for image_id, description in knowledge.images
+                                    if build_query_plan(user_message, [description])['desc_matches']
+                                ]
+                    
+                    # Только изображения, чьё описание совпало с вопросом
+                    if ai_response is not None:
+                        with stage('images'):
+                            image_files = load_image_refs(cursor, matched_images)
+                    
+                    # Под ключом генерации кэшируется только ответ модели
+                    if ai_response is not None and not use_llm:
+                        with stage('cache_store'):
+                            answer_cache.put(version, cache_key, (ai_response, image_files))
+                            if CACHE_DB_ENABLED:
+                                try:
+                                    store_shared(cursor, version, cache_key, (ai_response, image_files))
+                                except psycopg2.Error:
+                                    rollback()
+                
+                if ai_response is not None:
+                    conn.commit()
+                cursor.close()
         except Exception as e:
-            knowledge_base = ""
+            ai_response = None
+    
+    if ai_response is None:
+        return json_response(400, {'error': 'Загрузите хотя бы один файл с данными для ответов помощника'})
     
-    if not knowledge_base:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'error': 'Загрузите хотя бы один файл с данными для ответов помощника'})
-        }
+    model_used = GENERATED_MODEL if use_llm and cache_status == 'HIT' else SEARCH_MODEL
+    deltas = [ai_response]
+    generation = None
     
-    ai_response = simple_search_answer(user_message, knowledge_base, descriptions)
-    model_used = "Умный поиск по документам"
+    if use_llm and context_chunks:
+        messages = build_messages(user_message, pack_context(context_chunks))
+        try:
+            with stage('llm'):
+                generation = generate(messages)
+        except LLMError:
+            count('llm_errors')
+        if generation is not None and not (generation.complete and generation.text):
+            # Оборванный поток не выдаётся за ответ и не кэшируется: остаётся извлечённый ответ
+            count('llm_incomplete')
+            generation = None
+        if generation is not None:
+            ai_response = generation.text
+            deltas = generation.deltas
+            model_used = generation.model
+            answer_cache.put(version, cache_key, (ai_response, image_files))
     
     response_data = {
         'response': ai_response,
-        'file_analyzed': bool(knowledge_base),
+        'file_analyzed': True,
         'model': model_used
     }
     
+    if generation is not None:
+        response_data['provider'] = generation.provider
+        response_data['hedged'] = generation.hedged
+    
     # Add images to response if found
     if image_files:
         response_data['images'] = image_files
     
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'isBase64Encoded': False,
-        'body': json.dumps(response_data, ensure_ascii=False)
-    }
\ No newline at end of file
+    if quota is not None:
+        response_data['quota'] = quota.as_dict()
+    
+    if stream:
+        final = {key: value for key, value in response_data.items() if key != 'response'}
+        return event_stream(deltas, final, {'X-Cache': cache_status})
+    
+    return json_response(200, response_data, {'X-Cache': cache_status})
\ No newline at end of file
@@ -0,0 +1,138 @@
+'''
+Снимок базы знаний для линейного поиска, живущий в тёплом экземпляре функции.
+На каждом запросе проверяется только сводка по таблице files (max(id),
+max(updated_at), count(*)); если она изменилась, из базы читаются лишь новые
+и изменённые файлы, остальные части снимка переиспользуются.
+'''
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from search import PreparedKnowledgeBase, prepare_knowledge_base
+from timing import count
+
+KB_FILE_LIMIT = 10
+
+def is_image_file(file_name: str) -> bool:
+    """Check if file is an image based on extension"""
+    image_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.svg')
+    return file_name.lower().endswith(image_extensions)
+
+class FileEntry(NamedTuple):
+    id: int
+    updated_at: Optional[datetime]
+    file_name: str
+    description: str
+    is_image: bool
+    text: str
+    content_hash: Optional[str]
+
+class KnowledgeBase(NamedTuple):
+    text: str
+    prepared: PreparedKnowledgeBase
+    descriptions: List[str]
+    images: List[Tuple[int, str]]
+
+EMPTY = KnowledgeBase('', prepare_knowledge_base(''), [], [])
+
+def file_entry(file_record: Dict[str, Any]) -> FileEntry:
+    file_name = file_record['file_name']
+    return FileEntry(
+        file_record['id'], file_record['updated_at'], file_name, file_record.get('description', ''),
+        is_image_file(file_name), (file_record['extracted_text'] or '')[:5000], file_record['content_hash']
+    )
+
+def file_segment(entry: FileEntry, with_text: bool) -> str:
+    """Фрагмент базы знаний для одного файла"""
+    file_name = entry.file_name
+    file_description = entry.description
+
+    if entry.is_image:
+        # Add description to knowledge base for images
+        if file_description:
+            return f"\n--- Файл: {file_name} [ИЗОБРАЖЕНИЕ] ---\n{file_description}\n"
+        return f"\n--- Файл: {file_name} [ИЗОБРАЖЕНИЕ] ---\n"
+
+    file_text = entry.text if with_text else ''
+    if file_description:
+        return f"\n--- Файл: {file_name} ---\nОписание: {file_description}\n{file_text}\n"
+    return f"\n--- Файл: {file_name} ---\n{file_text}\n"
+
+def build_knowledge_base(entries: List[FileEntry]) -> KnowledgeBase:
+    """Текст одинакового содержимого попадает в базу один раз, у копий остаются
+    только имя и описание, чтобы в ответе не повторялись одни и те же строки"""
+    if not entries:
+        return EMPTY
+    segments = []
+    seen_hashes = set()
+    for entry in entries:
+        duplicate = entry.content_hash is not None and entry.content_hash in seen_hashes
+        seen_hashes.add(entry.content_hash)
+        segments.append(file_segment(entry, not duplicate))
+    knowledge_base = "\n\n=== БАЗА ЗНАНИЙ ===\n" + ''.join(segments)
+    return KnowledgeBase(
+        knowledge_base,
+        prepare_knowledge_base(knowledge_base),
+        [entry.description for entry in entries if entry.description],
+        [(entry.id, entry.description) for entry in entries if entry.is_image]
+    )
+
+class KnowledgeBaseSnapshot:
+    def __init__(self):
+        self.signature: Optional[tuple] = None
+        self.entries: Dict[int, FileEntry] = {}
+        self.current: KnowledgeBase = EMPTY
+        self.refreshes = 0
+        self.fetched_files = 0
+        self._lock = threading.Lock()
+
+    def get(self, cursor) -> KnowledgeBase:
+        """Актуальная база знаний; читает из files только то, что изменилось"""
+        cursor.execute("SELECT max(id) AS max_id, max(updated_at) AS max_updated_at, count(*) AS total FROM files")
+        row = cursor.fetchone()
+        signature = (row['max_id'], row['max_updated_at'], row['total'])
+        if signature == self.signature:
+            return self.current
+
+        with self._lock:
+            if signature == self.signature:
+                return self.current
+
+            cursor.execute("SELECT id, updated_at FROM files ORDER BY id DESC LIMIT %s", (KB_FILE_LIMIT,))
+            latest = [(r['id'], r['updated_at']) for r in cursor.fetchall()]
+            changed = [
+                file_id for file_id, updated_at in latest
+                if file_id not in self.entries or self.entries[file_id].updated_at != updated_at
+            ]
+
+            fetched: Dict[int, FileEntry] = {}
+            if changed:
+                cursor.execute(
+                    """SELECT id, updated_at, file_name, description, extracted_text, content_hash
+                       FROM files WHERE id = ANY(%s)""",
+                    (changed,)
+                )
+                rows = cursor.fetchall()
+                count('rows_read', len(rows))
+                count('chars_read', sum(len(r['extracted_text'] or '') for r in rows))
+                fetched = {r['id']: file_entry(r) for r in rows}
+
+            # Файлы, выпавшие из последних KB_FILE_LIMIT или удалённые, уходят из снимка
+            entries = {}
+            for file_id, _ in latest:
+                entry = fetched.get(file_id) or self.entries.get(file_id)
+                if entry is not None:
+                    entries[file_id] = entry
+
+            self.entries = entries
+            self.current = build_knowledge_base(list(entries.values()))
+            self.signature = signature
+            self.refreshes += 1
+            self.fetched_files += len(fetched)
+            return self.current
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'files': len(self.entries),
+            'refreshes': self.refreshes,
+            'fetchedFiles': self.fetched_files
+        }
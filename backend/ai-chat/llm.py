@@ -0,0 +1,252 @@
+'''
+Генерация ответа языковой моделью по найденным фрагментам (режим generate).
+Провайдеры - OpenAI-совместимые /chat/completions (DeepSeek, OpenRouter или
+любой другой из LLM_PROVIDERS), запросы идут через общий requests.Session с
+пулом keep-alive соединений, поэтому тёплый экземпляр не платит за TCP и TLS
+на каждом вопросе.
+Ответ всегда запрашивается потоком. Если первый провайдер не прислал первый
+токен за LLM_HEDGE_SECONDS или упал, параллельно запускается следующий;
+побеждает тот, кто первым начал отвечать, остальные попытки отменяются.
+Поток, оборванный ошибкой или общим таймаутом, возвращается с complete=False:
+такой текст нельзя выдавать за ответ и кэшировать.
+В модель уходят только лучшие фрагменты поиска, упакованные в бюджет токенов.
+'''
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional
+import requests
+from requests.adapters import HTTPAdapter
+
+LLM_TOP_K = int(os.environ.get('LLM_TOP_K', '8'))
+LLM_CONTEXT_TOKENS = int(os.environ.get('LLM_CONTEXT_TOKENS', '3000'))
+LLM_MAX_TOKENS = int(os.environ.get('LLM_MAX_TOKENS', '512'))
+LLM_TEMPERATURE = float(os.environ.get('LLM_TEMPERATURE', '0.2'))
+LLM_HEDGE_SECONDS = float(os.environ.get('LLM_HEDGE_SECONDS', '2.5'))
+LLM_TOTAL_TIMEOUT = float(os.environ.get('LLM_TOTAL_TIMEOUT', '60'))
+LLM_POOL_SIZE = int(os.environ.get('LLM_POOL_SIZE', '8'))
+
+# Грубая оценка для смеси кириллицы и латиницы; точный токенизатор у каждой модели свой
+CHARS_PER_TOKEN = 3
+MIN_FRAGMENT_CHARS = 200
+
+DEFAULT_PROVIDERS = {
+    'deepseek': ('https://api.deepseek.com', 'deepseek-chat'),
+    'openrouter': ('https://openrouter.ai/api/v1', 'deepseek/deepseek-chat')
+}
+
+SYSTEM_PROMPT = (
+    "Ты помощник, который отвечает на вопросы пользователя только по фрагментам документов ниже. "
+    "Если ответа во фрагментах нет, честно скажи, что не нашёл информацию в загруженных документах. "
+    "Отвечай кратко и на языке вопроса."
+)
+
+class Provider(NamedTuple):
+    name: str
+    url: str
+    api_key: str
+    model: str
+    connect_timeout: float
+    read_timeout: float
+
+class Generation(NamedTuple):
+    text: str
+    deltas: List[str]
+    provider: str
+    model: str
+    hedged: bool
+    first_token_seconds: float
+    # Поток закончился [DONE] или штатно, без ошибки и отмены
+    complete: bool
+
+class LLMError(Exception):
+    pass
+
+def configured_providers() -> List[Provider]:
+    """Провайдеры в порядке LLM_PROVIDERS; без ключа провайдер пропускается"""
+    providers = []
+    for name in os.environ.get('LLM_PROVIDERS', 'deepseek,openrouter').split(','):
+        name = name.strip().lower()
+        prefix = name.upper().replace('-', '_')
+        api_key = os.environ.get(f'{prefix}_API_KEY')
+        if not name or not api_key:
+            continue
+        default_url, default_model = DEFAULT_PROVIDERS.get(name, ('', ''))
+        base_url = os.environ.get(f'{prefix}_BASE_URL', default_url).rstrip('/')
+        if not base_url:
+            continue
+        providers.append(Provider(
+            name, f'{base_url}/chat/completions', api_key,
+            os.environ.get(f'{prefix}_MODEL', default_model),
+            float(os.environ.get(f'{prefix}_CONNECT_TIMEOUT', '3')),
+            # Между байтами потока, а не на весь ответ
+            float(os.environ.get(f'{prefix}_TIMEOUT', '20'))
+        ))
+    return providers
+
+def make_session() -> requests.Session:
+    session = requests.Session()
+    # Повторы отключены: запасной провайдер запускается хеджированием, а не ретраями
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=LLM_POOL_SIZE, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+session = make_session()
+_executor = ThreadPoolExecutor(max_workers=LLM_POOL_SIZE, thread_name_prefix='llm')
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def pack_context(chunks: List[str], budget: int = LLM_CONTEXT_TOKENS) -> List[str]:
+    """Фрагменты в порядке рейтинга, пока помещаются в бюджет; последний
+    обрезается по границе строки или слова, если от него остаётся достаточно"""
+    packed: List[str] = []
+    used = 0
+    for chunk in chunks:
+        cost = estimate_tokens(chunk)
+        if used + cost <= budget:
+            packed.append(chunk)
+            used += cost
+            continue
+        limit = (budget - used) * CHARS_PER_TOKEN
+        if limit >= MIN_FRAGMENT_CHARS:
+            cut = chunk[:limit]
+            boundary = max(cut.rfind('\n'), cut.rfind(' '))
+            packed.append(cut[:boundary] if boundary > MIN_FRAGMENT_CHARS // 2 else cut)
+        break
+    return packed
+
+def build_messages(question: str, fragments: List[str]) -> List[Dict[str, str]]:
+    context = '\n\n'.join(f'[{number}] {fragment}' for number, fragment in enumerate(fragments, 1))
+    return [
+        {'role': 'system', 'content': f'{SYSTEM_PROMPT}\n\nФрагменты документов:\n\n{context}'},
+        {'role': 'user', 'content': question}
+    ]
+
+def stream_completion(provider: Provider, messages: List[Dict[str, str]], max_tokens: int,
+                      cancelled: threading.Event) -> Iterator[str]:
+    """Текст ответа по кускам из потока server-sent events"""
+    response = session.post(
+        provider.url,
+        json={'model': provider.model, 'messages': messages, 'max_tokens': max_tokens,
+              'temperature': LLM_TEMPERATURE, 'stream': True},
+        headers={'Authorization': f'Bearer {provider.api_key}', 'Accept': 'text/event-stream'},
+        stream=True,
+        timeout=(provider.connect_timeout, provider.read_timeout)
+    )
+    try:
+        if response.status_code != 200:
+            raise LLMError(f'{provider.name}: HTTP {response.status_code}')
+        for line in response.iter_lines():
+            if cancelled.is_set():
+                return
+            if not line.startswith(b'data:'):
+                continue
+            data = line[5:].strip()
+            if data == b'[DONE]':
+                return
+            try:
+                choice = json.loads(data)['choices'][0]
+            except (ValueError, KeyError, IndexError, TypeError):
+                continue
+            delta = (choice.get('delta') or {}).get('content')
+            if delta:
+                yield delta
+    finally:
+        response.close()
+
+class Attempt:
+    """Один запрос к провайдеру в фоновом потоке; состояние меняется под общим condition"""
+
+    def __init__(self, provider: Provider, condition: threading.Condition):
+        self.provider = provider
+        self.condition = condition
+        self.deltas: List[str] = []
+        self.error: Optional[BaseException] = None
+        self.finished = False
+        self.complete = False
+        self.cancelled = threading.Event()
+        self.started = time.monotonic()
+        self.first_token_at: Optional[float] = None
+
+    def run(self, messages: List[Dict[str, str]], max_tokens: int) -> None:
+        try:
+            for delta in stream_completion(self.provider, messages, max_tokens, self.cancelled):
+                with self.condition:
+                    if self.first_token_at is None:
+                        self.first_token_at = time.monotonic()
+                    self.deltas.append(delta)
+                    self.condition.notify_all()
+            # stream_completion молча возвращается и после отмены
+            self.complete = not self.cancelled.is_set()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+
+def generate(messages: List[Dict[str, str]], providers: Optional[List[Provider]] = None,
+             max_tokens: int = LLM_MAX_TOKENS, hedge_after: float = LLM_HEDGE_SECONDS,
+             total_timeout: float = LLM_TOTAL_TIMEOUT) -> Generation:
+    """Ответ первого провайдера, начавшего отвечать. Следующий запускается, если
+    предыдущие молчат hedge_after секунд или все уже завершились ошибкой"""
+    pending = list(providers if providers is not None else configured_providers())
+    if not pending:
+        raise LLMError('No LLM provider configured')
+
+    condition = threading.Condition()
+    attempts: List[Attempt] = []
+    started = time.monotonic()
+    deadline = started + total_timeout
+
+    def launch() -> None:
+        attempt = Attempt(pending.pop(0), condition)
+        attempts.append(attempt)
+        _executor.submit(attempt.run, messages, max_tokens)
+
+    with condition:
+        launch()
+        next_hedge = time.monotonic() + hedge_after
+        winner: Optional[Attempt] = None
+        while winner is None:
+            winner = next((attempt for attempt in attempts if attempt.deltas), None)
+            if winner is not None:
+                break
+            now = time.monotonic()
+            running = any(not attempt.finished for attempt in attempts)
+            if pending and (not running or now >= next_hedge):
+                launch()
+                next_hedge = now + hedge_after
+                continue
+            if not running or now >= deadline:
+                break
+            condition.wait((min(next_hedge, deadline) if pending else deadline) - now)
+
+        for attempt in attempts:
+            if attempt is not winner:
+                attempt.cancelled.set()
+        if winner is None:
+            errors = '; '.join(str(attempt.error) for attempt in attempts if attempt.error)
+            raise LLMError(errors or 'LLM providers did not answer in time')
+
+        while not winner.finished and time.monotonic() < deadline:
+            condition.wait(deadline - time.monotonic())
+        # По истечении общего времени отдаётся то, что успело прийти, с complete=False
+        complete = winner.finished and winner.complete
+        winner.cancelled.set()
+        deltas = list(winner.deltas)
+
+    return Generation(''.join(deltas), deltas, winner.provider.name, winner.provider.model,
+                      winner is not attempts[0], winner.first_token_at - started, complete)
+
+def sse_body(deltas: List[str], final: Dict[str, Any], dumps=json.dumps) -> str:
+    """Тело text/event-stream: событие на каждый кусок текста и итоговое событие
+    с метаданными ответа"""
+    events = [f"data: {dumps({'delta': delta})}\n\n" for delta in deltas]
+    events.append(f"data: {dumps({'done': True, **final})}\n\n")
+    events.append("data: [DONE]\n\n")
+    return ''.join(events)
@@ -0,0 +1,113 @@
+'''
+Дневная квота сообщений и опыт (XP) пользователей в user_stats. Проверка
+лимита, ленивый сброс счётчика в новый день и начисление XP делаются одним
+UPDATE ... RETURNING: строка блокируется на время обновления, а конкурирующий
+UPDATE после снятия блокировки перепроверяет WHERE на свежей версии строки,
+поэтому параллельные запросы одного пользователя не превышают лимит.
+Анонимные запросы может ограничивать token bucket в памяти экземпляра, без БД;
+он включается заданием ANON_RATE_PER_MINUTE.
+'''
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+XP_PER_MESSAGE = int(os.environ.get('XP_PER_MESSAGE', '10'))
+XP_PER_LEVEL = int(os.environ.get('XP_PER_LEVEL', '100'))
+# По умолчанию 0: ограничение анонимных запросов выключено
+ANON_RATE_PER_MINUTE = float(os.environ.get('ANON_RATE_PER_MINUTE', '0'))
+ANON_BURST = int(os.environ.get('ANON_BURST', '10'))
+ANON_BUCKETS_MAX = 10000
+
+class Quota(NamedTuple):
+    allowed: bool
+    messages_today: int
+    daily_limit: int
+    experience_points: int
+    level: int
+    retry_after: int
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'messagesToday': self.messages_today,
+            'dailyLimit': self.daily_limit,
+            'remaining': max(0, self.daily_limit - self.messages_today),
+            'experiencePoints': self.experience_points,
+            'level': self.level
+        }
+
+_CONSUME = """WITH updated AS (
+      UPDATE user_stats SET
+        messages_today = CASE WHEN last_reset_date IS DISTINCT FROM CURRENT_DATE THEN 1
+                              ELSE COALESCE(messages_today, 0) + 1 END,
+        last_reset_date = CURRENT_DATE,
+        messages_sent = COALESCE(messages_sent, 0) + 1,
+        experience_points = COALESCE(experience_points, 0) + %(xp)s,
+        level = 1 + (COALESCE(experience_points, 0) + %(xp)s) / %(per_level)s,
+        updated_at = CURRENT_TIMESTAMP
+      WHERE user_id = %(user_id)s
+        AND (last_reset_date IS DISTINCT FROM CURRENT_DATE
+             OR COALESCE(messages_today, 0) < COALESCE(daily_limit, 10))
+      RETURNING messages_today, daily_limit, experience_points, level
+    )
+    SELECT true, messages_today, daily_limit, experience_points, level, 0 FROM updated
+    UNION ALL
+    SELECT false, messages_today, daily_limit, experience_points, level,
+           CEIL(EXTRACT(EPOCH FROM (CURRENT_DATE + 1) - LOCALTIMESTAMP))::int
+    FROM user_stats
+    WHERE user_id = %(user_id)s AND NOT EXISTS (SELECT 1 FROM updated)"""
+
+def consume_message(cursor, user_id: int) -> Optional[Quota]:
+    """Списать одно сообщение из дневной квоты и начислить XP, если лимит не исчерпан.
+    Счётчик за прошлые дни сбрасывается тем же UPDATE. None - пользователя нет"""
+    with cursor.connection.cursor() as quota_cursor:
+        params = {'user_id': user_id, 'xp': XP_PER_MESSAGE, 'per_level': XP_PER_LEVEL}
+        quota_cursor.execute(_CONSUME, params)
+        row = quota_cursor.fetchone()
+        if row is None:
+            # Пользователи, зарегистрированные до user_stats, получают строку при первом сообщении
+            quota_cursor.execute(
+                "INSERT INTO user_stats (user_id) SELECT id FROM users WHERE id = %s ON CONFLICT (user_id) DO NOTHING",
+                (user_id,)
+            )
+            quota_cursor.execute(_CONSUME, params)
+            row = quota_cursor.fetchone()
+    if row is None:
+        return None
+    allowed, messages_today, daily_limit, experience_points, level, retry_after = row
+    return Quota(allowed, messages_today or 0, daily_limit or 0, experience_points or 0, level or 1,
+                 max(1, retry_after) if not allowed else 0)
+
+class TokenBucket:
+    """Token bucket на клиента: ANON_BURST запросов сразу, дальше ANON_RATE_PER_MINUTE.
+    Хранит не больше ANON_BUCKETS_MAX клиентов, давно не приходившие вытесняются"""
+
+    def __init__(self, rate_per_minute: float = ANON_RATE_PER_MINUTE, burst: int = ANON_BURST,
+                 max_clients: int = ANON_BUCKETS_MAX):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: 'OrderedDict[str, Tuple[float, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def take(self, client: str, now: float = None) -> Tuple[bool, int]:
+        """(разрешено, через сколько секунд появится следующий токен)"""
+        if not self.enabled:
+            return True, 0
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (float(self.burst), now))
+            tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1.0
+            if allowed:
+                tokens -= 1.0
+            self._buckets[client] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return allowed, 0 if allowed else max(1, math.ceil((1.0 - tokens) / self.rate))
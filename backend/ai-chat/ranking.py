@@ -0,0 +1,110 @@
+'''
+BM25F ranking of indexed chunks. Every chunk is a document with two fields:
+its own text and the description of its file. Document frequencies and
+corpus statistics are precomputed at upload time, so scoring a query
+costs a few dictionary lookups per term and posting.
+'''
+import math
+from typing import Dict, Hashable, List, Tuple, Iterable, NamedTuple
+from text_index import split_lines, tokenize
+
+K1 = 1.2
+B_TEXT = 0.75
+B_DESC = 0.5
+W_TEXT = 1.0
+W_DESC = 2.0
+# Reciprocal rank fusion constant for hybrid keyword + vector ranking
+RRF_K = 60
+
+DocKey = Tuple[int, int]
+
+class Posting(NamedTuple):
+    term: str
+    file_id: int
+    chunk_no: int
+    tf: int
+    term_count: int
+
+class CorpusStats(NamedTuple):
+    doc_count: int
+    total_terms: int
+    desc_count: int
+    desc_terms: int
+
+    @property
+    def avg_length(self) -> float:
+        return self.total_terms / self.doc_count if self.doc_count else 1.0
+
+    @property
+    def avg_desc_length(self) -> float:
+        return self.desc_terms / self.desc_count if self.desc_count else 1.0
+
+def idf(doc_freq: int, doc_count: int) -> float:
+    return math.log(1.0 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+
+def term_idfs(doc_freq: Dict[str, int], stats: CorpusStats) -> Dict[str, float]:
+    return {term: idf(df, max(stats.doc_count, df)) for term, df in doc_freq.items()}
+
+def _normalized_tf(tf: int, length: int, avg_length: float, b: float) -> float:
+    return tf / (1.0 - b + b * length / max(avg_length, 1.0))
+
+def bm25f_scores(postings: Iterable[Posting], doc_freq: Dict[str, int], stats: CorpusStats) -> Dict[DocKey, float]:
+    """Score every chunk that contains at least one query term.
+    Chunk 0 of a file is its description: it is ranked as a document of its
+    own and also acts as the description field of the other chunks of the file"""
+    text_tf: Dict[DocKey, Dict[str, float]] = {}
+    desc_tf: Dict[int, Dict[str, float]] = {}
+
+    for posting in postings:
+        key = (posting.file_id, posting.chunk_no)
+        text_tf.setdefault(key, {})[posting.term] = _normalized_tf(
+            posting.tf, posting.term_count, stats.avg_length, B_TEXT
+        )
+        if posting.chunk_no == 0:
+            desc_tf.setdefault(posting.file_id, {})[posting.term] = _normalized_tf(
+                posting.tf, posting.term_count, stats.avg_desc_length, B_DESC
+            )
+
+    term_idf = term_idfs(doc_freq, stats)
+
+    scores: Dict[DocKey, float] = {}
+    for key, chunk_tf in text_tf.items():
+        file_desc = desc_tf.get(key[0], {}) if key[1] != 0 else {}
+        score = 0.0
+        for term in chunk_tf.keys() | file_desc.keys():
+            weight = W_TEXT * chunk_tf.get(term, 0.0) + W_DESC * file_desc.get(term, 0.0)
+            score += term_idf.get(term, 0.0) * weight * (K1 + 1.0) / (K1 + weight)
+        scores[key] = score
+    return scores
+
+def top_documents(scores: Dict[DocKey, float], limit: int) -> List[DocKey]:
+    """Best scored chunks; ties go to newer files and earlier chunks"""
+    return sorted(scores, key=lambda key: (-scores[key], -key[0], key[1]))[:limit]
+
+def best_lines(chunks: List[str], term_idf: Dict[str, float], limit: int) -> List[str]:
+    """Lines of the ranked chunks that carry the most query weight.
+    Overlapping chunks repeat lines, so each line is taken once; ties keep
+    chunk rank and line order"""
+    scored = []
+    seen = set()
+    for rank, content in enumerate(chunks):
+        for position, line in enumerate(split_lines(content)):
+            if line in seen:
+                continue
+            seen.add(line)
+            weight = sum(term_idf[term] for term in set(tokenize(line)) if term in term_idf)
+            if weight > 0:
+                scored.append((-weight, rank, position, line))
+    scored.sort()
+    return [item[3] for item in scored[:limit]]
+
+def fuse_rankings(rankings: List[List[Hashable]], k: int = RRF_K) -> List[Hashable]:
+    """Reciprocal rank fusion of several best-first rankings.
+    Scores from different rankers are not comparable, ranks are; a single
+    ranking comes back unchanged, ties keep the order of first appearance"""
+    fused: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank + 1)
+    order = {item: position for position, item in enumerate(fused)}
+    return sorted(fused, key=lambda item: (-fused[item], order[item]))
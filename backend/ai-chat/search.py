@@ -0,0 +1,101 @@
+'''
+Линейный поиск по базе знаний для файлов, которые ещё не проиндексированы.
+Всё, что зависит только от вопроса и описаний, считается один раз в плане
+запроса; строки-кандидаты находятся поиском слов по всей базе сразу.
+'''
+import re
+from bisect import bisect_right
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple, Optional
+
+MAX_ANSWER_LINES = 7
+NOT_FOUND_ANSWER = "К сожалению, я не нашёл информацию по вашему вопросу в загруженных документах."
+
+class PreparedKnowledgeBase(NamedTuple):
+    """База, разобранная один раз: строки, текст в нижнем регистре и позиции переводов строк"""
+    sentences: List[str]
+    lower: str
+    newlines: List[int]
+
+def prepare_knowledge_base(knowledge_base: str) -> PreparedKnowledgeBase:
+    lower = knowledge_base.lower()
+    return PreparedKnowledgeBase(
+        knowledge_base.split('\n'), lower, [m.start() for m in re.finditer('\n', lower)]
+    )
+
+def build_query_plan(question: str, descriptions: list) -> Dict[str, Any]:
+    """Ключевые слова с кратностью и бонус за совпадение с описаниями"""
+    # Слово из одних '?.,!' становится пустой строкой и, как и раньше, совпадает с любой строкой
+    words: List[str] = [w.strip('?.,!') for w in question.lower().split() if len(w) > 3]
+    desc_matches = [desc for desc in descriptions if desc and any(word in desc.lower() for word in words)]
+
+    return {
+        # Повторённое в вопросе слово весит столько раз, сколько встретилось
+        'weights': Counter(words),
+        'desc_matches': desc_matches,
+        # Бонус не зависит от строки: +2 за каждое совпавшее описание
+        'desc_bonus': 2 * len(desc_matches)
+    }
+
+def match_lines(knowledge_base_lower: str, weights: Dict[str, int],
+                newlines: Optional[List[int]] = None) -> Dict[int, int]:
+    """Номер строки -> сумма весов слов, встретившихся в ней.
+    Каждое слово ищется по всей базе через str.find, поэтому работа
+    пропорциональна числу совпадений, а не числу строк"""
+    if newlines is None:
+        newlines = [m.start() for m in re.finditer('\n', knowledge_base_lower)]
+    end = len(knowledge_base_lower)
+    scores: Dict[int, int] = {}
+    for word, weight in weights.items():
+        if not word:
+            # Пустая строка входит в каждую строку базы; find по ней не продвигается в конце текста
+            for line_no in range(len(newlines) + 1):
+                scores[line_no] = scores.get(line_no, 0) + weight
+            continue
+        pos = knowledge_base_lower.find(word)
+        while pos != -1:
+            line_no = bisect_right(newlines, pos)
+            scores[line_no] = scores.get(line_no, 0) + weight
+            next_line = newlines[line_no] + 1 if line_no < len(newlines) else end
+            pos = knowledge_base_lower.find(word, next_line)
+    return scores
+
+def simple_search_answer(question: str, knowledge_base: str, descriptions: list) -> str:
+    """Улучшенный поиск по ключевым словам с учетом описаний файлов"""
+    return prepared_search_answer(question, prepare_knowledge_base(knowledge_base), descriptions)
+
+def prepared_search_answer(question: str, prepared: PreparedKnowledgeBase, descriptions: list) -> str:
+    """Тот же поиск по заранее разобранной базе: тёплый экземпляр разбирает её
+    только при изменении файлов"""
+    plan = build_query_plan(question, descriptions)
+    desc_bonus = plan['desc_bonus']
+    sentences = prepared.sentences
+
+    # Регистр понижается один раз для всей базы, а не для каждой строки
+    matched = match_lines(prepared.lower, plan['weights'], prepared.newlines)
+
+    # Сортировка устойчива: при равном весе сохраняется порядок в документе
+    relevant = []
+    for line_no in sorted(matched):
+        stripped = sentences[line_no].strip()
+        if len(stripped) >= 10:
+            relevant.append((matched[line_no] + desc_bonus, stripped))
+    relevant.sort(reverse=True, key=lambda x: x[0])
+    answer_parts = [s[1] for s in relevant[:MAX_ANSWER_LINES]]
+
+    # Строки без слов запроса получают только бонус и идут следом по порядку
+    if desc_bonus:
+        for line_no, sentence in enumerate(sentences):
+            if len(answer_parts) >= MAX_ANSWER_LINES:
+                break
+            stripped = sentence.strip()
+            if line_no not in matched and len(stripped) >= 10:
+                answer_parts.append(stripped)
+
+    if not answer_parts:
+        # Попробуем найти в описаниях
+        if plan['desc_matches']:
+            return "Информация по вашему запросу:\n\n" + "\n\n".join(plan['desc_matches'])
+        return NOT_FOUND_ANSWER
+
+    return "\n\n".join(answer_parts)
@@ -0,0 +1,93 @@
+'''
+Семантический поиск по эмбеддингам фрагментов (embedding.py), которые
+file-upload сохраняет в document_chunks.embedding как int8. Матрица
+эмбеддингов загружается один раз на версию корпуса и держится в тёплом
+экземпляре; сходство считается одним матричным умножением NumPy, а без
+NumPy - построчно на чистом Python.
+'''
+import threading
+from array import array
+from typing import List, Optional, Tuple
+from embedding import EMBEDDING_DIM, EMBEDDING_SCALE, embed, cosine
+from text_index import split_lines
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MIN_CHUNK_SIMILARITY = 0.15
+MIN_LINE_SIMILARITY = 0.15
+
+DocKey = Tuple[int, int]
+
+class EmbeddingIndex:
+    def __init__(self, keys: List[DocKey], blobs: List[bytes]):
+        self.keys = keys
+        if np is not None:
+            matrix = np.frombuffer(b''.join(blobs), dtype=np.int8).reshape(len(blobs), EMBEDDING_DIM)
+            self.matrix = matrix.astype(np.float32) / EMBEDDING_SCALE
+            self.rows = None
+        else:
+            self.matrix = None
+            self.rows = [[x / EMBEDDING_SCALE for x in array('b', blob)] for blob in blobs]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def search(self, query: List[float], min_similarity: float = MIN_CHUNK_SIMILARITY) -> List[Tuple[DocKey, float]]:
+        """Фрагменты со сходством не ниже порога, лучшие первыми"""
+        if not self.keys:
+            return []
+        if self.matrix is not None:
+            similarities = self.matrix @ np.asarray(query, dtype=np.float32)
+            candidates = np.flatnonzero(similarities >= min_similarity)
+            hits = [(self.keys[i], float(similarities[i])) for i in candidates]
+        else:
+            hits = []
+            for key, row in zip(self.keys, self.rows):
+                similarity = cosine(row, query)
+                if similarity >= min_similarity:
+                    hits.append((key, similarity))
+        # При равном сходстве выше новые файлы и ранние фрагменты, как в BM25F
+        hits.sort(key=lambda hit: (-hit[1], -hit[0][0], hit[0][1]))
+        return hits
+
+_cache_lock = threading.Lock()
+_cached_version: Optional[int] = None
+_cached_index: Optional[EmbeddingIndex] = None
+
+def load_embedding_index(cursor, version: int) -> EmbeddingIndex:
+    """Матрица эмбеддингов для версии корпуса; перечитывается только после её смены"""
+    global _cached_version, _cached_index
+    with _cache_lock:
+        if _cached_index is not None and _cached_version == version:
+            return _cached_index
+        cursor.execute(
+            """SELECT file_id, chunk_no, embedding FROM document_chunks
+               WHERE embedding IS NOT NULL AND octet_length(embedding) = %s
+               ORDER BY file_id, chunk_no""",
+            (EMBEDDING_DIM,)
+        )
+        rows = cursor.fetchall()
+        _cached_index = EmbeddingIndex(
+            [(row['file_id'], row['chunk_no']) for row in rows],
+            [bytes(row['embedding']) for row in rows]
+        )
+        _cached_version = version
+        return _cached_index
+
+def semantic_lines(chunks: List[str], query: List[float], limit: int) -> List[str]:
+    """Строки найденных фрагментов, ближайшие к вопросу по смыслу"""
+    scored = []
+    seen = set()
+    for rank, content in enumerate(chunks):
+        for position, line in enumerate(split_lines(content)):
+            if line in seen:
+                continue
+            seen.add(line)
+            similarity = cosine(embed(line), query)
+            if similarity >= MIN_LINE_SIMILARITY:
+                scored.append((-similarity, rank, position, line))
+    scored.sort()
+    return [item[3] for item in scored[:limit]]
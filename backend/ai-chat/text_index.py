@@ -0,0 +1,220 @@
+'''
+Tokenization for the inverted index over uploaded files.
+file-upload builds postings with it, ai-chat tokenizes questions with it:
+both copies of this module must stay identical.
+'''
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+WORD_RE = re.compile(r'\w+')
+MIN_WORD_LENGTH = 3
+MAX_TERM_LENGTH = 100
+MIN_LINE_LENGTH = 10
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 200
+
+STOP_WORDS = frozenset('''
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по
+только ее её мне было вот от меня еще ещё нет о из ему теперь когда даже ну вдруг ли
+если уже или ни быть был него до вас нибудь опять уж вам ведь там потом себя ничего
+ей может они тут где есть надо ней для мы тебя их чем была сам чтоб без будто чего
+раз тоже себе под будет ж тогда кто этот того потому этого какой совсем ним здесь
+этом один почти мой тем чтобы нее неё сейчас были куда зачем всех никогда можно при
+наконец два об другой хоть после над больше тот через эти нас про всего них какая
+много разве три эту моя впрочем хорошо свою этой перед иногда лучше чуть том нельзя
+такой им более всегда конечно всю между это как какие каков какова каково
+the a an and or but if of to in on at by for with from as is are was were be been
+being it its this that these those what which who whom how why when where do does
+did have has had not no can could will would should i you he she we they me my your
+our their there here about into than then so also just
+'''.split())
+
+_RU_VOWELS = 'аеиоуыэюя'
+
+_RU_PERFECTIVE_GERUND_1 = ('вшись', 'вши', 'в')
+_RU_PERFECTIVE_GERUND_2 = ('ившись', 'ывшись', 'ивши', 'ывши', 'ив', 'ыв')
+_RU_REFLEXIVE = ('ся', 'сь')
+_RU_ADJECTIVE = (
+    'ими', 'ыми', 'его', 'ого', 'ему', 'ому', 'ее', 'ие', 'ые', 'ое', 'ей', 'ий', 'ый',
+    'ой', 'ем', 'им', 'ым', 'ом', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею'
+)
+_RU_PARTICIPLE_1 = ('ем', 'нн', 'вш', 'ющ', 'щ')
+_RU_PARTICIPLE_2 = ('ивш', 'ывш', 'ующ')
+_RU_VERB_1 = ('ете', 'йте', 'ешь', 'нно', 'ла', 'на', 'ли', 'ем', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'й', 'л', 'н')
+_RU_VERB_2 = (
+    'ейте', 'уйте', 'ила', 'ыла', 'ена', 'ите', 'или', 'ыли', 'ило', 'ыло', 'ено', 'ует',
+    'уют', 'ены', 'ить', 'ыть', 'ишь', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ят', 'ит',
+    'ыт', 'ую', 'ю'
+)
+_RU_NOUN = (
+    'иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ев', 'ов', 'ие', 'ье', 'еи', 'ии',
+    'ей', 'ой', 'ий', 'ям', 'ем', 'ам', 'ом', 'ах', 'ях', 'ию', 'ью', 'ия', 'ья',
+    'а', 'е', 'и', 'й', 'о', 'у', 'ы', 'ь', 'ю', 'я'
+)
+_RU_SUPERLATIVE = ('ейше', 'ейш')
+_RU_DERIVATIONAL = ('ость', 'ост')
+
+_EN_SUFFIXES = (('sses', 'ss'), ('ies', 'y'), ('ing', ''), ('ed', ''), ('ly', ''), ('es', ''), ('s', ''))
+
+def _longest_suffix(word: str, suffixes: Tuple[str, ...]) -> str:
+    for suffix in sorted(suffixes, key=len, reverse=True):
+        if word.endswith(suffix):
+            return suffix
+    return ''
+
+def _strip_after_a(word: str, suffixes_1: Tuple[str, ...], suffixes_2: Tuple[str, ...]) -> str:
+    """Remove a suffix; group-1 suffixes only count after 'а' or 'я'"""
+    for suffix in sorted(suffixes_1 + suffixes_2, key=len, reverse=True):
+        if not word.endswith(suffix):
+            continue
+        if suffix in suffixes_2:
+            return word[:-len(suffix)]
+        if len(word) > len(suffix) and word[-len(suffix) - 1] in 'ая':
+            return word[:-len(suffix)]
+    return word
+
+def _region_start(word: str, start: int) -> int:
+    """Start of the region after the first non-vowel following a vowel"""
+    for i in range(start, len(word) - 1):
+        if word[i] in _RU_VOWELS and word[i + 1] not in _RU_VOWELS:
+            return i + 2
+    return len(word)
+
+def stem_russian(word: str) -> str:
+    """Snowball-style Russian stemmer"""
+    word = word.replace('ё', 'е')
+    rv_start = next((i + 1 for i, ch in enumerate(word) if ch in _RU_VOWELS), len(word))
+    r2_start = _region_start(word, _region_start(word, 0))
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Step 1
+    stripped = _strip_after_a(rv, _RU_PERFECTIVE_GERUND_1, _RU_PERFECTIVE_GERUND_2)
+    if stripped != rv:
+        rv = stripped
+    else:
+        suffix = _longest_suffix(rv, _RU_REFLEXIVE)
+        rv = rv[:-len(suffix)] if suffix else rv
+        suffix = _longest_suffix(rv, _RU_ADJECTIVE)
+        if suffix:
+            rv = _strip_after_a(rv[:-len(suffix)], _RU_PARTICIPLE_1, _RU_PARTICIPLE_2)
+        else:
+            stripped = _strip_after_a(rv, _RU_VERB_1, _RU_VERB_2)
+            if stripped != rv:
+                rv = stripped
+            else:
+                suffix = _longest_suffix(rv, _RU_NOUN)
+                rv = rv[:-len(suffix)] if suffix else rv
+
+    # Step 2
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    # Step 3
+    suffix = _longest_suffix(rv, _RU_DERIVATIONAL)
+    if suffix and rv_start + len(rv) - len(suffix) >= r2_start:
+        rv = rv[:-len(suffix)]
+
+    # Step 4
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    else:
+        suffix = _longest_suffix(rv, _RU_SUPERLATIVE)
+        if suffix:
+            rv = rv[:-len(suffix)]
+            if rv.endswith('нн'):
+                rv = rv[:-1]
+        elif rv.endswith('ь'):
+            rv = rv[:-1]
+
+    return prefix + rv
+
+def stem_english(word: str) -> str:
+    """Light suffix-stripping English stemmer"""
+    for suffix, replacement in _EN_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            if suffix == 's' and word.endswith('ss'):
+                return word
+            return word[:-len(suffix)] + replacement
+    return word
+
+def stem(word: str) -> str:
+    if any('а' <= ch <= 'я' or ch == 'ё' for ch in word):
+        return stem_russian(word)
+    if word.isascii() and word.isalpha():
+        return stem_english(word)
+    return word
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase stemmed index terms without stop words"""
+    return [
+        stem(word)[:MAX_TERM_LENGTH] for word in WORD_RE.findall(text.lower())
+        if len(word) >= MIN_WORD_LENGTH and word not in STOP_WORDS
+    ]
+
+def query_terms(question: str) -> List[str]:
+    """Unique terms of a question in their original order"""
+    return list(dict.fromkeys(tokenize(question)))
+
+def split_lines(text: str) -> List[str]:
+    """Lines worth indexing: stripped and long enough to be an answer"""
+    return [line.strip() for line in text.split('\n') if len(line.strip()) >= MIN_LINE_LENGTH]
+
+def _snap_back(text: str, start: int, end: int) -> int:
+    """Last line break, else last space, in text[start:end]; end if there is none"""
+    for separator in ('\n', ' '):
+        cut = text.rfind(separator, start, end)
+        if cut != -1:
+            return cut
+    return end
+
+def _snap_forward(text: str, start: int, end: int) -> int:
+    """First line break, else first space, in text[start:end]; -1 if there is none"""
+    for separator in ('\n', ' '):
+        cut = text.find(separator, start, end)
+        if cut != -1:
+            return cut
+    return -1
+
+def chunk_text(text: str) -> List[str]:
+    """Fixed-size chunks of CHUNK_SIZE characters overlapping by CHUNK_OVERLAP.
+    Boundaries move back to a line break or a space so words stay whole"""
+    text = text.strip()
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + CHUNK_SIZE, len(text))
+        if end < len(text):
+            end = _snap_back(text, start + CHUNK_SIZE // 2, end)
+        chunk = text[start:end].strip()
+        if len(chunk) >= MIN_LINE_LENGTH:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        overlap_start = max(end - CHUNK_OVERLAP, start + 1)
+        boundary = _snap_forward(text, overlap_start, end)
+        start = boundary + 1 if boundary != -1 else overlap_start
+    return chunks
+
+def analyze_chunks(chunks: Dict[int, str]) -> Tuple[Dict[int, int], List[Tuple[str, int, int]], Dict[str, int]]:
+    """Index data of one file whose chunk 0 is the description.
+    Returns term count per chunk, (term, chunk_no, tf) postings and
+    per-term document frequency contribution: a description term counts
+    for every chunk of the file, since the description is a field of each chunk"""
+    term_counts = {}
+    postings = []
+    chunk_terms: Dict[int, Counter] = {}
+    for chunk_no, chunk in chunks.items():
+        counts = Counter(tokenize(chunk))
+        chunk_terms[chunk_no] = counts
+        term_counts[chunk_no] = sum(counts.values())
+        postings.extend((term, chunk_no, tf) for term, tf in counts.items())
+
+    desc_terms = set(chunk_terms.get(0, ()))
+    doc_freq = Counter()
+    for counts in chunk_terms.values():
+        doc_freq.update(term for term in counts if term not in desc_terms)
+    for term in desc_terms:
+        doc_freq[term] = len(chunks)
+
+    return term_counts, postings, dict(doc_freq)
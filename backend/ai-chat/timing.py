@@ -0,0 +1,107 @@
+'''
+Per-request stage timings, switched on with REQUEST_TIMING=1. A handler
+wrapped in instrument() gets a timer for the duration of the request: code
+anywhere below it marks stages with `with stage('search'):` and adds rows or
+bytes read with count(). The response carries a Server-Timing header and one
+JSON line per request is printed to the function log (request_id from the
+context, stage durations, counters, status).
+When timing is off instrument() returns the handler unchanged and stage()
+returns a shared no-op context manager, so instrumented code pays one global
+lookup per stage. Every backend function ships an identical copy of this
+module: keep the copies in sync.
+'''
+import functools
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional
+
+TIMING_ENABLED = os.environ.get('REQUEST_TIMING', '').lower() in ('1', 'true', 'yes', 'on')
+
+_NO_STAGE = nullcontext()
+
+class RequestTimer:
+    def __init__(self, function: str, request_id: Optional[str]):
+        self.function = function
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            # A stage entered several times (one query per file, ...) accumulates
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - started
+
+    def count(self, name: str, value: int) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def server_timing(self, total: float) -> str:
+        entries = [f"{name};dur={seconds * 1e3:.2f}" for name, seconds in self.stages.items()]
+        entries.append(f"total;dur={total * 1e3:.2f}")
+        return ', '.join(entries)
+
+    def log(self, status: Any, total: float) -> None:
+        print(json.dumps({
+            'type': 'request_timing',
+            'function': self.function,
+            'request_id': self.request_id,
+            'status': status,
+            'total_ms': round(total * 1e3, 2),
+            'stages_ms': {name: round(seconds * 1e3, 2) for name, seconds in self.stages.items()},
+            'counters': self.counters
+        }, ensure_ascii=False), file=sys.stdout, flush=True)
+
+    def finish(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        total = time.perf_counter() - self.started
+        headers = dict(response.get('headers') or {})
+        headers['Server-Timing'] = self.server_timing(total)
+        # Without it browsers hide Server-Timing of cross-origin responses
+        headers['Timing-Allow-Origin'] = '*'
+        response = {**response, 'headers': headers}
+        self.log(response.get('statusCode'), total)
+        return response
+
+_current: ContextVar[Optional[RequestTimer]] = ContextVar('request_timer', default=None)
+
+def stage(name: str):
+    """Context manager timing a stage of the current request"""
+    if not TIMING_ENABLED:
+        return _NO_STAGE
+    timer = _current.get()
+    return timer.stage(name) if timer is not None else _NO_STAGE
+
+def count(name: str, value: int = 1) -> None:
+    """Add to a counter of the current request: rows, bytes read, ..."""
+    if TIMING_ENABLED:
+        timer = _current.get()
+        if timer is not None:
+            timer.count(name, value)
+
+def instrument(function: str) -> Callable:
+    """Decorator for a handler: times the request and reports it when REQUEST_TIMING is on"""
+    def decorate(handler: Callable[[Dict[str, Any], Any], Dict[str, Any]]) -> Callable:
+        if not TIMING_ENABLED:
+            return handler
+
+        @functools.wraps(handler)
+        def timed_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            timer = RequestTimer(function, getattr(context, 'request_id', None))
+            token = _current.set(timer)
+            try:
+                response = handler(event, context)
+            except BaseException:
+                timer.log('exception', time.perf_counter() - timer.started)
+                raise
+            finally:
+                _current.reset(token)
+            return timer.finish(response)
+        return timed_handler
+    return decorate
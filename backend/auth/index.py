@@ -3,32 +3,26 @@ Business: User authentication and authorization system
 Args: event - dict with httpMethod, body, headers, queryStringParameters
       context - object with attributes: request_id, function_name
 Returns: HTTP response with JWT tokens or error messages
+Requires DATABASE_URL and AUTH_SECRET (shared with ai-chat, which verifies the tokens)
 '''
 
 import json
 import os
-import hashlib
 import secrets
 import re
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional, Tuple
-import psycopg2
 from psycopg2.extras import RealDictCursor
+from db import connection
+from timing import instrument, stage
+from responses import json_response, negotiated, preflight
+from passwords import hash_password, verify_password, needs_rehash, burn_verification
+from tokens import ACCESS_TOKEN_TTL_SECONDS, AUTH_SECRET, RevokedTokens, issue_access_token, verify_access_token
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
+SESSION_TTL_DAYS = 30
 
-def hash_password(password: str) -> str:
-    salt = secrets.token_hex(16)
-    pwd_hash = hashlib.sha256((password + salt).encode()).hexdigest()
-    return f"{salt}${pwd_hash}"
-
-def verify_password(password: str, stored_hash: str) -> bool:
-    try:
-        salt, pwd_hash = stored_hash.split('$')
-        computed_hash = hashlib.sha256((password + salt).encode()).hexdigest()
-        return computed_hash == pwd_hash
-    except:
-        return False
+revoked_refresh_tokens = RevokedTokens()
 
 def generate_token(length: int = 32) -> str:
     return secrets.token_urlsafe(length)
@@ -52,219 +46,283 @@ def validate_password(password: str) -> Tuple[bool, str]:
         return False, "Пароль должен содержать цифры"
     return True, ""
 
-def create_user(conn, email: str, username: str, password: str, full_name: Optional[str] = None) -> Dict[str, Any]:
+def create_user(conn, email: str, username: str, password: str, full_name: Optional[str],
+                device_info: str, ip_address: str) -> Dict[str, Any]:
+    """Register a user with stats and a first session in one statement.
+    The unique constraints on email and username decide duplicates, so two
+    concurrent registrations cannot both pass a check-then-insert"""
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
-    cursor.execute("SELECT id FROM users WHERE email = %s OR username = %s", (email, username))
-    if cursor.fetchone():
-        return {'error': 'Пользователь с таким email или username уже существует'}
-    
-    password_hash = hash_password(password)
+    with stage('kdf'):
+        password_hash = hash_password(password)
     verification_token = generate_token()
+    refresh_token = generate_token(48)
     
-    cursor.execute(
-        """INSERT INTO users (email, username, password_hash, full_name, verification_token) 
-           VALUES (%s, %s, %s, %s, %s) RETURNING id, email, username, full_name, created_at""",
-        (email, username, password_hash, full_name, verification_token)
-    )
-    user = dict(cursor.fetchone())
-    user_id = user['id']
+    with stage('query'):
+        cursor.execute(
+            """WITH new_user AS (
+                 INSERT INTO users (email, username, password_hash, full_name, verification_token)
+                 VALUES (%s, %s, %s, %s, %s)
+                 ON CONFLICT DO NOTHING
+                 RETURNING id, email, username, full_name, subscription_tier, created_at
+               ), new_stats AS (
+                 INSERT INTO user_stats (user_id) SELECT id FROM new_user
+               ), new_session AS (
+                 INSERT INTO user_sessions (user_id, refresh_token, device_info, ip_address, expires_at)
+                 SELECT id, %s, %s, %s, %s FROM new_user
+               )
+               SELECT id, email, username, full_name, subscription_tier, created_at FROM new_user""",
+            (email, username, password_hash, full_name, verification_token,
+             refresh_token, device_info, ip_address, datetime.now() + timedelta(days=SESSION_TTL_DAYS))
+        )
+        row = cursor.fetchone()
+        conn.commit()
     
-    cursor.execute(
-        "INSERT INTO user_stats (user_id) VALUES (%s)",
-        (user_id,)
-    )
+    if not row:
+        return {'error': 'Пользователь с таким email или username уже существует'}
     
-    conn.commit()
-    return user
+    user = dict(row)
+    user['created_at'] = user['created_at'].isoformat() if user['created_at'] else None
+    return {'user': user, 'tokens': session_tokens(user, refresh_token)}
 
 def authenticate_user(conn, login: str, password: str) -> Optional[Dict[str, Any]]:
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
-    cursor.execute(
-        """SELECT id, email, username, password_hash, full_name, avatar_url, 
-                  subscription_tier, is_active, is_verified 
-           FROM users WHERE email = %s OR username = %s""",
-        (login, login)
-    )
-    user = cursor.fetchone()
+    # Two lookups that each use their unique index; an OR across both columns
+    # can fall back to a scan. Usernames cannot contain "@", so at most one side matches
+    with stage('query'):
+        cursor.execute(
+            """SELECT id, email, username, password_hash, full_name, avatar_url,
+                      subscription_tier, is_active, is_verified
+               FROM users WHERE email = %s
+               UNION ALL
+               SELECT id, email, username, password_hash, full_name, avatar_url,
+                      subscription_tier, is_active, is_verified
+               FROM users WHERE username = %s
+               LIMIT 1""",
+            (login.lower(), login)
+        )
+        user = cursor.fetchone()
     
     if not user:
+        with stage('kdf'):
+            burn_verification(password)
         return None
     
-    if not verify_password(password, user['password_hash']):
+    with stage('kdf'):
+        verified = verify_password(password, user['password_hash'])
+    if not verified:
         return None
     
     if not user['is_active']:
         return None
     
+    # Legacy SHA-256 hashes and hashes with outdated KDF settings are upgraded
+    # while the plain password is at hand
+    if needs_rehash(user['password_hash']):
+        with stage('rehash'):
+            cursor.execute(
+                "UPDATE users SET password_hash = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+                (hash_password(password), user['id'])
+            )
+            conn.commit()
+    
     user_dict = dict(user)
     del user_dict['password_hash']
     return user_dict
 
-def create_session(conn, user_id: int, device_info: str, ip_address: str) -> Dict[str, str]:
+def session_tokens(user: Dict[str, Any], refresh_token: str) -> Dict[str, Any]:
+    return {
+        'access_token': issue_access_token(user),
+        'refresh_token': refresh_token,
+        'expires_in': ACCESS_TOKEN_TTL_SECONDS
+    }
+
+def create_session(conn, user: Dict[str, Any], device_info: str, ip_address: str) -> Dict[str, str]:
+    """Signed access token (verified without the database) plus a refresh token stored in user_sessions"""
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
-    access_token = generate_token(32)
     refresh_token = generate_token(48)
-    expires_at = datetime.now() + timedelta(days=30)
+    expires_at = datetime.now() + timedelta(days=SESSION_TTL_DAYS)
     
     cursor.execute(
         """INSERT INTO user_sessions (user_id, refresh_token, device_info, ip_address, expires_at)
            VALUES (%s, %s, %s, %s, %s)""",
-        (user_id, refresh_token, device_info, ip_address, expires_at)
+        (user['id'], refresh_token, device_info, ip_address, expires_at)
     )
     
     conn.commit()
     
-    return {
-        'access_token': access_token,
-        'refresh_token': refresh_token,
-        'expires_in': 1800
-    }
+    return session_tokens(user, refresh_token)
 
+def revoke_session(conn, refresh_token: str) -> Optional[Dict[str, Any]]:
+    """Delete a refresh token's session and remember the token as revoked.
+    Returns the session's user and expiry, or None if the token is unknown or expired"""
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    
+    cursor.execute(
+        """DELETE FROM user_sessions WHERE refresh_token = %s
+           RETURNING user_id, expires_at, expires_at > CURRENT_TIMESTAMP AS is_live""",
+        (refresh_token,)
+    )
+    session = cursor.fetchone()
+    conn.commit()
+    
+    if not session:
+        return None
+    revoked_refresh_tokens.add(refresh_token, session['expires_at'].timestamp())
+    return dict(session) if session['is_live'] else None
+
+def refresh_session(conn, refresh_token: str, device_info: str, ip_address: str) -> Optional[Dict[str, Any]]:
+    """Rotate a refresh token: the old one is revoked, a new pair is issued"""
+    if refresh_token in revoked_refresh_tokens:
+        return None
+    
+    session = revoke_session(conn, refresh_token)
+    if not session:
+        return None
+    
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute(
+        """SELECT id, email, username, full_name, avatar_url, subscription_tier, is_active, is_verified
+           FROM users WHERE id = %s""",
+        (session['user_id'],)
+    )
+    user = cursor.fetchone()
+    if not user or not user['is_active']:
+        return None
+    
+    user = dict(user)
+    return {'user': user, 'tokens': create_session(conn, user, device_info, ip_address)}
+
+def get_access_token(event: Dict[str, Any], body: Dict[str, Any]) -> str:
+    """Access token from the body, an Authorization: Bearer header or X-Auth-Token"""
+    headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    authorization = headers.get('authorization') or ''
+    if authorization.lower().startswith('bearer '):
+        return authorization[7:].strip()
+    return body.get('access_token') or headers.get('x-auth-token') or ''
+
+@instrument('auth')
+@negotiated
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+        return preflight('GET, POST, OPTIONS', 'Content-Type, Authorization, X-User-Id, X-Auth-Token')
+    
+    if not AUTH_SECRET:
+        return json_response(500, {'error': 'AUTH_SECRET not configured'})
+    
+    body: Dict[str, Any] = {}
+    if method == 'POST':
+        try:
+            body = json.loads(event.get('body') or '{}')
+        except json.JSONDecodeError:
+            return json_response(400, {'error': 'Invalid JSON body'})
+        if not isinstance(body, dict):
+            return json_response(400, {'error': 'Invalid JSON body'})
+        
+        # Token validation is a signature check only: no database connection is opened
+        if body.get('action') == 'verify':
+            claims = verify_access_token(get_access_token(event, body))
+            if not claims:
+                return json_response(401, {'valid': False, 'error': 'Недействительный или просроченный токен'})
+            return json_response(200, {
+                'valid': True,
+                'user': {'id': claims['sub'], 'username': claims.get('username'), 'subscription_tier': claims.get('tier')},
+                'expires_at': claims['exp']
+            })
     
     if not DATABASE_URL:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'DATABASE_URL not configured'})
-        }
+        return json_response(500, {'error': 'DATABASE_URL not configured'})
     
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        
-        if method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
+        with connection(DATABASE_URL) as conn:
             
-            if action == 'register':
-                email = body.get('email', '').strip().lower()
-                username = body.get('username', '').strip()
-                password = body.get('password', '')
-                full_name = body.get('full_name', '').strip()
-                
-                if not email or not username or not password:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Email, username и password обязательны'})
-                    }
-                
-                if not validate_email(email):
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Неверный формат email'})
-                    }
-                
-                if not validate_username(username):
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Username должен быть 3-30 символов (буквы, цифры, _ и -)'})
-                    }
-                
-                is_valid, error_msg = validate_password(password)
-                if not is_valid:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': error_msg})
-                    }
+            if method == 'POST':
+                action = body.get('action')
                 
-                user = create_user(conn, email, username, password, full_name or None)
-                
-                if 'error' in user:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps(user)
-                    }
-                
-                device_info = event.get('headers', {}).get('user-agent', 'Unknown')
-                ip_address = event.get('requestContext', {}).get('identity', {}).get('sourceIp', 'Unknown')
-                
-                tokens = create_session(conn, user['id'], device_info, ip_address)
-                
-                return {
-                    'statusCode': 201,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'user': user,
-                        'tokens': tokens,
+                if action == 'register':
+                    email = body.get('email', '').strip().lower()
+                    username = body.get('username', '').strip()
+                    password = body.get('password', '')
+                    full_name = body.get('full_name', '').strip()
+                    
+                    if not email or not username or not password:
+                        return json_response(400, {'error': 'Email, username и password обязательны'})
+                    
+                    if not validate_email(email):
+                        return json_response(400, {'error': 'Неверный формат email'})
+                    
+                    if not validate_username(username):
+                        return json_response(400, {'error': 'Username должен быть 3-30 символов (буквы, цифры, _ и -)'})
+                    
+                    is_valid, error_msg = validate_password(password)
+                    if not is_valid:
+                        return json_response(400, {'error': error_msg})
+                    
+                    device_info = event.get('headers', {}).get('user-agent', 'Unknown')
+                    ip_address = event.get('requestContext', {}).get('identity', {}).get('sourceIp', 'Unknown')
+                    
+                    result = create_user(conn, email, username, password, full_name or None, device_info, ip_address)
+                    
+                    if 'error' in result:
+                        return json_response(400, result)
+                    
+                    return json_response(201, {
+                        'user': result['user'],
+                        'tokens': result['tokens'],
                         'message': 'Регистрация успешна!'
                     })
-                }
-            
-            elif action == 'login':
-                login = body.get('login', '').strip()
-                password = body.get('password', '')
-                
-                if not login or not password:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Login и password обязательны'})
-                    }
                 
-                user = authenticate_user(conn, login, password)
-                
-                if not user:
-                    return {
-                        'statusCode': 401,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Неверный логин или пароль'})
-                    }
-                
-                device_info = event.get('headers', {}).get('user-agent', 'Unknown')
-                ip_address = event.get('requestContext', {}).get('identity', {}).get('sourceIp', 'Unknown')
-                
-                tokens = create_session(conn, user['id'], device_info, ip_address)
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
+                elif action == 'login':
+                    login = body.get('login', '').strip()
+                    password = body.get('password', '')
+                    
+                    if not login or not password:
+                        return json_response(400, {'error': 'Login и password обязательны'})
+                    
+                    user = authenticate_user(conn, login, password)
+                    
+                    if not user:
+                        return json_response(401, {'error': 'Неверный логин или пароль'})
+                    
+                    device_info = event.get('headers', {}).get('user-agent', 'Unknown')
+                    ip_address = event.get('requestContext', {}).get('identity', {}).get('sourceIp', 'Unknown')
+                    
+                    tokens = create_session(conn, user, device_info, ip_address)
+                    
+                    return json_response(200, {
                         'user': user,
                         'tokens': tokens,
                         'message': 'Вход выполнен успешно!'
                     })
-                }
+                
+                elif action == 'refresh':
+                    refresh_token = body.get('refresh_token', '')
+                    
+                    device_info = event.get('headers', {}).get('user-agent', 'Unknown')
+                    ip_address = event.get('requestContext', {}).get('identity', {}).get('sourceIp', 'Unknown')
+                    
+                    result = refresh_session(conn, refresh_token, device_info, ip_address) if refresh_token else None
+                    
+                    if not result:
+                        return json_response(401, {'error': 'Сессия недействительна, войдите снова'})
+                    
+                    return json_response(200, result)
+                
+                elif action == 'logout':
+                    refresh_token = body.get('refresh_token', '')
+                    if refresh_token:
+                        revoke_session(conn, refresh_token)
+                    
+                    return json_response(200, {'message': 'Выход выполнен'})
+                
+                else:
+                    return json_response(400, {'error': 'Неизвестное действие'})
             
-            else:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Неизвестное действие'})
-                }
-        
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+            return json_response(405, {'error': 'Method not allowed'})
     
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)})
-        }
-    finally:
-        if 'conn' in locals():
-            conn.close()
+        return json_response(500, {'error': str(e)})
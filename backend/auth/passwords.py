@@ -0,0 +1,73 @@
+'''
+Password hashing with a tunable KDF from hashlib: scrypt where OpenSSL
+provides it, PBKDF2-HMAC-SHA256 otherwise. The parameters are stored inside
+each hash, so they can be raised later: needs_rehash tells the login path to
+re-hash a password it has just verified. Hashes from before this module
+(one round of salted SHA-256, "salt$hex") still verify and are upgraded the
+same way.
+'''
+import hashlib
+import hmac
+import os
+import secrets
+from typing import Optional
+
+PASSWORD_KDF = os.environ.get('PASSWORD_KDF') or ('scrypt' if hasattr(hashlib, 'scrypt') else 'pbkdf2_sha256')
+SCRYPT_N = int(os.environ.get('SCRYPT_N', str(2 ** 14)))
+SCRYPT_R = int(os.environ.get('SCRYPT_R', '8'))
+SCRYPT_P = int(os.environ.get('SCRYPT_P', '1'))
+PBKDF2_ITERATIONS = int(os.environ.get('PBKDF2_ITERATIONS', '600000'))
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    # scrypt needs 128 * n * r bytes; OpenSSL's default cap of 32 MiB would reject larger settings
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r + 1024 * 1024, dklen=KEY_BYTES)
+
+def _pbkdf2(password: str, salt: bytes, iterations: int) -> bytes:
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations, dklen=KEY_BYTES)
+
+def hash_password(password: str) -> str:
+    salt = secrets.token_bytes(SALT_BYTES)
+    if PASSWORD_KDF == 'scrypt':
+        key = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${key.hex()}"
+    key = _pbkdf2(password, salt, PBKDF2_ITERATIONS)
+    return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${salt.hex()}${key.hex()}"
+
+def verify_password(password: str, stored_hash: str) -> bool:
+    """Constant-time check against any supported format; malformed hashes never match"""
+    try:
+        parts = stored_hash.split('$')
+        if parts[0] == 'scrypt' and len(parts) == 6:
+            n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+            expected = bytes.fromhex(parts[5])
+            return hmac.compare_digest(_scrypt(password, bytes.fromhex(parts[4]), n, r, p), expected)
+        if parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+            expected = bytes.fromhex(parts[3])
+            return hmac.compare_digest(_pbkdf2(password, bytes.fromhex(parts[2]), int(parts[1])), expected)
+        if len(parts) == 2:
+            salt, pwd_hash = parts
+            computed_hash = hashlib.sha256((password + salt).encode()).hexdigest()
+            return hmac.compare_digest(computed_hash, pwd_hash)
+    except (ValueError, TypeError):
+        pass
+    return False
+
+def needs_rehash(stored_hash: str) -> bool:
+    """True for legacy hashes and for hashes made with other KDF settings than the current ones"""
+    parts = stored_hash.split('$')
+    if PASSWORD_KDF == 'scrypt':
+        return parts[:4] != ['scrypt', str(SCRYPT_N), str(SCRYPT_R), str(SCRYPT_P)]
+    return parts[:2] != ['pbkdf2_sha256', str(PBKDF2_ITERATIONS)]
+
+_dummy_hash: Optional[str] = None
+
+def burn_verification(password: str) -> None:
+    """Spend one verification when the login is unknown, so the response time
+    does not reveal which emails and usernames exist"""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(secrets.token_urlsafe(16))
+    verify_password(password, _dummy_hash)
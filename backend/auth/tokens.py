@@ -0,0 +1,130 @@
+'''
+Self-contained access tokens: HS256 JWTs signed with AUTH_SECRET, so any
+function holding the secret validates a token with one HMAC and no database
+round trip. Refresh tokens stay opaque rows of user_sessions; the ones revoked
+through this instance are also kept in an LRU, so a replayed refresh token is
+rejected without a query.
+AUTH_SECRET is required by both functions and must be the same in both: auth
+issues and verifies tokens, ai-chat verifies them. Without it no token is
+issued or accepted and the handlers answer 500. Both copies of this module
+must stay identical.
+'''
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+ACCESS_TOKEN_TTL_SECONDS = int(os.environ.get('ACCESS_TOKEN_TTL_SECONDS', '1800'))
+REVOKED_CACHE_SIZE = int(os.environ.get('REVOKED_CACHE_SIZE', '10000'))
+AUTH_SECRET = os.environ.get('AUTH_SECRET', '')
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+# The only header this module issues or accepts: a token claiming any other
+# algorithm, "none" included, fails before its signature is looked at
+_HEADER = _b64encode(json.dumps({'alg': 'HS256', 'typ': 'JWT'}, separators=(',', ':')).encode())
+
+class TokenSigner:
+    def __init__(self, secret: bytes):
+        # The keyed HMAC state is built once; each token only copies it
+        self._mac = hmac.new(secret, digestmod=hashlib.sha256)
+
+    def _sign(self, message: bytes) -> bytes:
+        mac = self._mac.copy()
+        mac.update(message)
+        return mac.digest()
+
+    def issue(self, claims: Dict[str, Any]) -> str:
+        payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode())
+        signing_input = f"{_HEADER}.{payload}"
+        return f"{signing_input}.{_b64encode(self._sign(signing_input.encode('ascii')))}"
+
+    def verify(self, token: str, now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Claims of a valid, unexpired access token; None for anything else"""
+        try:
+            header, payload, signature = token.split('.')
+            if header != _HEADER:
+                return None
+            expected = self._sign(f"{header}.{payload}".encode('ascii'))
+            if not hmac.compare_digest(expected, _b64decode(signature)):
+                return None
+            claims = json.loads(_b64decode(payload))
+        except (ValueError, AttributeError, binascii.Error, UnicodeError):
+            return None
+        if not isinstance(claims, dict) or claims.get('typ') != 'access':
+            return None
+        if not isinstance(claims.get('exp'), (int, float)) or claims['exp'] <= (now or time.time()):
+            return None
+        return claims
+
+class AuthSecretMissing(RuntimeError):
+    pass
+
+# A per-instance random secret would log everyone out on every cold start and
+# make tokens fail in every other instance and function, so there is no fallback
+signer: Optional[TokenSigner] = TokenSigner(AUTH_SECRET.encode('utf-8')) if AUTH_SECRET else None
+
+def _signer() -> TokenSigner:
+    if signer is None:
+        raise AuthSecretMissing('AUTH_SECRET not configured')
+    return signer
+
+def issue_access_token(user: Dict[str, Any], ttl: int = ACCESS_TOKEN_TTL_SECONDS) -> str:
+    now = int(time.time())
+    return _signer().issue({
+        'sub': user['id'],
+        'username': user.get('username'),
+        'tier': user.get('subscription_tier') or 'free',
+        'typ': 'access',
+        'iat': now,
+        'exp': now + ttl
+    })
+
+def verify_access_token(token: str) -> Optional[Dict[str, Any]]:
+    return _signer().verify(token)
+
+class RevokedTokens:
+    """LRU of revoked refresh tokens, keyed by their SHA-256 so raw tokens are not
+    kept in memory. An entry is useless once the token would have expired anyway"""
+
+    def __init__(self, size: int = REVOKED_CACHE_SIZE):
+        self.size = size
+        self._entries: 'OrderedDict[bytes, float]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def add(self, token: str, expires_at: float) -> None:
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = expires_at
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def __contains__(self, token: str) -> bool:
+        key = self._key(token)
+        with self._lock:
+            expires_at = self._entries.get(key)
+            if expires_at is None:
+                return False
+            if expires_at <= time.time():
+                del self._entries[key]
+                return False
+            self._entries.move_to_end(key)
+            return True
+
+    def __len__(self) -> int:
+        return len(self._entries)
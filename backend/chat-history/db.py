@@ -0,0 +1,120 @@
+'''
+PostgreSQL connection pool kept at module scope, so warm invocations of a
+function reuse connections instead of paying for a new TCP + auth
+handshake on every request. ThreadedConnectionPool raises instead of waiting
+when all its connections are out, so a semaphore sized to the pool makes
+concurrent requests queue for a connection (up to DB_POOL_WAIT_SECONDS).
+Every backend function ships an identical copy of this module: keep the
+copies in sync.
+'''
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+import psycopg2
+from psycopg2 import pool
+from timing import stage
+
+POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '1'))
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+# Connections idle for longer than this are checked with SELECT 1 before reuse
+HEALTH_CHECK_IDLE_SECONDS = float(os.environ.get('DB_HEALTH_CHECK_IDLE_SECONDS', '30'))
+POOL_WAIT_SECONDS = float(os.environ.get('DB_POOL_WAIT_SECONDS', '10'))
+
+_pool: Optional[pool.ThreadedConnectionPool] = None
+_pool_dsn: Optional[str] = None
+_pool_lock = threading.Lock()
+_last_used: Dict[int, float] = {}
+# One permit per connection the pool may hand out
+_slots = threading.BoundedSemaphore(POOL_MAX_SIZE)
+
+def get_pool(dsn: str) -> pool.ThreadedConnectionPool:
+    """Create the pool lazily on first use or when DATABASE_URL changes"""
+    global _pool, _pool_dsn
+    if _pool is None or _pool.closed or _pool_dsn != dsn:
+        with _pool_lock:
+            if _pool is None or _pool.closed or _pool_dsn != dsn:
+                if _pool is not None and not _pool.closed:
+                    _pool.closeall()
+                _last_used.clear()
+                _pool = pool.ThreadedConnectionPool(
+                    POOL_MIN_SIZE, POOL_MAX_SIZE, dsn,
+                    keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3
+                )
+                _pool_dsn = dsn
+    return _pool
+
+def _is_healthy(conn) -> bool:
+    if conn.closed:
+        return False
+    if time.monotonic() - _last_used.get(id(conn), 0.0) < HEALTH_CHECK_IDLE_SECONDS:
+        return True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def acquire(dsn: str):
+    """Healthy connection from the pool, waiting while all of them are in use;
+    dropped ones are discarded and replaced"""
+    if not _slots.acquire(timeout=POOL_WAIT_SECONDS):
+        raise psycopg2.OperationalError('Timed out waiting for a database connection')
+    try:
+        connection_pool = get_pool(dsn)
+        for _ in range(POOL_MAX_SIZE + 1):
+            conn = connection_pool.getconn()
+            if _is_healthy(conn):
+                return conn
+            _last_used.pop(id(conn), None)
+            connection_pool.putconn(conn, close=True)
+    except BaseException:
+        _slots.release()
+        raise
+    _slots.release()
+    raise psycopg2.OperationalError('No healthy database connection available')
+
+def release(conn, discard: bool = False) -> None:
+    """Return a connection to the pool, rolling back anything left uncommitted"""
+    try:
+        _put_back(conn, discard)
+    finally:
+        _slots.release()
+
+def _put_back(conn, discard: bool) -> None:
+    connection_pool = _pool
+    if connection_pool is None or connection_pool.closed:
+        conn.close()
+        return
+    if not discard and not conn.closed:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            discard = True
+    if discard or conn.closed:
+        _last_used.pop(id(conn), None)
+        connection_pool.putconn(conn, close=True)
+        return
+    _last_used[id(conn)] = time.monotonic()
+    connection_pool.putconn(conn)
+
+@contextmanager
+def connection(dsn: str) -> Iterator:
+    """Pooled connection for the duration of a request.
+    Uncommitted work is rolled back on exit; a connection that failed at the
+    protocol level is closed instead of going back to the pool"""
+    with stage('db_connect'):
+        conn = acquire(dsn)
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        release(conn, discard=True)
+        raise
+    except BaseException:
+        release(conn)
+        raise
+    else:
+        release(conn)
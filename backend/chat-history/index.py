@@ -1,191 +1,294 @@
 import json
+import base64
 import os
-from typing import Dict, Any
-import psycopg2
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
 from psycopg2.extras import RealDictCursor
+from db import connection
+from timing import count, instrument, stage
+from responses import json_response, negotiated, preflight, with_etag
 
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+SNIPPET_OPTIONS = 'MaxFragments=2, MaxWords=20, MinWords=5, StartSel=<mark>, StopSel=</mark>'
+
+def encode_cursor(updated_at: datetime, chat_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{updated_at.isoformat()}|{chat_id}".encode()).decode()
+
+def decode_cursor(cursor_value: str) -> Tuple[datetime, int]:
+    updated_at, chat_id = base64.urlsafe_b64decode(cursor_value.encode()).decode().split('|')
+    return datetime.fromisoformat(updated_at), int(chat_id)
+
+def encode_search_cursor(rank: float, message_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{rank!r}|{message_id}".encode()).decode()
+
+def decode_search_cursor(cursor_value: str) -> Tuple[float, int]:
+    rank, message_id = base64.urlsafe_b64decode(cursor_value.encode()).decode().split('|')
+    return float(rank), int(message_id)
+
+def search_messages(cur, session_id: str, query: str, tags: List[str], page_size: int,
+                    before: Optional[Tuple[float, int]]) -> list:
+    """Сообщения сессии, подходящие под запрос, по убыванию ts_rank_cd.
+    Запрос разбирается websearch_to_tsquery в обеих конфигурациях search_vector
+    (russian и simple), tags оставляет чаты, где есть все перечисленные теги.
+    ts_headline дорогой, поэтому считается только для строк страницы"""
+    params: list = [query, query, session_id]
+    where_sql = "WHERE c.session_id = %s AND m.search_vector @@ q.query"
+    if tags:
+        where_sql += " AND c.tags @> %s::text[]"
+        params.append(tags)
+    if before is not None:
+        # ts_rank_cd возвращает real: сравнение в real, чтобы ранг из курсора совпал точно
+        where_sql += " AND (ts_rank_cd(m.search_vector, q.query), m.id) < (%s::real, %s)"
+        params.extend(before)
+    params.append(page_size + 1)
+    
+    cur.execute(
+        f"""WITH q AS (
+             SELECT websearch_to_tsquery('russian', %s) || websearch_to_tsquery('simple', %s) AS query
+           ),
+           hits AS (
+             SELECT m.id, m.chat_id, m.role, m.content, m.created_at,
+                    ts_rank_cd(m.search_vector, q.query) AS rank
+             FROM q, messages m
+             JOIN chats c ON c.id = m.chat_id
+             {where_sql}
+             ORDER BY rank DESC, m.id DESC
+             LIMIT %s
+           )
+           SELECT h.id, h.chat_id, h.role, h.created_at, h.rank, c.title, c.tags,
+                  ts_headline('russian',
+                              replace(replace(replace(h.content, '&', '&amp;'), '<', '&lt;'), '>', '&gt;'),
+                              q.query, %s) AS snippet
+           FROM hits h
+           JOIN chats c ON c.id = h.chat_id
+           CROSS JOIN q
+           ORDER BY h.rank DESC, h.id DESC""",
+        params + [SNIPPET_OPTIONS]
+    )
+    return cur.fetchall()
+
+def fetch_chats(cur, session_id: str, page_size: int, before: Optional[Tuple[datetime, int]],
+                messages_limit: Optional[int], titles_only: bool) -> list:
+    """Страница чатов вместе с сообщениями одним запросом (json_agg через LATERAL).
+    messages_limit оставляет последние N сообщений каждого чата"""
+    params: list = []
+    messages_sql = ""
+    lateral_sql = ""
+    if not titles_only:
+        messages_sql = ", COALESCE(m.messages, '[]'::json) AS messages"
+        lateral_sql = """
+           LEFT JOIN LATERAL (
+             SELECT json_agg(json_build_object('role', x.role, 'text', x.content)
+                             ORDER BY x.created_at, x.id) AS messages
+             FROM (
+               SELECT id, role, content, created_at FROM messages
+               WHERE chat_id = c.id
+               ORDER BY created_at DESC, id DESC
+               LIMIT %s
+             ) x
+           ) m ON TRUE"""
+        params.append(messages_limit)
+    
+    where_sql = "WHERE c.session_id = %s"
+    params.append(session_id)
+    if before is not None:
+        where_sql += " AND (c.updated_at, c.id) < (%s, %s)"
+        params.extend(before)
+    
+    params.append(page_size + 1)
+    cur.execute(
+        f"""SELECT c.id, c.title, c.created_at, c.updated_at, c.tags{messages_sql}
+           FROM chats c{lateral_sql}
+           {where_sql}
+           ORDER BY c.updated_at DESC, c.id DESC
+           LIMIT %s""",
+        params
+    )
+    return cur.fetchall()
+
+@instrument('chat-history')
+@negotiated
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Управление историей чатов - сохранение, загрузка, удаление
     Args: event с httpMethod, body, queryStringParameters
+          (GET с q - полнотекстовый поиск по сообщениям, tags через запятую)
           context с request_id
     Returns: HTTP response с данными чатов
     '''
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+        return preflight('GET, POST, PUT, DELETE, OPTIONS')
     
     dsn = os.environ.get('DATABASE_URL')
     
     if not dsn:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'error': 'Database not configured'})
-        }
+        return json_response(500, {'error': 'Database not configured'})
     
     try:
-        conn = psycopg2.connect(dsn)
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        if method == 'GET':
-            query_params = event.get('queryStringParameters', {}) or {}
-            session_id = query_params.get('session_id')
-            
-            if not session_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'session_id required'})
-                }
-            
-            cur.execute(
-                "SELECT c.id, c.title, c.created_at, c.updated_at, c.tags FROM chats c WHERE c.session_id = %s ORDER BY c.updated_at DESC LIMIT 10",
-                (session_id,)
-            )
-            chats = cur.fetchall()
-            
-            result = []
-            for chat in chats:
-                cur.execute(
-                    "SELECT role, content, created_at FROM messages WHERE chat_id = %s ORDER BY created_at ASC",
-                    (chat['id'],)
-                )
-                messages = cur.fetchall()
-                result.append({
-                    'id': chat['id'],
-                    'title': chat['title'],
-                    'created_at': chat['created_at'].isoformat() if chat['created_at'] else None,
-                    'messages': [{'role': m['role'], 'text': m['content']} for m in messages],
-                    'tags': chat['tags'] or []
-                })
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps({'chats': result})
-            }
-        
-        elif method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
-            session_id = body_data.get('session_id')
-            title = body_data.get('title', 'Новый чат')
-            messages = body_data.get('messages', [])
-            tags = body_data.get('tags', [])
+        with connection(dsn) as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
             
-            if not session_id or not messages:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'session_id and messages required'})
-                }
+            if method == 'GET':
+                query_params = event.get('queryStringParameters', {}) or {}
+                session_id = query_params.get('session_id')
+                
+                if not session_id:
+                    return json_response(400, {'error': 'session_id required'})
+                
+                try:
+                    page_size = min(int(query_params.get('limit') or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE)
+                    messages_limit = (min(int(query_params['messages_limit']), MAX_PAGE_SIZE)
+                                      if query_params.get('messages_limit') else None)
+                except ValueError:
+                    page_size, messages_limit = 0, None
+                if page_size < 1 or (messages_limit is not None and messages_limit < 1):
+                    return json_response(400, {'error': 'Invalid limit'})
+                
+                search_query = (query_params.get('q') or '').strip()
+                if search_query:
+                    tags = [tag.strip() for tag in (query_params.get('tags') or '').split(',') if tag.strip()]
+                    try:
+                        before = decode_search_cursor(query_params['cursor']) if query_params.get('cursor') else None
+                    except ValueError:
+                        return json_response(400, {'error': 'Invalid cursor'})
+                    with stage('search'):
+                        hits = search_messages(cur, session_id, search_query, tags, page_size, before)
+                    count('rows_read', len(hits))
+                    has_more = len(hits) > page_size
+                    hits = hits[:page_size]
+                    
+                    results = [{
+                        'chat_id': hit['chat_id'],
+                        'title': hit['title'],
+                        'tags': hit['tags'] or [],
+                        'message_id': hit['id'],
+                        'role': hit['role'],
+                        'snippet': hit['snippet'],
+                        'rank': hit['rank'],
+                        'created_at': hit['created_at'].isoformat() if hit['created_at'] else None
+                    } for hit in hits]
+                    next_cursor = encode_search_cursor(hits[-1]['rank'], hits[-1]['id']) if has_more else None
+                    
+                    cur.close()
+                    
+                    return json_response(200, {'results': results, 'nextCursor': next_cursor})
+                
+                titles_only = query_params.get('titles_only') in ('1', 'true')
+                try:
+                    before = decode_cursor(query_params['cursor']) if query_params.get('cursor') else None
+                except ValueError:
+                    return json_response(400, {'error': 'Invalid cursor'})
+                
+                with stage('list'):
+                    chats = fetch_chats(cur, session_id, page_size, before, messages_limit, titles_only)
+                count('rows_read', len(chats))
+                has_more = len(chats) > page_size
+                chats = chats[:page_size]
+                
+                result = []
+                for chat in chats:
+                    chat_info = {
+                        'id': chat['id'],
+                        'title': chat['title'],
+                        'created_at': chat['created_at'].isoformat() if chat['created_at'] else None,
+                        'updated_at': chat['updated_at'].isoformat() if chat['updated_at'] else None,
+                        'tags': chat['tags'] or []
+                    }
+                    if not titles_only:
+                        chat_info['messages'] = chat['messages']
+                    result.append(chat_info)
+                
+                next_cursor = encode_cursor(chats[-1]['updated_at'], chats[-1]['id']) if has_more else None
+                
+                cur.close()
+                
+                # Клиент, у которого эта страница уже есть, получает 304 без тела
+                return with_etag(event, json_response(200, {'chats': result, 'nextCursor': next_cursor}))
             
-            cur.execute(
-                "INSERT INTO chats (session_id, title, tags) VALUES (%s, %s, %s) RETURNING id",
-                (session_id, title, tags)
-            )
-            chat_id = cur.fetchone()['id']
+            elif method == 'POST':
+                body_data = json.loads(event.get('body', '{}'))
+                session_id = body_data.get('session_id')
+                chat_id = body_data.get('chat_id')
+                title = body_data.get('title', 'Новый чат')
+                messages = body_data.get('messages', [])
+                tags = body_data.get('tags', [])
+                
+                if not session_id or not messages:
+                    return json_response(400, {'error': 'session_id and messages required'})
+                
+                roles = [msg.get('role') for msg in messages]
+                texts = [msg.get('text') for msg in messages]
+                
+                # С chat_id сообщения дописываются в существующий чат, иначе создаётся новый
+                if chat_id:
+                    chat_sql = "UPDATE chats SET updated_at = NOW() WHERE id = %s AND session_id = %s RETURNING id"
+                    chat_params = (chat_id, session_id)
+                else:
+                    chat_sql = "INSERT INTO chats (session_id, title, tags) VALUES (%s, %s, %s) RETURNING id"
+                    chat_params = (session_id, title, tags)
+                
+                with stage('save'):
+                    cur.execute(
+                        f"""WITH chat AS ({chat_sql}),
+                            inserted AS (
+                              INSERT INTO messages (chat_id, role, content)
+                              SELECT chat.id, m.role, m.content
+                              FROM chat, unnest(%s::text[], %s::text[]) WITH ORDINALITY AS m(role, content, ord)
+                              ORDER BY m.ord
+                              RETURNING 1
+                            )
+                            SELECT (SELECT id FROM chat) AS chat_id, (SELECT COUNT(*) FROM inserted) AS inserted""",
+                        chat_params + (roles, texts)
+                    )
+                    saved = cur.fetchone()
+                
+                if saved['chat_id'] is None:
+                    conn.rollback()
+                    cur.close()
+                    return json_response(404, {'error': 'Chat not found'})
+                
+                conn.commit()
+                cur.close()
+                
+                return json_response(200, {'success': True, 'chat_id': saved['chat_id'], 'appended': saved['inserted']})
             
-            for msg in messages:
+            elif method == 'PUT':
+                body_data = json.loads(event.get('body', '{}'))
+                chat_id = body_data.get('chat_id')
+                tags = body_data.get('tags', [])
+                
+                if not chat_id:
+                    return json_response(400, {'error': 'chat_id required'})
+                
                 cur.execute(
-                    "INSERT INTO messages (chat_id, role, content) VALUES (%s, %s, %s)",
-                    (chat_id, msg.get('role'), msg.get('text'))
+                    "UPDATE chats SET tags = %s, updated_at = NOW() WHERE id = %s",
+                    (tags, chat_id)
                 )
+                
+                conn.commit()
+                cur.close()
+                
+                return json_response(200, {'success': True})
             
-            conn.commit()
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps({'success': True, 'chat_id': chat_id})
-            }
-        
-        elif method == 'PUT':
-            body_data = json.loads(event.get('body', '{}'))
-            chat_id = body_data.get('chat_id')
-            tags = body_data.get('tags', [])
-            
-            if not chat_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'chat_id required'})
-                }
-            
-            cur.execute(
-                "UPDATE chats SET tags = %s, updated_at = NOW() WHERE id = %s",
-                (tags, chat_id)
-            )
+            elif method == 'DELETE':
+                query_params = event.get('queryStringParameters', {}) or {}
+                chat_id = query_params.get('chat_id')
+                
+                if not chat_id:
+                    return json_response(400, {'error': 'chat_id required'})
+                
+                cur.execute("DELETE FROM messages WHERE chat_id = %s", (chat_id,))
+                cur.execute("DELETE FROM chats WHERE id = %s", (chat_id,))
+                
+                conn.commit()
+                cur.close()
+                
+                return json_response(200, {'success': True})
             
-            conn.commit()
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps({'success': True})
-            }
-        
-        elif method == 'DELETE':
-            query_params = event.get('queryStringParameters', {}) or {}
-            chat_id = query_params.get('chat_id')
-            
-            if not chat_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'isBase64Encoded': False,
-                    'body': json.dumps({'error': 'chat_id required'})
-                }
-            
-            cur.execute("DELETE FROM messages WHERE chat_id = %s", (chat_id,))
-            cur.execute("DELETE FROM chats WHERE id = %s", (chat_id,))
-            
-            conn.commit()
-            cur.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps({'success': True})
-            }
-        
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+            return json_response(405, {'error': 'Method not allowed'})
         
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'error': f'Database error: {str(e)}'})
-        }
\ No newline at end of file
+        return json_response(500, {'error': f'Database error: {str(e)}'})
\ No newline at end of file
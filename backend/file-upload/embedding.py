@@ -0,0 +1,85 @@
+'''
+Local CPU-only text embeddings for semantic search: no model download, no
+network. Stemmed terms and their character trigrams are hashed into a
+fixed-size vector; words of a small synonym lexicon also set a dedicated
+concept dimension, so paraphrases like "цена" and "стоимость" land close to
+each other.
+file-upload embeds chunks with it, ai-chat embeds questions and answer
+lines with it: both copies of this module must stay identical.
+'''
+import math
+import zlib
+from array import array
+from collections import Counter
+from typing import Dict, List, Tuple
+from text_index import stem, tokenize
+
+EMBEDDING_DIM = 256
+EMBEDDING_SCALE = 127
+NGRAM_SIZE = 3
+NGRAM_WEIGHT = 0.5
+SYNONYM_WEIGHT = 1.0
+
+SYNONYM_GROUPS = (
+    ('price', 'цена стоимость прайс тариф расценка ценник price cost pricing'),
+    ('delivery', 'доставка отправка пересылка курьер shipping delivery'),
+    ('payment', 'оплата платёж платеж плата расчёт расчет payment pay'),
+    ('refund', 'возврат обмен refund return'),
+    ('warranty', 'гарантия warranty guarantee'),
+    ('order', 'заказ заказать купить покупка приобрести order purchase buy'),
+    ('contact', 'контакт телефон связь почта contact phone email'),
+    ('address', 'адрес местоположение расположение address location'),
+    ('schedule', 'график расписание режим часы schedule hours'),
+    ('deadline', 'срок сроки длительность deadline duration'),
+    ('discount', 'скидка акция промокод распродажа discount sale promo'),
+    ('support', 'поддержка помощь консультация support help assistance'),
+    ('document', 'документ договор контракт соглашение document contract agreement'),
+    ('problem', 'ошибка сбой неполадка проблема неисправность error failure issue problem'),
+    ('account', 'аккаунт профиль учётная учетная account profile'),
+    ('staff', 'сотрудник менеджер специалист персонал staff employee manager'),
+    ('company', 'компания организация фирма предприятие company organization firm'),
+    ('customer', 'клиент покупатель заказчик customer client buyer'),
+    ('product', 'товар продукт изделие продукция product item goods'),
+    ('cancel', 'отмена отменить аннулировать cancel'),
+    ('install', 'установка монтаж подключение настройка install setup installation'),
+    ('size', 'размер габарит величина size dimension'),
+)
+
+# Stem -> concept dimension; the first len(SYNONYM_GROUPS) dimensions are
+# reserved for concepts so they never collide with hashed features
+SYNONYMS: Dict[str, int] = {
+    stem(word): dimension for dimension, (_, words) in enumerate(SYNONYM_GROUPS) for word in words.split()
+}
+HASHED_DIM = EMBEDDING_DIM - len(SYNONYM_GROUPS)
+
+def _bucket(feature: str) -> Tuple[int, float]:
+    """Stable signed hashing: Python's hash() is salted per process"""
+    h = zlib.crc32(feature.encode('utf-8'))
+    return len(SYNONYM_GROUPS) + h % HASHED_DIM, (1.0 if h & 0x80000000 else -1.0)
+
+def embed(text: str) -> List[float]:
+    """L2-normalized hashed feature vector of a text; all zeros if it has no terms"""
+    vector = [0.0] * EMBEDDING_DIM
+    for term, tf in Counter(tokenize(text)).items():
+        weight = 1.0 + math.log(tf)
+        concept = SYNONYMS.get(term)
+        if concept is not None:
+            vector[concept] += weight * SYNONYM_WEIGHT
+        features = [('w:' + term, weight)]
+        padded = f'#{term}#'
+        grams = [padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)]
+        features.extend(('g:' + gram, weight * NGRAM_WEIGHT / len(grams)) for gram in grams)
+        for feature, value in features:
+            index, sign = _bucket(feature)
+            vector[index] += sign * value
+
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else vector
+
+def quantize(vector: List[float]) -> bytes:
+    """int8 storage: EMBEDDING_DIM bytes per chunk"""
+    return array('b', [max(-EMBEDDING_SCALE, min(EMBEDDING_SCALE, round(x * EMBEDDING_SCALE))) for x in vector]).tobytes()
+
+def cosine(a: List[float], b: List[float]) -> float:
+    """Dot product of two normalized vectors"""
+    return sum(x * y for x, y in zip(a, b))
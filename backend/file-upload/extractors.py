@@ -0,0 +1,485 @@
+'''
+Pure-Python text extraction for office documents: PDF content streams
+(FlateDecode, Tj/TJ text operators, ToUnicode CMaps) and DOCX
+word/document.xml. Both yield text page by page or paragraph by paragraph,
+so a large document is never expanded in memory all at once. Runs in the
+extraction worker processes, off the upload request path.
+'''
+import base64
+import binascii
+import io
+import re
+import zipfile
+import zlib
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+from xml.etree import ElementTree
+
+MAX_EXTRACTED_CHARS = 2_000_000
+MAX_DOCX_XML_SIZE = 200 * 1024 * 1024
+MAX_FORM_DEPTH = 3
+# TJ offsets (thousandths of an em) wider than this separate words
+TJ_SPACE_THRESHOLD = 200
+
+class ExtractionError(Exception):
+    pass
+
+def is_document_file(file_name: str) -> bool:
+    """Formats extracted by the worker instead of at upload time"""
+    return file_name.lower().endswith(('.pdf', '.docx', '.doc'))
+
+def extract_document_text(data: bytes, file_name: str) -> str:
+    """Text of a PDF, DOCX or legacy DOC file, capped at MAX_EXTRACTED_CHARS"""
+    file_lower = file_name.lower()
+    if file_lower.endswith('.pdf'):
+        pieces = iter_pdf_pages(data)
+    elif file_lower.endswith('.docx'):
+        pieces = iter_docx_paragraphs(data)
+    else:
+        pieces = iter_doc_strings(data)
+
+    text = []
+    size = 0
+    for piece in pieces:
+        piece = piece.strip()
+        if not piece:
+            continue
+        text.append(piece)
+        size += len(piece) + 1
+        if size >= MAX_EXTRACTED_CHARS:
+            break
+    return '\n'.join(text)[:MAX_EXTRACTED_CHARS]
+
+# --- PDF objects ---
+
+class Name(str):
+    pass
+
+class Operator(str):
+    pass
+
+class Ref(NamedTuple):
+    num: int
+    gen: int
+
+_WHITESPACE = b' \t\r\n\x0c\x00'
+_DELIMITERS = b'()<>[]{}/%'
+_NUMBER_RE = re.compile(rb'[+-]?(?:\d+\.?\d*|\.\d+)$')
+_ESCAPES = {ord('n'): b'\n', ord('r'): b'\r', ord('t'): b'\t', ord('b'): b'\b', ord('f'): b'\f',
+            ord('('): b'(', ord(')'): b')', ord('\\'): b'\\'}
+_INLINE_IMAGE_END_RE = re.compile(rb'\sEI(?=\s|$)')
+_OPEN_ARRAY, _CLOSE_ARRAY, _OPEN_DICT, _CLOSE_DICT = object(), object(), object(), object()
+
+def _tokens(data: bytes, pos: int = 0, end: Optional[int] = None) -> Iterator[object]:
+    """Lexer for PDF objects and content streams"""
+    end = len(data) if end is None else end
+    while pos < end:
+        ch = data[pos]
+        if ch in _WHITESPACE:
+            pos += 1
+        elif ch == 0x25:  # % comment
+            while pos < end and data[pos] not in b'\r\n':
+                pos += 1
+        elif ch == 0x2F:  # /Name
+            start = pos + 1
+            pos = start
+            while pos < end and data[pos] not in _WHITESPACE and data[pos] not in _DELIMITERS:
+                pos += 1
+            raw = data[start:pos]
+            raw = re.sub(rb'#([0-9A-Fa-f]{2})', lambda m: bytes([int(m.group(1), 16)]), raw)
+            yield Name(raw.decode('latin-1'))
+        elif ch == 0x28:  # (literal string)
+            pos, value = _literal_string(data, pos + 1, end)
+            yield value
+        elif ch == 0x3C:  # <hex> or <<
+            if data[pos + 1:pos + 2] == b'<':
+                pos += 2
+                yield _OPEN_DICT
+            else:
+                close = data.find(b'>', pos)
+                close = end if close == -1 else close
+                digits = re.sub(rb'[^0-9A-Fa-f]', b'', data[pos + 1:close])
+                if len(digits) % 2:
+                    digits += b'0'
+                pos = close + 1
+                yield binascii.unhexlify(digits)
+        elif ch == 0x3E:
+            pos += 2 if data[pos + 1:pos + 2] == b'>' else 1
+            yield _CLOSE_DICT
+        elif ch == 0x5B:
+            pos += 1
+            yield _OPEN_ARRAY
+        elif ch == 0x5D:
+            pos += 1
+            yield _CLOSE_ARRAY
+        elif ch in b'{}':
+            pos += 1
+        else:
+            start = pos
+            while pos < end and data[pos] not in _WHITESPACE and data[pos] not in _DELIMITERS:
+                pos += 1
+            word = data[start:pos]
+            if _NUMBER_RE.match(word):
+                yield float(word) if b'.' in word else int(word)
+            else:
+                token = Operator(word.decode('latin-1'))
+                yield token
+                if token == 'ID':
+                    # Inline image data is binary: skip to EI
+                    match = _INLINE_IMAGE_END_RE.search(data, pos + 1, end)
+                    pos = match.end() if match else end
+
+def _literal_string(data: bytes, pos: int, end: int) -> Tuple[int, bytes]:
+    depth = 1
+    out = bytearray()
+    while pos < end:
+        ch = data[pos]
+        if ch == 0x5C:  # backslash
+            pos += 1
+            if pos >= end:
+                break
+            escaped = data[pos]
+            if escaped in _ESCAPES:
+                out += _ESCAPES[escaped]
+                pos += 1
+            elif 0x30 <= escaped <= 0x37:
+                digits = re.match(rb'[0-7]{1,3}', data[pos:pos + 3]).group(0)
+                out.append(int(digits, 8) & 0xFF)
+                pos += len(digits)
+            elif escaped in b'\r\n':
+                pos += 2 if data[pos:pos + 2] == b'\r\n' else 1
+            else:
+                out.append(escaped)
+                pos += 1
+            continue
+        if ch == 0x28:
+            depth += 1
+        elif ch == 0x29:
+            depth -= 1
+            if depth == 0:
+                return pos + 1, bytes(out)
+        out.append(ch)
+        pos += 1
+    return pos, bytes(out)
+
+def _collect_refs(items: list) -> list:
+    """Fold `num gen R` triples into Ref"""
+    folded = []
+    for item in items:
+        if isinstance(item, Operator) and item == 'R' and len(folded) >= 2 \
+                and isinstance(folded[-1], int) and isinstance(folded[-2], int):
+            gen = folded.pop()
+            num = folded.pop()
+            folded.append(Ref(num, gen))
+        else:
+            folded.append(item)
+    return folded
+
+def _parse_values(tokens: Iterator[object], closing: Optional[object] = None) -> list:
+    items = []
+    for token in tokens:
+        if token is closing:
+            break
+        if token is _OPEN_ARRAY:
+            items.append(_parse_values(tokens, _CLOSE_ARRAY))
+        elif token is _OPEN_DICT:
+            values = _parse_values(tokens, _CLOSE_DICT)
+            items.append({values[i]: values[i + 1] for i in range(0, len(values) - 1, 2)
+                          if isinstance(values[i], Name)})
+        else:
+            items.append(token)
+            if closing is None and isinstance(token, Operator) and token not in ('R', 'true', 'false', 'null'):
+                break
+    return _collect_refs(items)
+
+def parse_object(data: bytes, pos: int = 0, end: Optional[int] = None) -> object:
+    values = _parse_values(_tokens(data, pos, end))
+    return values[0] if values else None
+
+# --- PDF document ---
+
+_OBJECT_RE = re.compile(rb'(\d+)\s+(\d+)\s+obj\b')
+_STREAM_RE = re.compile(rb'stream\r?\n')
+
+class PdfDocument:
+    """Object index over the raw file; streams are decoded only when a page needs them"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.objects: Dict[int, Tuple[object, Optional[Tuple[int, int]]]] = {}
+        self._decoded: Dict[int, bytes] = {}
+        self._cmaps: Dict[int, Tuple[Dict[bytes, str], int]] = {}
+        self._index()
+        if any(isinstance(value, dict) and 'Encrypt' in value for value, _ in self.objects.values()) \
+                or re.search(rb'trailer\s*<<[^>]*/Encrypt', data):
+            raise ExtractionError('Encrypted PDF')
+
+    def _index(self) -> None:
+        data = self.data
+        for match in _OBJECT_RE.finditer(data):
+            num = int(match.group(1))
+            body_end = data.find(b'endobj', match.end())
+            body_end = len(data) if body_end == -1 else body_end
+            value = parse_object(data, match.end(), body_end)
+            stream = None
+            if isinstance(value, dict):
+                stream_match = _STREAM_RE.search(data, match.end(), body_end)
+                if stream_match:
+                    start = stream_match.end()
+                    length = value.get('Length')
+                    stop = start + length if isinstance(length, int) else -1
+                    if stop < 0 or data[stop:stop + 20].strip()[:9] != b'endstream':
+                        stop = data.find(b'endstream', start)
+                    stream = (start, stop if stop != -1 else body_end)
+            # Later revisions of an object replace earlier ones
+            self.objects[num] = (value, stream)
+
+        for num, (value, stream) in list(self.objects.items()):
+            if isinstance(value, dict) and value.get('Type') == 'ObjStm' and stream:
+                self._index_object_stream(num, value)
+
+    def _index_object_stream(self, num: int, header: dict) -> None:
+        content = self.stream(num)
+        first = header.get('First', 0)
+        numbers = _parse_values(_tokens(content, 0, first))
+        pairs = [(numbers[i], numbers[i + 1]) for i in range(0, len(numbers) - 1, 2)]
+        for index, (obj_num, offset) in enumerate(pairs):
+            stop = first + pairs[index + 1][1] if index + 1 < len(pairs) else len(content)
+            if obj_num not in self.objects:
+                self.objects[obj_num] = (parse_object(content, first + offset, stop), None)
+
+    def resolve(self, value: object) -> object:
+        seen = 0
+        while isinstance(value, Ref) and seen < 32:
+            value = self.objects.get(value.num, (None, None))[0]
+            seen += 1
+        return value
+
+    def stream(self, num: int) -> bytes:
+        """Decoded stream of an object; undecodable filters give empty bytes"""
+        if num in self._decoded:
+            return self._decoded[num]
+        value, span = self.objects.get(num, (None, None))
+        if not span or not isinstance(value, dict):
+            return b''
+        content = self.data[span[0]:span[1]]
+        filters = self.resolve(value.get('Filter'))
+        for name in (filters if isinstance(filters, list) else [filters] if filters else []):
+            content = _decode_filter(self.resolve(name), content)
+        if len(self._decoded) < 64:
+            self._decoded[num] = content
+        return content
+
+    def pages(self) -> Iterator[Tuple[dict, dict]]:
+        """(page, inherited resources) in document order"""
+        catalog = next((value for value, _ in self.objects.values()
+                        if isinstance(value, dict) and value.get('Type') == 'Catalog'), None)
+        root = self.resolve(catalog.get('Pages')) if catalog else None
+        if isinstance(root, dict):
+            yield from self._walk(root, {}, set())
+            return
+        for num in sorted(self.objects):
+            value = self.objects[num][0]
+            if isinstance(value, dict) and value.get('Type') == 'Page':
+                yield value, self.resolve(value.get('Resources')) or {}
+
+    def _walk(self, node: dict, resources: dict, seen: set) -> Iterator[Tuple[dict, dict]]:
+        resources = self.resolve(node.get('Resources')) or resources
+        kids = self.resolve(node.get('Kids'))
+        if node.get('Type') == 'Page' or not isinstance(kids, list):
+            yield node, resources
+            return
+        for kid in kids:
+            if isinstance(kid, Ref):
+                if kid.num in seen:
+                    continue
+                seen.add(kid.num)
+            child = self.resolve(kid)
+            if isinstance(child, dict):
+                yield from self._walk(child, resources, seen)
+
+    def content(self, page: dict) -> bytes:
+        contents = page.get('Contents')
+        refs = self.resolve(contents)
+        refs = refs if isinstance(refs, list) else [contents]
+        return b'\n'.join(self.stream(ref.num) for ref in refs if isinstance(ref, Ref))
+
+    def font_map(self, font_ref: object) -> Tuple[Optional[Dict[bytes, str]], int]:
+        """ToUnicode mapping and code width of a font; None mapping means single-byte Latin-1"""
+        font = self.resolve(font_ref)
+        if not isinstance(font, dict):
+            return None, 1
+        to_unicode = font.get('ToUnicode')
+        if isinstance(to_unicode, Ref):
+            if to_unicode.num not in self._cmaps:
+                self._cmaps[to_unicode.num] = parse_cmap(self.stream(to_unicode.num))
+            return self._cmaps[to_unicode.num]
+        return None, 2 if font.get('Subtype') == 'Type0' else 1
+
+def _decode_filter(name: object, content: bytes) -> bytes:
+    if name in ('FlateDecode', 'Fl'):
+        # Truncated or slightly corrupt streams still give their readable prefix
+        decompressor = zlib.decompressobj()
+        out = bytearray()
+        for start in range(0, len(content), 65536):
+            try:
+                out += decompressor.decompress(content[start:start + 65536])
+            except zlib.error:
+                break
+        return bytes(out)
+    if name in ('ASCIIHexDecode', 'AHx'):
+        digits = re.sub(rb'[^0-9A-Fa-f]', b'', content.split(b'>')[0])
+        return binascii.unhexlify(digits + b'0' * (len(digits) % 2))
+    if name in ('ASCII85Decode', 'A85'):
+        body = content.strip()
+        body = body[2:] if body.startswith(b'<~') else body
+        body = body.split(b'~>')[0]
+        try:
+            return base64.a85decode(body)
+        except ValueError:
+            return b''
+    return b''
+
+_BFCHAR_RE = re.compile(rb'beginbfchar(.*?)endbfchar', re.S)
+_BFRANGE_RE = re.compile(rb'beginbfrange(.*?)endbfrange', re.S)
+_HEX_PAIR_RE = re.compile(rb'<([0-9A-Fa-f]+)>\s*<([0-9A-Fa-f]*)>')
+_RANGE_RE = re.compile(rb'<([0-9A-Fa-f]+)>\s*<([0-9A-Fa-f]+)>\s*(<[0-9A-Fa-f]*>|\[[^\]]*\])')
+
+def _utf16(hex_digits: bytes) -> str:
+    raw = binascii.unhexlify(hex_digits + b'0' * (len(hex_digits) % 2))
+    return raw.decode('utf-16-be', errors='ignore')
+
+def parse_cmap(cmap: bytes) -> Tuple[Dict[bytes, str], int]:
+    """bfchar/bfrange entries of a ToUnicode CMap and the code width in bytes"""
+    mapping: Dict[bytes, str] = {}
+    width = 1
+    for section in _BFCHAR_RE.findall(cmap):
+        for source, target in _HEX_PAIR_RE.findall(section):
+            width = max(width, len(source) // 2)
+            mapping[binascii.unhexlify(source)] = _utf16(target)
+    for section in _BFRANGE_RE.findall(cmap):
+        for low, high, target in _RANGE_RE.findall(section):
+            width = max(width, len(low) // 2)
+            start, stop = int(low, 16), int(high, 16)
+            if stop - start > 0xFFFF:
+                continue
+            size = len(low) // 2
+            if target.startswith(b'['):
+                targets = re.findall(rb'<([0-9A-Fa-f]*)>', target)
+                for offset, item in enumerate(targets[:stop - start + 1]):
+                    mapping[(start + offset).to_bytes(size, 'big')] = _utf16(item)
+            else:
+                base = int(target[1:-1] or b'0', 16)
+                digits = max(len(target) - 2, 4)
+                for offset in range(stop - start + 1):
+                    mapping[(start + offset).to_bytes(size, 'big')] = _utf16(
+                        format(base + offset, f'0{digits}x').encode()
+                    )
+    return mapping, width
+
+def _decode_text(raw: bytes, font: Tuple[Optional[Dict[bytes, str]], int]) -> str:
+    mapping, width = font
+    if mapping is None:
+        # Two-byte fonts without ToUnicode have no recoverable text
+        return '' if width == 2 else raw.decode('cp1252', errors='ignore')
+    return ''.join(mapping.get(raw[i:i + width], '') for i in range(0, len(raw) - width + 1, width))
+
+def _page_text(document: PdfDocument, content: bytes, resources: dict, depth: int = 0) -> List[str]:
+    """Run the text operators of a content stream"""
+    fonts = document.resolve(resources.get('Font')) or {}
+    xobjects = document.resolve(resources.get('XObject')) or {}
+    font = (None, 1)
+    out: List[str] = []
+    operands: list = []
+    for token in _tokens(content):
+        if token is _OPEN_ARRAY:
+            operands.append(_OPEN_ARRAY)
+            continue
+        if token is _CLOSE_ARRAY:
+            start = max(i for i, item in enumerate(operands) if item is _OPEN_ARRAY) \
+                if any(item is _OPEN_ARRAY for item in operands) else len(operands)
+            array = operands[start + 1:]
+            del operands[start:]
+            operands.append(array)
+            continue
+        if token is _OPEN_DICT or token is _CLOSE_DICT or not isinstance(token, Operator):
+            operands.append(token)
+            continue
+
+        op = token
+        if op == 'Tf' and len(operands) >= 2 and isinstance(operands[-2], Name):
+            font = document.font_map(fonts.get(operands[-2]) if isinstance(fonts, dict) else None)
+        elif op == 'Tj' and operands and isinstance(operands[-1], bytes):
+            out.append(_decode_text(operands[-1], font))
+        elif op in ("'", '"') and operands and isinstance(operands[-1], bytes):
+            out.append('\n' + _decode_text(operands[-1], font))
+        elif op == 'TJ' and operands and isinstance(operands[-1], list):
+            for item in operands[-1]:
+                if isinstance(item, bytes):
+                    out.append(_decode_text(item, font))
+                elif isinstance(item, (int, float)) and item < -TJ_SPACE_THRESHOLD:
+                    out.append(' ')
+        elif op in ('T*', 'ET'):
+            out.append('\n')
+        elif op in ('Td', 'TD') and len(operands) >= 2 and isinstance(operands[-1], (int, float)):
+            out.append('\n' if operands[-1] != 0 else ' ')
+        elif op == 'Do' and operands and isinstance(operands[-1], Name) and depth < MAX_FORM_DEPTH \
+                and isinstance(xobjects, dict):
+            ref = xobjects.get(operands[-1])
+            form = document.resolve(ref)
+            if isinstance(ref, Ref) and isinstance(form, dict) and form.get('Subtype') == 'Form':
+                form_resources = document.resolve(form.get('Resources')) or resources
+                out.extend(_page_text(document, document.stream(ref.num), form_resources, depth + 1))
+        operands = []
+    return out
+
+def iter_pdf_pages(data: bytes) -> Iterator[str]:
+    """Text of each page in order; a page's streams are decoded only when it is reached"""
+    if not data.startswith(b'%PDF'):
+        raise ExtractionError('Not a PDF file')
+    document = PdfDocument(data)
+    for page, resources in document.pages():
+        text = ''.join(_page_text(document, document.content(page), resources))
+        yield re.sub(r'[ \t]+', ' ', re.sub(r'\n\s*\n+', '\n', text))
+
+# --- Word ---
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+def iter_docx_paragraphs(data: bytes) -> Iterator[str]:
+    """Paragraphs of word/document.xml, parsed incrementally"""
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile as e:
+        raise ExtractionError(f'Not a DOCX file: {e}')
+    with archive:
+        try:
+            info = archive.getinfo('word/document.xml')
+        except KeyError:
+            raise ExtractionError('DOCX without word/document.xml')
+        if info.file_size > MAX_DOCX_XML_SIZE:
+            raise ExtractionError('DOCX document is too large')
+        with archive.open(info) as document:
+            parts: List[str] = []
+            for _, element in ElementTree.iterparse(document, events=('end',)):
+                tag = element.tag
+                if tag == _W + 't':
+                    parts.append(element.text or '')
+                elif tag == _W + 'tab':
+                    parts.append('\t')
+                elif tag in (_W + 'br', _W + 'cr'):
+                    parts.append('\n')
+                elif tag == _W + 'p':
+                    yield ''.join(parts)
+                    parts = []
+                    element.clear()
+            if parts:
+                yield ''.join(parts)
+
+# Runs of UTF-16LE Latin or Cyrillic text inside a binary .doc
+_DOC_TEXT_RE = re.compile(rb'(?:[\x09\x0a\x0d\x20-\x7e]\x00|[\x00-\xff]\x04){8,}')
+
+def iter_doc_strings(data: bytes) -> Iterator[str]:
+    """Best effort for legacy binary Word files, which have no pure-Python parser:
+    text stored as UTF-16LE is picked out of the file"""
+    for match in _DOC_TEXT_RE.finditer(data):
+        yield match.group(0).decode('utf-16-le', errors='ignore').replace('\r', '\n')
@@ -1,57 +1,720 @@
 import json
 import base64
+import codecs
+import hashlib
+import io
 import os
-from typing import Dict, Any
+import secrets
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+from db import connection
+from timing import count, instrument, stage
+from responses import CORS_HEADERS, etag_matches, json_response, negotiated, preflight, request_header, with_etag
+from text_index import chunk_text, analyze_chunks
+from embedding import embed, quantize
+from extractors import extract_document_text, is_document_file
+from job_queue import Job, complete, dequeue, enqueue, fail, queue_stats
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Bump when extract_text_from_file or make_thumbnail changes: reindex re-extracts older rows
+EXTRACTOR_VERSION = 4
+
+THUMBNAIL_SIZE = (192, 192)
+THUMBNAIL_TYPE = 'image/webp'
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Multipart upload: a base64 part of MAX_PART_SIZE bytes stays under the gateway body limit
+MAX_PART_SIZE = 4 * 1024 * 1024
+MAX_PARTS = 10000
+# Images above this size are stored without a thumbnail instead of being held in memory
+MAX_THUMBNAIL_SOURCE_SIZE = 20 * 1024 * 1024
+UPLOAD_EXPIRY_HOURS = 24
+UPLOAD_ACTIONS = ('upload_init', 'upload_part', 'upload_status', 'upload_complete')
+
+# Heavy work runs as jobs (job_queue.py) after the upload request has returned:
+# PDF/DOCX/DOC extraction, thumbnails and reindexing.
+# files.extraction_status: pending -> processing -> done | failed
+EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS', '0')) or os.cpu_count() or 1
+JOB_BATCH_SIZE = 8
 
 def is_image_file(file_name: str) -> bool:
     """Check if file is an image based on extension"""
     image_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.svg')
     return file_name.lower().endswith(image_extensions)
 
+def extract_text_from_file(file_content: bytes, file_name: str) -> str:
+    if is_image_file(file_name):
+        return ''
+    
+    if is_document_file(file_name):
+        return extract_document_text(file_content, file_name)
+    
+    return extract_text_from_decoded(file_content.decode('utf-8', errors='ignore'), file_name)
+
+def extract_text_from_decoded(text: str, file_name: str) -> str:
+    """Same extraction for content that was already decoded part by part"""
+    file_lower = file_name.lower()
+    
+    if file_lower.endswith('.txt'):
+        return text
+    
+    elif file_lower.endswith('.json'):
+        try:
+            data = json.loads(text)
+            return json.dumps(data, indent=2, ensure_ascii=False)
+        except:
+            return text
+    
+    else:
+        return text
+
+def make_thumbnail(file_data: bytes, file_name: str) -> Optional[bytes]:
+    """Small WebP preview for the admin file list; None for non-images,
+    SVG (already small and scalable) or when Pillow is unavailable"""
+    if Image is None or not is_image_file(file_name) or file_name.lower().endswith('.svg'):
+        return None
+    try:
+        with Image.open(io.BytesIO(file_data)) as image:
+            # Lets the JPEG decoder downscale while decoding
+            image.draft('RGB', THUMBNAIL_SIZE)
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+            image.thumbnail(THUMBNAIL_SIZE)
+            output = io.BytesIO()
+            image.save(output, 'WEBP', quality=75)
+            return output.getvalue()
+    except Exception:
+        return None
+
+def encode_cursor(uploaded_at: datetime, file_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{uploaded_at.isoformat()}|{file_id}".encode()).decode()
+
+def decode_cursor(cursor_value: str) -> Tuple[datetime, int]:
+    uploaded_at, file_id = base64.urlsafe_b64decode(cursor_value.encode()).decode().split('|')
+    return datetime.fromisoformat(uploaded_at), int(file_id)
+
+def remove_file_index(cursor, file_id: int) -> None:
+    """Drop postings of a file and subtract it from corpus statistics"""
+    cursor.execute(
+        """UPDATE search_terms t SET doc_freq = t.doc_freq - f.doc_count
+           FROM search_file_terms f WHERE f.file_id = %s AND f.term = t.term""",
+        (file_id,)
+    )
+    cursor.execute(
+        """UPDATE search_stats s SET
+             doc_count = s.doc_count - old.doc_count,
+             total_terms = s.total_terms - old.total_terms,
+             desc_count = s.desc_count - old.desc_count,
+             desc_terms = s.desc_terms - old.desc_terms
+           FROM (
+             SELECT COUNT(*) AS doc_count,
+                    COALESCE(SUM(term_count), 0) AS total_terms,
+                    COUNT(*) FILTER (WHERE chunk_no = 0) AS desc_count,
+                    COALESCE(SUM(term_count) FILTER (WHERE chunk_no = 0), 0) AS desc_terms
+             FROM document_chunks WHERE file_id = %s
+           ) old
+           WHERE s.id = 1""",
+        (file_id,)
+    )
+    cursor.execute("DELETE FROM search_file_terms WHERE file_id = %s", (file_id,))
+    cursor.execute("DELETE FROM search_postings WHERE file_id = %s", (file_id,))
+    cursor.execute("DELETE FROM document_chunks WHERE file_id = %s", (file_id,))
+
+def canonical_file_id(cursor, file_id: int) -> int:
+    """Oldest file with the same content; identical uploads share its indexed text"""
+    with cursor.connection.cursor() as lookup:
+        lookup.execute(
+            """SELECT COALESCE(MIN(c.id), %s) FROM files f
+               JOIN files c ON c.content_hash = f.content_hash
+               WHERE f.id = %s""",
+            (file_id, file_id)
+        )
+        return lookup.fetchone()[0]
+
+def index_file(cursor, file_id: int, text: str, description: str) -> int:
+    """Rebuild chunks and inverted index of one file: chunk 0 is the description, text chunks start at 1.
+    A copy of already uploaded content only indexes its description, so answers
+    do not repeat the same text once per copy"""
+    remove_file_index(cursor, file_id)
+    
+    if canonical_file_id(cursor, file_id) != file_id:
+        text = ''
+    
+    chunks = {}
+    if description and description.strip():
+        chunks[0] = description.strip()
+    for chunk_no, chunk in enumerate(chunk_text(text), start=1):
+        chunks[chunk_no] = chunk
+    
+    if not chunks:
+        return 0
+    
+    term_counts, postings, doc_freq = analyze_chunks(chunks)
+    
+    execute_values(
+        cursor,
+        "INSERT INTO document_chunks (file_id, chunk_no, content, term_count, embedding) VALUES %s",
+        [(file_id, chunk_no, content, term_counts[chunk_no], quantize(embed(content)))
+         for chunk_no, content in chunks.items()],
+        page_size=500
+    )
+    if postings:
+        execute_values(
+            cursor,
+            "INSERT INTO search_postings (term, file_id, chunk_no, tf) VALUES %s",
+            [(term, file_id, chunk_no, tf) for term, chunk_no, tf in postings],
+            page_size=1000
+        )
+    if doc_freq:
+        execute_values(
+            cursor,
+            "INSERT INTO search_file_terms (file_id, term, doc_count) VALUES %s",
+            [(file_id, term, count) for term, count in doc_freq.items()],
+            page_size=1000
+        )
+        execute_values(
+            cursor,
+            """INSERT INTO search_terms (term, doc_freq) VALUES %s
+               ON CONFLICT (term) DO UPDATE SET doc_freq = search_terms.doc_freq + EXCLUDED.doc_freq""",
+            sorted(doc_freq.items()),
+            page_size=1000
+        )
+    
+    cursor.execute(
+        """UPDATE search_stats SET
+             doc_count = doc_count + %s,
+             total_terms = total_terms + %s,
+             desc_count = desc_count + %s,
+             desc_terms = desc_terms + %s
+           WHERE id = 1""",
+        (len(chunks), sum(term_counts.values()), 1 if 0 in chunks else 0, term_counts.get(0, 0))
+    )
+    return len(chunks)
+
+def bump_corpus_version(cursor) -> None:
+    """Invalidate cached ai-chat answers: they are keyed on this version"""
+    cursor.execute(
+        """WITH bumped AS (
+             INSERT INTO settings (key, value, updated_at) VALUES ('corpus_version', '1', CURRENT_TIMESTAMP)
+             ON CONFLICT (key) DO UPDATE
+             SET value = (COALESCE(settings.value, '0')::bigint + 1)::text, updated_at = CURRENT_TIMESTAMP
+             RETURNING value::bigint AS version
+           )
+           DELETE FROM answer_cache WHERE corpus_version < (SELECT version FROM bumped)"""
+    )
+
+def find_blob(cursor, content_hash: str) -> Optional[Tuple[str, Optional[bytes], int]]:
+    """Extracted text, thumbnail and size of content stored before,
+    if the current extractor produced them"""
+    with cursor.connection.cursor() as lookup:
+        lookup.execute(
+            """SELECT extracted_text, thumbnail, size FROM file_blobs
+               WHERE content_hash = %s AND extractor_version = %s""",
+            (content_hash, EXTRACTOR_VERSION)
+        )
+        row = lookup.fetchone()
+    if not row:
+        return None
+    return row[0] or '', bytes(row[1]) if row[1] is not None else None, row[2]
+
+def save_blob(cursor, content_hash: str, file_data: bytes, text: str, thumbnail: Optional[bytes],
+              extractor_version: Optional[int] = EXTRACTOR_VERSION) -> None:
+    """Store content once per hash; for known content only the extraction results are refreshed.
+    extractor_version None stores a document whose extraction is still pending"""
+    cursor.execute(
+        """INSERT INTO file_blobs (content_hash, data, size, extracted_text, thumbnail, extractor_version)
+           VALUES (%s, %s, %s, %s, %s, %s)
+           ON CONFLICT (content_hash) DO UPDATE
+           SET extracted_text = EXCLUDED.extracted_text, thumbnail = EXCLUDED.thumbnail,
+               extractor_version = EXCLUDED.extractor_version""",
+        (content_hash, file_data, len(file_data), text, thumbnail, extractor_version)
+    )
+
+def insert_file(cursor, file_name: str, file_type: str, file_size: int, session_id: str, description: str,
+                content_hash: str, text: str, thumbnail: Optional[bytes], extraction_status: str = 'done') -> int:
+    """Logical file row referencing its blob by content_hash, indexed right away
+    (a pending document by its description until its extract job has run)"""
+    with cursor.connection.cursor() as insert:
+        insert.execute(
+            """INSERT INTO files (file_name, file_type, file_size, session_id, description,
+                                  extracted_text, content_hash, thumbnail, extractor_version, extraction_status)
+               VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id""",
+            (file_name, file_type, file_size, session_id, description, text, content_hash, thumbnail,
+             EXTRACTOR_VERSION if extraction_status == 'done' else None, extraction_status)
+        )
+        file_id = insert.fetchone()[0]
+    index_file(cursor, file_id, text, description)
+    bump_corpus_version(cursor)
+    return file_id
+
+def extract_file(cursor, file_id: int) -> str:
+    """Extract text and thumbnail once per distinct content and keep them next to the file.
+    Rows from before content-addressed storage move their bytes into file_blobs"""
+    cursor.execute("SELECT file_name, content_hash FROM files WHERE id = %s", (file_id,))
+    file_name, content_hash = cursor.fetchone()
+    
+    derived = find_blob(cursor, content_hash) if content_hash else None
+    status = 'done'
+    if derived is None:
+        cursor.execute(
+            """SELECT COALESCE(b.data, f.file_data), f.extracted_text FROM files f
+               LEFT JOIN file_blobs b ON b.content_hash = f.content_hash
+               WHERE f.id = %s""",
+            (file_id,)
+        )
+        file_data, previous_text = cursor.fetchone()
+        file_data = bytes(file_data or b'')
+        content_hash = hashlib.sha256(file_data).hexdigest()
+        if is_document_file(file_name):
+            # Parsed later by an extract job; the previous text stays searchable until then
+            derived = previous_text or '', None, len(file_data)
+            save_blob(cursor, content_hash, file_data, '', None, extractor_version=None)
+            queue_extraction(cursor, content_hash, file_name)
+            status = 'pending'
+        else:
+            derived = extract_text_from_file(file_data, file_name), make_thumbnail(file_data, file_name), len(file_data)
+            save_blob(cursor, content_hash, file_data, derived[0], derived[1])
+    
+    text, thumbnail, _ = derived
+    cursor.execute(
+        """UPDATE files SET extracted_text = %s, content_hash = %s, thumbnail = %s, extractor_version = %s,
+                             extraction_status = %s, file_data = NULL, updated_at = CURRENT_TIMESTAMP
+           WHERE id = %s""",
+        (text, content_hash, thumbnail, EXTRACTOR_VERSION if status == 'done' else None, status, file_id)
+    )
+    return text
+
+def reindex_file(cursor, file_id: int) -> None:
+    """Rebuild index of a stored file, re-extracting text only if the extractor changed"""
+    cursor.execute("SELECT extracted_text, extractor_version, description FROM files WHERE id = %s", (file_id,))
+    row = cursor.fetchone()
+    if not row:
+        return
+    text, extractor_version, description = row
+    if extractor_version != EXTRACTOR_VERSION or text is None:
+        text = extract_file(cursor, file_id)
+    index_file(cursor, file_id, text, description or '')
+
+def queue_extraction(cursor, content_hash: str, file_name: str) -> None:
+    """Parse a stored document outside the request; one queued job per content"""
+    enqueue(cursor, 'extract', {'contentHash': content_hash, 'fileName': file_name}, dedup_key=content_hash)
+
+def queue_thumbnail(cursor, content_hash: str, file_name: str) -> None:
+    enqueue(cursor, 'thumbnail', {'contentHash': content_hash, 'fileName': file_name}, dedup_key=content_hash)
+
+def queue_derived_work(cursor, content_hash: str, file_name: str) -> None:
+    """Jobs for newly stored content: text of documents, thumbnails of images"""
+    if is_document_file(file_name):
+        queue_extraction(cursor, content_hash, file_name)
+    elif is_image_file(file_name):
+        queue_thumbnail(cursor, content_hash, file_name)
+
+def extract_stored_document(task: Tuple[str, str, str]) -> Tuple[str, Optional[str], Optional[str], bool]:
+    """Process pool entry point. The worker reads the blob itself, so file bytes are
+    not pickled between processes, and opens its own connection: a pool inherited
+    through fork would share sockets with the parent.
+    Returns hash, text, error and whether the error is worth a retry"""
+    dsn, content_hash, file_name = task
+    try:
+        conn = psycopg2.connect(dsn)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT data FROM file_blobs WHERE content_hash = %s", (content_hash,))
+                row = cursor.fetchone()
+        finally:
+            conn.close()
+    except psycopg2.Error as e:
+        return content_hash, None, str(e) or type(e).__name__, True
+    if not row:
+        return content_hash, None, 'Blob not found', False
+    try:
+        return content_hash, extract_document_text(bytes(row[0]), file_name), None, False
+    except Exception as e:
+        # Parse errors repeat on every attempt
+        return content_hash, None, str(e) or type(e).__name__, False
+
+def run_extractions(dsn: str, tasks: List[Tuple[str, str]]) -> List[Tuple[str, Optional[str], Optional[str], bool]]:
+    jobs = [(dsn, content_hash, file_name) for content_hash, file_name in tasks]
+    if len(jobs) == 1:
+        return [extract_stored_document(jobs[0])]
+    try:
+        with ProcessPoolExecutor(max_workers=min(EXTRACTION_WORKERS, len(jobs))) as pool:
+            return list(pool.map(extract_stored_document, jobs))
+    except (OSError, NotImplementedError, BrokenProcessPool):
+        # Runtimes without working multiprocessing (no /dev/shm) extract in-process
+        return [extract_stored_document(job) for job in jobs]
+
+def apply_extraction(cursor, content_hash: str, text: Optional[str], error: Optional[str]) -> None:
+    """Store extracted text on the blob and on every waiting file with that content, then index them.
+    A failed blob keeps no extractor version, so a later upload of the same bytes tries again"""
+    if error is None:
+        cursor.execute(
+            "UPDATE file_blobs SET extracted_text = %s, extractor_version = %s WHERE content_hash = %s",
+            (text, EXTRACTOR_VERSION, content_hash)
+        )
+    cursor.execute(
+        """UPDATE files SET extracted_text = COALESCE(%s, extracted_text, ''), extractor_version = %s,
+                             extraction_status = %s, updated_at = CURRENT_TIMESTAMP
+           WHERE content_hash = %s AND extraction_status IN ('pending', 'processing')
+           RETURNING id, extracted_text, description""",
+        (text, EXTRACTOR_VERSION, 'failed' if error is not None else 'done', content_hash)
+    )
+    for file_id, file_text, description in sorted(cursor.fetchall()):
+        index_file(cursor, file_id, file_text, description or '')
+
+def store_thumbnail(cursor, content_hash: str, file_name: str) -> None:
+    """Thumbnail of an uploaded image, shared by every file with that content"""
+    cursor.execute(
+        "SELECT data FROM file_blobs WHERE content_hash = %s AND size <= %s",
+        (content_hash, MAX_THUMBNAIL_SOURCE_SIZE)
+    )
+    row = cursor.fetchone()
+    thumbnail = make_thumbnail(bytes(row[0]), file_name) if row else None
+    if thumbnail is None:
+        return
+    cursor.execute("UPDATE file_blobs SET thumbnail = %s WHERE content_hash = %s", (thumbnail, content_hash))
+    cursor.execute(
+        "UPDATE files SET thumbnail = %s WHERE content_hash = %s AND thumbnail IS NULL",
+        (thumbnail, content_hash)
+    )
+
+def run_job(cursor, job: Job, extraction: Optional[Tuple[str, Optional[str], Optional[str], bool]]) -> None:
+    if job.kind == 'extract':
+        content_hash, text, error, retryable = extraction
+        if retryable:
+            raise RuntimeError(error)
+        apply_extraction(cursor, content_hash, text, error)
+        bump_corpus_version(cursor)
+    elif job.kind == 'thumbnail':
+        store_thumbnail(cursor, job.payload['contentHash'], job.payload['fileName'])
+    elif job.kind == 'reindex':
+        reindex_file(cursor, job.payload['fileId'])
+        bump_corpus_version(cursor)
+    else:
+        raise ValueError(f'Unknown job kind: {job.kind}')
+
+def process_jobs(conn, dsn: str, limit: int) -> Dict[str, int]:
+    """Claim up to `limit` due jobs and run them, each in its own transaction.
+    Documents of the batch are parsed together in the process pool first"""
+    jobs = dequeue(conn, limit)
+    cursor = conn.cursor()
+    
+    extract_jobs = [job for job in jobs if job.kind == 'extract']
+    extractions = {}
+    if extract_jobs:
+        hashes = [job.payload['contentHash'] for job in extract_jobs]
+        cursor.execute(
+            """UPDATE files SET extraction_status = 'processing'
+               WHERE content_hash = ANY(%s) AND extraction_status = 'pending'""",
+            (hashes,)
+        )
+        conn.commit()
+        tasks = [(job.payload['contentHash'], job.payload['fileName']) for job in extract_jobs]
+        extractions = {result[0]: result for result in run_extractions(dsn, tasks)}
+    
+    completed = retried = failed = 0
+    for job in jobs:
+        try:
+            run_job(cursor, job, extractions.get(job.payload.get('contentHash')))
+            complete(cursor, job)
+            conn.commit()
+            completed += 1
+        except Exception as e:
+            conn.rollback()
+            error = str(e) or type(e).__name__
+            if fail(cursor, job, error):
+                retried += 1
+            else:
+                failed += 1
+                if job.kind == 'extract':
+                    apply_extraction(cursor, job.payload['contentHash'], None, error)
+            conn.commit()
+    
+    cursor.close()
+    return {'claimed': len(jobs), 'completed': completed, 'retried': retried, 'failed': failed}
+
+def serve_file_content(cursor, file_id: str, if_none_match: str) -> Dict[str, Any]:
+    """Raw file bytes for image references; content_hash is the ETag, so the
+    response is immutable for clients that request it with ?v=<hash>"""
+    cursor.execute("SELECT content_hash FROM files WHERE id = %s", (file_id,))
+    row = cursor.fetchone()
+    if not row:
+        return json_response(404, {'error': 'File not found'})
+    
+    etag = f'"{row["content_hash"]}"' if row['content_hash'] else ''
+    cache_control = 'public, max-age=31536000, immutable' if etag else 'no-cache'
+    
+    if etag and etag_matches(etag, if_none_match):
+        return {'statusCode': 304, 'headers': {**CORS_HEADERS, 'ETag': etag, 'Cache-Control': cache_control}, 'body': ''}
+    
+    with stage('blob'):
+        cursor.execute(
+            """SELECT f.file_name, f.file_type, COALESCE(b.data, f.file_data) AS file_data FROM files f
+               LEFT JOIN file_blobs b ON b.content_hash = f.content_hash
+               WHERE f.id = %s""",
+            (file_id,)
+        )
+        row = cursor.fetchone()
+    count('bytes_read', len(row['file_data'] or b''))
+    headers = {
+        **CORS_HEADERS,
+        'Content-Type': row['file_type'] or 'application/octet-stream',
+        'Cache-Control': cache_control
+    }
+    if etag:
+        headers['ETag'] = etag
+    
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'isBase64Encoded': True,
+        'body': base64.b64encode(bytes(row['file_data'] or b'')).decode('utf-8')
+    }
+
+def stream_upload_parts(conn, upload_id: str, file_name: str) -> Tuple[str, str, int]:
+    """One pass over the stored parts through a server-side cursor: the hash and
+    UTF-8 decoding are incremental, so the raw file is never held in memory.
+    Returns extracted text, SHA-256 and size; images and documents are only hashed,
+    their thumbnail or text comes from a job"""
+    digest = hashlib.sha256()
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    pieces = []
+    binary = is_image_file(file_name) or is_document_file(file_name)
+    size = 0
+    
+    with conn.cursor(name='upload_parts_stream') as parts_cursor:
+        parts_cursor.itersize = 1
+        parts_cursor.execute("SELECT data FROM upload_parts WHERE upload_id = %s ORDER BY part_no", (upload_id,))
+        for (data,) in parts_cursor:
+            data = bytes(data)
+            digest.update(data)
+            size += len(data)
+            if not binary:
+                pieces.append(decoder.decode(data))
+    
+    if binary:
+        return '', digest.hexdigest(), size
+    
+    pieces.append(decoder.decode(b'', final=True))
+    return extract_text_from_decoded(''.join(pieces), file_name), digest.hexdigest(), size
+
+def handle_upload_action(conn, action: str, body: Dict[str, Any]) -> Dict[str, Any]:
+    """Resumable multipart upload: upload_init -> upload_part (any order, retries
+    overwrite) -> upload_complete; upload_status lists stored parts with their
+    checksums so an interrupted client only resends what is missing"""
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    
+    if action == 'upload_init':
+        part_count = int(body.get('partCount') or 0)
+        if not 1 <= part_count <= MAX_PARTS:
+            return json_response(400, {'error': f'partCount must be between 1 and {MAX_PARTS}'})
+        
+        # No dedup by a client-supplied hash: hashes are public (listings, ?v= image URLs),
+        # so it would hand out stored content to anyone. upload_complete dedups the received bytes
+        # Abandoned uploads are dropped together with their parts
+        cursor.execute(
+            "DELETE FROM upload_sessions WHERE file_id IS NULL AND created_at < NOW() - make_interval(hours => %s)",
+            (UPLOAD_EXPIRY_HOURS,)
+        )
+        upload_id = secrets.token_urlsafe(24)
+        cursor.execute(
+            """INSERT INTO upload_sessions (id, file_name, file_type, session_id, description, part_count)
+               VALUES (%s, %s, %s, %s, %s, %s)""",
+            (upload_id, body.get('filename', 'unknown'), body.get('fileType', 'unknown'),
+             body.get('sessionId', 'anonymous'), body.get('description', ''), part_count)
+        )
+        conn.commit()
+        return json_response(200, {'uploadId': upload_id, 'partCount': part_count, 'maxPartSize': MAX_PART_SIZE})
+    
+    # Parts of one upload may arrive in parallel; complete waits for them and blocks new ones
+    lock = {'upload_complete': 'FOR UPDATE', 'upload_part': 'FOR SHARE'}.get(action, '')
+    upload_id = body.get('uploadId')
+    cursor.execute(
+        f"""SELECT id, file_name, file_type, session_id, description, part_count, file_id
+            FROM upload_sessions WHERE id = %s {lock}""",
+        (upload_id,)
+    )
+    upload = cursor.fetchone()
+    if not upload:
+        return json_response(404, {'error': 'Upload not found'})
+    
+    if action == 'upload_status':
+        cursor.execute(
+            "SELECT part_no, size, sha256 FROM upload_parts WHERE upload_id = %s ORDER BY part_no",
+            (upload_id,)
+        )
+        parts = [
+            {'partNumber': row['part_no'], 'size': row['size'], 'sha256': row['sha256']}
+            for row in cursor.fetchall()
+        ]
+        return json_response(200, {
+            'uploadId': upload_id,
+            'partCount': upload['part_count'],
+            'parts': parts,
+            'file_id': upload['file_id']
+        })
+    
+    if upload['file_id'] is not None:
+        # Completed already: a retried complete gets the same file back
+        if action == 'upload_complete':
+            return json_response(200, {'success': True, 'file_id': upload['file_id']})
+        return json_response(409, {'error': 'Upload already completed'})
+    
+    if action == 'upload_part':
+        try:
+            part_number = int(body.get('partNumber') or 0)
+        except (TypeError, ValueError):
+            part_number = 0
+        if not 1 <= part_number <= upload['part_count']:
+            return json_response(400, {'error': f"partNumber must be between 1 and {upload['part_count']}"})
+        
+        try:
+            # validate=True rejects stray characters instead of skipping them into a corrupt part
+            data = base64.b64decode(body.get('content', ''), validate=True)
+        except (TypeError, ValueError):
+            return json_response(400, {'error': 'content must be base64'})
+        if len(data) > MAX_PART_SIZE:
+            return json_response(413, {'error': f'Part is larger than {MAX_PART_SIZE} bytes'})
+        
+        checksum = hashlib.sha256(data).hexdigest()
+        if body.get('sha256') and body['sha256'].lower() != checksum:
+            return json_response(400, {'error': 'Checksum mismatch', 'sha256': checksum})
+        
+        cursor.execute(
+            """INSERT INTO upload_parts (upload_id, part_no, data, size, sha256) VALUES (%s, %s, %s, %s, %s)
+               ON CONFLICT (upload_id, part_no)
+               DO UPDATE SET data = EXCLUDED.data, size = EXCLUDED.size, sha256 = EXCLUDED.sha256,
+                             created_at = CURRENT_TIMESTAMP""",
+            (upload_id, part_number, data, len(data), checksum)
+        )
+        conn.commit()
+        return json_response(200, {'partNumber': part_number, 'size': len(data), 'sha256': checksum})
+    
+    # upload_complete
+    cursor.execute(
+        """SELECT n AS part_no FROM generate_series(1, %s) AS n
+           WHERE NOT EXISTS (SELECT 1 FROM upload_parts p WHERE p.upload_id = %s AND p.part_no = n)""",
+        (upload['part_count'], upload_id)
+    )
+    missing = [row['part_no'] for row in cursor.fetchall()]
+    if missing:
+        return json_response(409, {'error': 'Upload is incomplete', 'missingParts': missing})
+    
+    extracted_text, content_hash, file_size = stream_upload_parts(conn, upload_id, upload['file_name'])
+    
+    # The database concatenates the parts itself: the file bytes never pass through Python.
+    # Content stored before keeps its blob and extraction results
+    derived = find_blob(cursor, content_hash)
+    extraction_status = 'done'
+    thumbnail = None
+    if derived is None:
+        if is_document_file(upload['file_name']):
+            extraction_status = 'pending'
+        cursor.execute(
+            """INSERT INTO file_blobs (content_hash, data, size, extracted_text, thumbnail, extractor_version)
+               SELECT %s, string_agg(data, ''::bytea ORDER BY part_no), %s, %s, %s, %s
+               FROM upload_parts WHERE upload_id = %s
+               ON CONFLICT (content_hash) DO UPDATE
+               SET extracted_text = EXCLUDED.extracted_text, thumbnail = EXCLUDED.thumbnail,
+                   extractor_version = EXCLUDED.extractor_version""",
+            (content_hash, file_size, extracted_text, thumbnail,
+             EXTRACTOR_VERSION if extraction_status == 'done' else None, upload_id)
+        )
+    else:
+        extracted_text, thumbnail, _ = derived
+    
+    file_id = insert_file(cursor, upload['file_name'], upload['file_type'], file_size, upload['session_id'],
+                          upload['description'] or '', content_hash, extracted_text, thumbnail, extraction_status)
+    if derived is None:
+        queue_derived_work(cursor, content_hash, upload['file_name'])
+    
+    cursor.execute("UPDATE upload_sessions SET file_id = %s WHERE id = %s", (file_id, upload_id))
+    cursor.execute("DELETE FROM upload_parts WHERE upload_id = %s", (upload_id,))
+    conn.commit()
+    cursor.close()
+    
+    return json_response(200, {
+        'success': True,
+        'file_id': file_id,
+        'deduplicated': derived is not None,
+        'extractionStatus': extraction_status,
+        'file': {'filename': upload['file_name'], 'size': file_size, 'hash': content_hash}
+    })
+
+@instrument('file-upload')
+@negotiated
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Handle file uploads and store in database with binary data
     Args: event with httpMethod, body containing file data
+          or an upload_* action of the multipart protocol for large files,
+          or action 'process_jobs' to run a batch of queued jobs (worker.py runs them continuously)
     Returns: Success response with file_id for later analysis
     '''
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+        return preflight('GET, POST, DELETE, OPTIONS', 'Content-Type, If-None-Match')
     
     if method == 'GET':
         database_url = os.environ.get('DATABASE_URL')
         
         if not database_url:
-            return {
-                'statusCode': 500,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Database not configured'})
-            }
+            return json_response(500, {'error': 'Database not configured'})
         
         try:
-            conn = psycopg2.connect(database_url)
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            
-            cursor.execute(
-                "SELECT id, file_name, file_type, file_size, file_data, session_id, uploaded_at, description FROM files ORDER BY uploaded_at DESC"
-            )
-            
-            files = cursor.fetchall()
+            with connection(database_url) as conn:
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                
+                query_params = event.get('queryStringParameters', {}) or {}
+                if query_params.get('id'):
+                    response = serve_file_content(cursor, query_params['id'], request_header(event, 'if-none-match'))
+                    cursor.close()
+                    return response
+                
+                try:
+                    page_size = min(int(query_params.get('limit') or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE)
+                    before = decode_cursor(query_params['cursor']) if query_params.get('cursor') else None
+                except ValueError:
+                    page_size, before = 0, None
+                if page_size < 1:
+                    cursor.close()
+                    return json_response(400, {'error': 'Invalid limit/cursor'})
+                
+                # Метаданные и миниатюры, file_data не читается; keyset-пагинация по (uploaded_at, id)
+                with stage('list'):
+                    if before is not None:
+                        cursor.execute(
+                            """SELECT id, file_name, file_type, file_size, uploaded_at, description, content_hash, thumbnail,
+                                      extraction_status
+                               FROM files WHERE (uploaded_at, id) < (%s, %s)
+                               ORDER BY uploaded_at DESC, id DESC LIMIT %s""",
+                            (*before, page_size + 1)
+                        )
+                    else:
+                        cursor.execute(
+                            """SELECT id, file_name, file_type, file_size, uploaded_at, description, content_hash, thumbnail,
+                                      extraction_status
+                               FROM files ORDER BY uploaded_at DESC, id DESC LIMIT %s""",
+                            (page_size + 1,)
+                        )
+                    
+                    files = cursor.fetchall()
+                count('rows_read', len(files))
+                count('bytes_read', sum(len(f['thumbnail']) for f in files if f['thumbnail'] is not None))
+                
+                cursor.close()
             
-            cursor.close()
-            conn.close()
+            has_more = len(files) > page_size
+            files = files[:page_size]
             
             files_list = []
             for f in files:
@@ -61,43 +724,35 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'type': f['file_type'],
                     'size': f['file_size'],
                     'uploadedAt': f['uploaded_at'].isoformat() if f['uploaded_at'] else None,
-                    'description': f.get('description', '')
+                    'description': f.get('description', ''),
+                    'hash': f['content_hash'],
+                    'extractionStatus': f['extraction_status']
                 }
                 
-                # Add base64 data for images (24x24 thumbnail)
                 if is_image_file(f['file_name']):
-                    file_data = bytes(f['file_data'])
                     file_info['isImage'] = True
-                    file_info['base64'] = base64.b64encode(file_data).decode('utf-8')
                     file_info['mimeType'] = f['file_type'] or 'image/jpeg'
+                    if f['thumbnail'] is not None:
+                        file_info['thumbnail'] = base64.b64encode(bytes(f['thumbnail'])).decode('utf-8')
+                        file_info['thumbnailType'] = THUMBNAIL_TYPE
                 else:
                     file_info['isImage'] = False
                 
                 files_list.append(file_info)
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps({'files': files_list})
-            }
+            next_cursor = encode_cursor(files[-1]['uploaded_at'], files[-1]['id']) if has_more else None
+            
+            # Revalidation returns 304 without the thumbnails when the page has not changed
+            return with_etag(event, json_response(200, {'files': files_list, 'nextCursor': next_cursor}))
         
         except Exception as e:
-            return {
-                'statusCode': 500,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': str(e)})
-            }
+            return json_response(500, {'error': str(e)})
     
     if method == 'PUT':
         database_url = os.environ.get('DATABASE_URL')
         
         if not database_url:
-            return {
-                'statusCode': 500,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Database not configured'})
-            }
+            return json_response(500, {'error': 'Database not configured'})
         
         try:
             body = json.loads(event.get('body', '{}'))
@@ -105,46 +760,84 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             description = body.get('description', '')
             
             if not file_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'fileId is required'})
-                }
-            
-            conn = psycopg2.connect(database_url)
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                "UPDATE files SET description = %s WHERE id = %s",
-                (description, file_id)
-            )
+                return json_response(400, {'error': 'fileId is required'})
             
-            conn.commit()
-            cursor.close()
-            conn.close()
+            with connection(database_url) as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute(
+                    "UPDATE files SET description = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+                    (description, file_id)
+                )
+                reindex_file(cursor, file_id)
+                bump_corpus_version(cursor)
+                
+                conn.commit()
+                cursor.close()
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True, 'message': 'Description updated'})
-            }
+            return json_response(200, {'success': True, 'message': 'Description updated'})
         
         except Exception as e:
-            return {
-                'statusCode': 500,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': str(e)})
-            }
+            return json_response(500, {'error': str(e)})
     
     if method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+        return json_response(405, {'error': 'Method not allowed'})
     
     try:
         body = json.loads(event.get('body', '{}'))
+        
+        if body.get('action') in UPLOAD_ACTIONS:
+            database_url = os.environ.get('DATABASE_URL')
+            
+            if not database_url:
+                return json_response(500, {'error': 'Database not configured'})
+            
+            with connection(database_url) as conn:
+                return handle_upload_action(conn, body['action'], body)
+        
+        if body.get('action') == 'process_jobs':
+            database_url = os.environ.get('DATABASE_URL')
+            
+            if not database_url:
+                return json_response(500, {'error': 'Database not configured'})
+            
+            limit = min(int(body.get('limit') or JOB_BATCH_SIZE), MAX_PAGE_SIZE)
+            with connection(database_url) as conn:
+                with stage('jobs'):
+                    result = process_jobs(conn, database_url, limit)
+                result['queue'] = queue_stats(conn)
+            
+            return json_response(200, {'success': True, **result})
+        
+        if body.get('action') == 'reindex':
+            database_url = os.environ.get('DATABASE_URL')
+            
+            if not database_url:
+                return json_response(500, {'error': 'Database not configured'})
+            
+            with connection(database_url) as conn:
+                cursor = conn.cursor()
+                
+                # Files uploaded before the index existed, extracted by an older extractor
+                # or indexed before chunk embeddings; documents waiting for an extract job are left to it
+                cursor.execute(
+                    """SELECT id FROM files f
+                       WHERE (f.extractor_version IS DISTINCT FROM %s AND f.extraction_status IN ('done', 'failed'))
+                          OR EXISTS (SELECT 1 FROM document_chunks c WHERE c.file_id = f.id AND c.embedding IS NULL)
+                       ORDER BY id""",
+                    (EXTRACTOR_VERSION,)
+                )
+                file_ids = [row[0] for row in cursor.fetchall()]
+                
+                # One job per file: the request returns at once and workers share the batch
+                for pending_id in file_ids:
+                    enqueue(cursor, 'reindex', {'fileId': pending_id}, dedup_key=str(pending_id))
+                conn.commit()
+                
+                cursor.close()
+            
+            return json_response(200, {'success': True, 'queued': len(file_ids)})
+        
         filename = body.get('filename', 'unknown')
         file_type = body.get('fileType', 'unknown')
         file_size = body.get('fileSize', 0)
@@ -155,39 +848,54 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         database_url = os.environ.get('DATABASE_URL')
         
         if not database_url:
-            return {
-                'statusCode': 500,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Database not configured'})
-            }
+            return json_response(500, {'error': 'Database not configured'})
         
-        # Handle base64 images or text content
-        if is_image_file(filename):
-            # Decode base64 for images
-            try:
-                file_data = base64.b64decode(content)
-            except:
+        # Handle base64 images and documents or text content
+        with stage('decode'):
+            if is_image_file(filename) or is_document_file(filename):
+                # Decode base64 for binary files
+                try:
+                    file_data = base64.b64decode(content)
+                except:
+                    file_data = content.encode('utf-8')
+            else:
                 file_data = content.encode('utf-8')
-        else:
-            file_data = content.encode('utf-8')
-        
-        conn = psycopg2.connect(database_url)
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        cursor.execute(
-            "INSERT INTO files (file_name, file_data, file_type, file_size, session_id, description) VALUES (%s, %s, %s, %s, %s, %s) RETURNING id",
-            (filename, file_data, file_type, file_size, session_id, description)
-        )
-        
-        file_id = cursor.fetchone()['id']
+            
+            content_hash = hashlib.sha256(file_data).hexdigest()
+        count('bytes_read', len(file_data))
         
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with connection(database_url) as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            # A copy of stored content only adds a files row: no bytes, extraction or thumbnail again
+            derived = find_blob(cursor, content_hash)
+            extraction_status = 'done'
+            if derived is None and is_document_file(filename):
+                # Parsing PDF/DOCX is left to a job, off the upload request
+                extracted_text, thumbnail, extraction_status = '', None, 'pending'
+                save_blob(cursor, content_hash, file_data, '', None, extractor_version=None)
+            elif derived is None:
+                # Images get their thumbnail from a job as well
+                with stage('extract'):
+                    extracted_text, thumbnail = extract_text_from_file(file_data, filename), None
+                save_blob(cursor, content_hash, file_data, extracted_text, None)
+            else:
+                extracted_text, thumbnail, _ = derived
+            
+            with stage('store'):
+                file_id = insert_file(cursor, filename, file_type, file_size, session_id, description,
+                                      content_hash, extracted_text, thumbnail, extraction_status)
+                if derived is None:
+                    queue_derived_work(cursor, content_hash, filename)
+                
+                conn.commit()
+            cursor.close()
         
         result = {
             'success': True,
             'file_id': file_id,
+            'deduplicated': derived is not None,
+            'extractionStatus': extraction_status,
             'file': {
                 'filename': filename,
                 'type': file_type,
@@ -195,19 +903,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
         }
         
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'isBase64Encoded': False,
-            'body': json.dumps(result)
-        }
+        return json_response(200, result)
     
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        return json_response(500, {'error': str(e)})
\ No newline at end of file
@@ -0,0 +1,117 @@
+'''
+Postgres-backed job queue for work that should not run inside the upload
+request: document extraction, thumbnails, reindexing. Jobs are claimed with
+FOR UPDATE SKIP LOCKED, so any number of workers can poll the jobs table
+without blocking each other or taking the same job twice. A failed job is
+retried with exponential backoff; a job whose worker died is released again
+after JOB_LOCK_TIMEOUT_SECONDS.
+'''
+import json
+import os
+import random
+from typing import Any, Dict, List, NamedTuple, Optional
+
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '5'))
+JOB_BACKOFF_BASE_SECONDS = float(os.environ.get('JOB_BACKOFF_BASE_SECONDS', '5'))
+JOB_BACKOFF_MAX_SECONDS = 3600
+JOB_LOCK_TIMEOUT_SECONDS = int(os.environ.get('JOB_LOCK_TIMEOUT_SECONDS', '900'))
+
+class Job(NamedTuple):
+    id: int
+    kind: str
+    payload: Dict[str, Any]
+    attempts: int
+    max_attempts: int
+
+def enqueue(cursor, kind: str, payload: Dict[str, Any], dedup_key: Optional[str] = None,
+            delay_seconds: float = 0) -> None:
+    """Add a job in the caller's transaction, so it exists only if the data it
+    refers to was committed. A queued job of the same kind and dedup_key absorbs
+    the new one; a running one does not, since it may have read older data"""
+    with cursor.connection.cursor() as insert:
+        insert.execute(
+            """INSERT INTO jobs (kind, payload, dedup_key, max_attempts, run_at)
+               VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+               ON CONFLICT (kind, dedup_key) WHERE status = 'queued' DO NOTHING""",
+            (kind, json.dumps(payload), dedup_key, JOB_MAX_ATTEMPTS, delay_seconds)
+        )
+
+# A job about to be queued again is dropped instead when a newer job for the same
+# dedup_key is already queued: that one does the same work on fresher data
+_QUEUED_TWIN = """EXISTS (SELECT 1 FROM jobs twin WHERE twin.kind = jobs.kind AND twin.dedup_key = jobs.dedup_key
+                          AND twin.status = 'queued' AND twin.id <> jobs.id)"""
+
+def release_stale(cursor) -> int:
+    """Jobs locked longer than JOB_LOCK_TIMEOUT_SECONDS belong to a dead worker:
+    queue them again, or fail them if that was their last attempt"""
+    cursor.execute(
+        f"""DELETE FROM jobs
+            WHERE status = 'running' AND locked_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+              AND attempts < max_attempts AND {_QUEUED_TWIN}""",
+        (JOB_LOCK_TIMEOUT_SECONDS,)
+    )
+    cursor.execute(
+        """UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+                          last_error = 'Worker lock timed out', locked_at = NULL,
+                          run_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+           WHERE status = 'running' AND locked_at < CURRENT_TIMESTAMP - make_interval(secs => %s)""",
+        (JOB_LOCK_TIMEOUT_SECONDS,)
+    )
+    return cursor.rowcount
+
+def dequeue(conn, limit: int = 1) -> List[Job]:
+    """Claim up to `limit` due jobs, oldest first. The claim is committed right
+    away: the row lock is not held while the job runs"""
+    with conn.cursor() as cursor:
+        release_stale(cursor)
+        cursor.execute(
+            """UPDATE jobs SET status = 'running', attempts = attempts + 1,
+                              locked_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+               WHERE id IN (
+                 SELECT id FROM jobs
+                 WHERE status = 'queued' AND run_at <= CURRENT_TIMESTAMP
+                 ORDER BY run_at, id
+                 LIMIT %s
+                 FOR UPDATE SKIP LOCKED
+               )
+               RETURNING id, kind, payload, attempts, max_attempts""",
+            (limit,)
+        )
+        rows = cursor.fetchall()
+    conn.commit()
+    jobs = [
+        Job(row[0], row[1], row[2] if isinstance(row[2], dict) else json.loads(row[2]), row[3], row[4])
+        for row in rows
+    ]
+    jobs.sort(key=lambda job: job.id)
+    return jobs
+
+def complete(cursor, job: Job) -> None:
+    """Done jobs are deleted, so the table only holds pending and failed work"""
+    cursor.execute("DELETE FROM jobs WHERE id = %s", (job.id,))
+
+def backoff_seconds(attempts: int) -> float:
+    """Exponential delay with jitter, so jobs failing together do not retry together"""
+    delay = min(JOB_BACKOFF_MAX_SECONDS, JOB_BACKOFF_BASE_SECONDS * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+def fail(cursor, job: Job, error: str) -> bool:
+    """Schedule a retry, or mark the job failed after max_attempts. Returns True if it will be retried"""
+    retry = job.attempts < job.max_attempts
+    if retry:
+        cursor.execute(f"DELETE FROM jobs WHERE id = %s AND {_QUEUED_TWIN}", (job.id,))
+        if cursor.rowcount:
+            return True
+    cursor.execute(
+        """UPDATE jobs SET status = %s, last_error = %s, locked_at = NULL,
+                          run_at = CURRENT_TIMESTAMP + make_interval(secs => %s), updated_at = CURRENT_TIMESTAMP
+           WHERE id = %s""",
+        ('queued' if retry else 'failed', error[:2000], backoff_seconds(job.attempts) if retry else 0, job.id)
+    )
+    return retry
+
+def queue_stats(conn) -> Dict[str, int]:
+    """Job count per status"""
+    with conn.cursor() as stats:
+        stats.execute("SELECT status, count(*) FROM jobs GROUP BY status")
+        return {status: count for status, count in stats.fetchall()}
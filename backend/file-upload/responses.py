@@ -0,0 +1,146 @@
+'''
+HTTP responses of the backend functions: JSON encoding (orjson when it is
+installed), the CORS headers, ETag / If-None-Match revalidation and
+compression. A handler decorated with negotiated() gets text bodies above
+COMPRESS_MIN_BYTES compressed with brotli or gzip according to the request's
+Accept-Encoding and returned base64-encoded, as the platform expects for
+binary bodies. Every backend function ships an identical copy of this
+module: keep the copies in sync.
+'''
+import base64
+import functools
+import gzip
+import hashlib
+import json
+import os
+from typing import Any, Callable, Dict, Optional
+from timing import stage
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '5'))
+
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*'}
+JSON_HEADERS = {'Content-Type': 'application/json', **CORS_HEADERS}
+COMPRESSIBLE_TYPES = ('application/json', 'text/')
+
+def dumps(payload: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(payload, ensure_ascii=False)
+
+def json_response(status_code: int, payload: Any, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    with stage('encode'):
+        body = dumps(payload)
+    return {
+        'statusCode': status_code,
+        'headers': {**JSON_HEADERS, **headers} if headers else dict(JSON_HEADERS),
+        'isBase64Encoded': False,
+        'body': body
+    }
+
+def preflight(methods: str, allow_headers: str = 'Content-Type') -> Dict[str, Any]:
+    return {
+        'statusCode': 200,
+        'headers': {
+            **CORS_HEADERS,
+            'Access-Control-Allow-Methods': methods,
+            'Access-Control-Allow-Headers': allow_headers,
+            'Access-Control-Max-Age': '86400'
+        },
+        'body': ''
+    }
+
+def request_header(event: Dict[str, Any], name: str) -> str:
+    """Case-insensitive request header lookup"""
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value or ''
+    return ''
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # Weak comparison: W/"x" and "x" name the same representation
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    return any((tag.strip()[2:] if tag.strip().startswith('W/') else tag.strip()) == opaque
+               for tag in if_none_match.split(','))
+
+def with_etag(event: Dict[str, Any], response: Dict[str, Any]) -> Dict[str, Any]:
+    """ETag from the body of a 200 response, 304 without a body when the client
+    already has it. The tag is weak: compression changes the bytes, not the content"""
+    if response.get('statusCode') != 200 or response.get('isBase64Encoded'):
+        return response
+    etag = 'W/"' + hashlib.blake2b(response['body'].encode('utf-8'), digest_size=16).hexdigest() + '"'
+    headers = {**response['headers'], 'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag_matches(etag, request_header(event, 'if-none-match')):
+        return {'statusCode': 304, 'headers': {**CORS_HEADERS, 'ETag': etag, 'Cache-Control': 'no-cache'}, 'body': ''}
+    return {**response, 'headers': headers}
+
+def accepted_encoding(accept_encoding: str) -> Optional[str]:
+    """br when brotli is installed and accepted, else gzip, else None.
+    A coding refused with q=0 is not picked through the * wildcard"""
+    accepted = set()
+    rejected = set()
+    for part in accept_encoding.lower().split(','):
+        coding, _, params = part.strip().partition(';')
+        params = params.strip()
+        try:
+            quality = float(params[2:]) if params.startswith('q=') else 1.0
+        except ValueError:
+            quality = 1.0
+        (accepted if quality > 0 else rejected).add(coding.strip())
+
+    def allows(coding: str) -> bool:
+        return coding in accepted or ('*' in accepted and coding not in rejected)
+
+    if brotli is not None and allows('br'):
+        return 'br'
+    if allows('gzip'):
+        return 'gzip'
+    return None
+
+def compress(event: Dict[str, Any], response: Dict[str, Any]) -> Dict[str, Any]:
+    body = response.get('body')
+    headers = response.get('headers') or {}
+    if response.get('isBase64Encoded') or not isinstance(body, str) or 'Content-Encoding' in headers:
+        return response
+    if not headers.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES):
+        return response
+    data = body.encode('utf-8')
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    encoding = accepted_encoding(request_header(event, 'accept-encoding'))
+    if encoding is None:
+        return {**response, 'headers': {**headers, 'Vary': 'Accept-Encoding'}}
+    with stage('compress'):
+        if encoding == 'br':
+            compressed = brotli.compress(data, quality=BROTLI_QUALITY)
+        else:
+            compressed = gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    return {
+        **response,
+        'headers': {**headers, 'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'},
+        'isBase64Encoded': True,
+        'body': base64.b64encode(compressed).decode('ascii')
+    }
+
+def negotiated(handler: Callable[[Dict[str, Any], Any], Dict[str, Any]]) -> Callable:
+    """Decorator for a handler: compresses its responses for clients that accept it"""
+    @functools.wraps(handler)
+    def negotiated_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        return compress(event, handler(event, context))
+    return negotiated_handler
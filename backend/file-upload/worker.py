@@ -0,0 +1,58 @@
+'''
+Job queue worker for file-upload. Each worker process polls the jobs table
+(job_queue.py) and runs what it claims with index.process_jobs; SKIP LOCKED
+lets any number of them share the queue.
+
+Usage: DATABASE_URL=postgresql://... python worker.py [--workers 4] [--batch-size 1] [--drain]
+'''
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from db import connection
+from index import process_jobs
+
+def work(dsn: str, batch_size: int, poll_seconds: float, drain: bool) -> None:
+    """Run jobs until interrupted; with drain, until no job is due"""
+    try:
+        while True:
+            with connection(dsn) as conn:
+                result = process_jobs(conn, dsn, batch_size)
+            if result['claimed']:
+                continue
+            if drain:
+                return
+            time.sleep(poll_seconds)
+    except KeyboardInterrupt:
+        pass
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='jobs claimed at once; documents of a batch are parsed in a process pool')
+    parser.add_argument('--poll-seconds', type=float, default=1.0)
+    parser.add_argument('--drain', action='store_true', help='exit once the queue has no due jobs')
+    args = parser.parse_args()
+
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        sys.exit('DATABASE_URL is not set')
+
+    # Connections are opened inside each process: the pool in db.py must not be shared across fork
+    processes = [
+        multiprocessing.Process(target=work, args=(dsn, args.batch_size, args.poll_seconds, args.drain))
+        for _ in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+'''
+Per-request cost of authentication checks in backend/auth: verifying a
+signed access token (what every authenticated request pays), the revoked
+refresh-token LRU lookup, and password verification with the legacy
+salted SHA-256 and the configured KDF (what a login pays). KDF settings come
+from the same environment variables as the function (PASSWORD_KDF, SCRYPT_N,
+PBKDF2_ITERATIONS, ...). Tokens are signed with AUTH_SECRET; a bench-only
+secret is used when it is unset.
+
+Usage: python bench/auth_benchmark.py [--tokens 20000] [--logins 5]
+'''
+import argparse
+import hashlib
+import os
+import secrets
+import statistics
+import sys
+import time
+from typing import Callable, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'auth'))
+# tokens.py refuses to sign without a secret
+os.environ.setdefault('AUTH_SECRET', 'bench-only-secret')
+
+from passwords import PASSWORD_KDF, hash_password, verify_password  # noqa: E402
+from tokens import RevokedTokens, issue_access_token, verify_access_token  # noqa: E402
+
+def measure(fn: Callable[[], object], repeat: int) -> List[float]:
+    fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def report(name: str, samples: List[float]) -> None:
+    print(f'{name:28} mean {statistics.mean(samples) * 1e6:11.1f} us   '
+          f'p50 {percentile(samples, 50) * 1e6:11.1f} us   '
+          f'p99 {percentile(samples, 99) * 1e6:11.1f} us')
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tokens', type=int, default=20000, help='repetitions of the per-request checks')
+    parser.add_argument('--logins', type=int, default=5, help='repetitions of password verification')
+    args = parser.parse_args()
+
+    token = issue_access_token({'id': 1, 'username': 'bench', 'subscription_tier': 'free'})
+    forged = token[:-4] + ('AAAA' if not token.endswith('AAAA') else 'BBBB')
+    assert verify_access_token(token) and not verify_access_token(forged)
+
+    revoked = RevokedTokens()
+    refresh_tokens = [secrets.token_urlsafe(48) for _ in range(revoked.size)]
+    for refresh_token in refresh_tokens:
+        revoked.add(refresh_token, time.time() + 3600)
+
+    report('access token verify', measure(lambda: verify_access_token(token), args.tokens))
+    report('forged token reject', measure(lambda: verify_access_token(forged), args.tokens))
+    report('revoked LRU hit', measure(lambda: refresh_tokens[-1] in revoked, args.tokens))
+    report('revoked LRU miss', measure(lambda: 'unknown' in revoked, args.tokens))
+
+    salt = secrets.token_hex(16)
+    legacy = f"{salt}${hashlib.sha256(('Password123' + salt).encode()).hexdigest()}"
+    report('legacy sha256 verify', measure(lambda: verify_password('Password123', legacy), args.tokens))
+    current = hash_password('Password123')
+    report(f'{PASSWORD_KDF} verify', measure(lambda: verify_password('Password123', current), args.logins))
+
+if __name__ == '__main__':
+    main()
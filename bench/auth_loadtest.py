@@ -0,0 +1,132 @@
+'''
+Register and login bursts against the auth queries, before and after the
+single-statement paths. "before" replays the old round trips (SELECT for a
+duplicate, INSERT users, INSERT user_stats, INSERT user_sessions; login with
+email = %s OR username = %s), "after" calls create_user/authenticate_user
+from backend/auth/index.py. The KDF is set to one PBKDF2 round unless
+--with-kdf is given, so the numbers show database cost, not hashing cost.
+DB_POOL_MAX_SIZE is raised to --threads, so threads do not queue for a
+connection of the default pool of 4.
+Users created by the run are deleted at the end. Sessions carry access tokens
+signed with AUTH_SECRET; a bench-only secret is used when it is unset.
+
+Needs a migrated database: DATABASE_URL=postgresql://... python bench/auth_loadtest.py
+Usage: python bench/auth_loadtest.py [--users 500] [--threads 8] [--with-kdf]
+'''
+import argparse
+import os
+import secrets
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'auth'))
+
+if '--with-kdf' not in sys.argv:
+    os.environ.setdefault('PASSWORD_KDF', 'pbkdf2_sha256')
+    os.environ.setdefault('PBKDF2_ITERATIONS', '1')
+# tokens.py refuses to sign without a secret
+os.environ.setdefault('AUTH_SECRET', 'bench-only-secret')
+
+DEFAULT_THREADS = 8
+# db.py reads the pool size at import: one connection per thread
+_pool_args = argparse.ArgumentParser(add_help=False)
+_pool_args.add_argument('--threads', type=int, default=DEFAULT_THREADS)
+os.environ['DB_POOL_MAX_SIZE'] = str(max(_pool_args.parse_known_args()[0].threads,
+                                         int(os.environ.get('DB_POOL_MAX_SIZE', '4'))))
+
+from db import connection  # noqa: E402
+from passwords import hash_password  # noqa: E402
+import index  # noqa: E402
+
+PASSWORD = 'Password123'
+
+def legacy_register(conn, email: str, username: str) -> None:
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM users WHERE email = %s OR username = %s", (email, username))
+    if cursor.fetchone():
+        return
+    cursor.execute(
+        """INSERT INTO users (email, username, password_hash, full_name, verification_token)
+           VALUES (%s, %s, %s, %s, %s) RETURNING id""",
+        (email, username, hash_password(PASSWORD), None, secrets.token_urlsafe(32))
+    )
+    user_id = cursor.fetchone()[0]
+    cursor.execute("INSERT INTO user_stats (user_id) VALUES (%s)", (user_id,))
+    conn.commit()
+    cursor.execute(
+        """INSERT INTO user_sessions (user_id, refresh_token, device_info, ip_address, expires_at)
+           VALUES (%s, %s, %s, %s, %s)""",
+        (user_id, secrets.token_urlsafe(48), 'loadtest', '127.0.0.1', datetime.now() + timedelta(days=30))
+    )
+    conn.commit()
+
+def legacy_login(conn, login: str) -> None:
+    cursor = conn.cursor()
+    cursor.execute(
+        """SELECT id, email, username, password_hash, full_name, avatar_url,
+                  subscription_tier, is_active, is_verified
+           FROM users WHERE email = %s OR username = %s""",
+        (login, login)
+    )
+    cursor.fetchone()
+
+def current_register(conn, email: str, username: str) -> None:
+    index.create_user(conn, email, username, PASSWORD, None, 'loadtest', '127.0.0.1')
+
+def current_login(conn, login: str) -> None:
+    index.authenticate_user(conn, login, PASSWORD)
+
+def burst(dsn: str, fn: Callable[..., None], calls: List[tuple], threads: int) -> float:
+    """Requests per second for a burst of calls"""
+    def run(args: tuple) -> None:
+        with connection(dsn) as conn:
+            fn(conn, *args)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(run, calls))
+    return len(calls) / (time.perf_counter() - started)
+
+def cleanup(dsn: str, prefix: str) -> None:
+    with connection(dsn) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """WITH doomed AS (SELECT id FROM users WHERE left(username, %s) = %s),
+                    sessions AS (DELETE FROM user_sessions WHERE user_id IN (SELECT id FROM doomed)),
+                    stats AS (DELETE FROM user_stats WHERE user_id IN (SELECT id FROM doomed))
+               DELETE FROM users WHERE id IN (SELECT id FROM doomed)""",
+            (len(prefix), prefix)
+        )
+        conn.commit()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS)
+    parser.add_argument('--with-kdf', action='store_true', help='keep the configured password KDF')
+    args = parser.parse_args()
+
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        sys.exit('DATABASE_URL is not set')
+
+    run_id = secrets.token_hex(3)
+    print(f'{args.users} users, {args.threads} threads')
+    try:
+        for name, register, login in (('before', legacy_register, legacy_login),
+                                      ('after', current_register, current_login)):
+            prefix = f'lt_{run_id}_{name}_'
+            users = [(f'{prefix}{n}@example.com', f'{prefix}{n}') for n in range(args.users)]
+            register_rps = burst(dsn, register, users, args.threads)
+            # Half the logins by email, half by username
+            logins = [(email if n % 2 else username,) for n, (email, username) in enumerate(users)]
+            login_rps = burst(dsn, login, logins, args.threads)
+            print(f'{name:7} register {register_rps:9.1f} req/s   login {login_rps:9.1f} req/s')
+    finally:
+        cleanup(dsn, f'lt_{run_id}_')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+'''
+Latency of chat-history full-text search (search_messages in
+backend/chat-history/index.py) on a large synthetic history. Seeds chats and
+messages with generate_series under bench sessions, then runs searches for
+one session, with and without a tag filter, first page and the page after
+it, and prints p50/p99 plus the plan of the first query so index use is
+visible. The seeded rows are deleted at the end.
+
+Needs a migrated database: DATABASE_URL=postgresql://... python bench/chat_search_benchmark.py
+Usage: python bench/chat_search_benchmark.py [--messages 1000000] [--sessions 1000] [--repeat 50]
+'''
+import argparse
+import os
+import secrets
+import sys
+import time
+from typing import Callable, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'chat-history'))
+
+import psycopg2  # noqa: E402
+from psycopg2.extras import RealDictCursor  # noqa: E402
+from index import encode_search_cursor, search_messages  # noqa: E402
+
+MESSAGES_PER_CHAT = 20
+WORDS = ['доставка', 'стоимость', 'оплата', 'заказ', 'возврат', 'гарантия', 'договор', 'скидка',
+         'курьер', 'склад', 'invoice', 'warranty', 'счёт', 'реквизиты', 'менеджер', 'регион']
+QUERIES = ['доставка', 'стоимость доставки', '"гарантия возврат"', 'invoice -скидка', 'реквизитов счёта']
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def seed(cursor, prefix: str, messages: int, sessions: int) -> None:
+    chats = max(1, messages // MESSAGES_PER_CHAT)
+    cursor.execute(
+        """INSERT INTO chats (session_id, title, tags, updated_at)
+           SELECT %s || (n %% %s), 'Чат ' || n,
+                  ARRAY['tag' || (n %% 7), 'tag' || (n %% 11)],
+                  NOW() - n * INTERVAL '1 minute'
+           FROM generate_series(1, %s) AS n""",
+        (prefix, sessions, chats)
+    )
+    # Every message is eight random vocabulary words; n > 0 makes the subquery run per row
+    cursor.execute(
+        """INSERT INTO messages (chat_id, role, content)
+           SELECT c.id, CASE WHEN n %% 2 = 0 THEN 'user' ELSE 'ai' END,
+                  (SELECT string_agg((%s::text[])[1 + floor(random() * %s)::int], ' ')
+                   FROM generate_series(1, 8) WHERE n > 0)
+           FROM chats c, generate_series(1, %s) AS n
+           WHERE left(c.session_id, %s) = %s""",
+        (WORDS, len(WORDS), MESSAGES_PER_CHAT, len(prefix), prefix)
+    )
+
+def cleanup(cursor, prefix: str) -> None:
+    cursor.execute(
+        """WITH doomed AS (SELECT id FROM chats WHERE left(session_id, %s) = %s),
+                gone AS (DELETE FROM messages WHERE chat_id IN (SELECT id FROM doomed))
+           DELETE FROM chats WHERE id IN (SELECT id FROM doomed)""",
+        (len(prefix), prefix)
+    )
+
+def measure(fn: Callable[[], object], repeat: int) -> List[float]:
+    fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--sessions', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--page-size', type=int, default=10)
+    args = parser.parse_args()
+
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        sys.exit('DATABASE_URL is not set')
+
+    prefix = f'bench_{secrets.token_hex(3)}_'
+    conn = psycopg2.connect(dsn)
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        started = time.perf_counter()
+        seed(cursor, prefix, args.messages, args.sessions)
+        cursor.execute("ANALYZE chats")
+        cursor.execute("ANALYZE messages")
+        conn.commit()
+        print(f'seeded {args.messages} messages in {args.sessions} sessions '
+              f'in {time.perf_counter() - started:.1f} s')
+
+        session_id = f'{prefix}0'
+        cursor.execute(
+            """EXPLAIN (ANALYZE, BUFFERS)
+               SELECT m.id FROM messages m JOIN chats c ON c.id = m.chat_id
+               WHERE c.session_id = %s
+                 AND m.search_vector @@ (websearch_to_tsquery('russian', %s) || websearch_to_tsquery('simple', %s))""",
+            (session_id, QUERIES[0], QUERIES[0])
+        )
+        print('\n'.join(row['QUERY PLAN'] for row in cursor.fetchall()))
+
+        for query in QUERIES:
+            for tags in ([], ['tag3']):
+                first = search_messages(cursor, session_id, query, tags, args.page_size, None)
+                samples = measure(
+                    lambda: search_messages(cursor, session_id, query, tags, args.page_size, None), args.repeat)
+                label = f'{query} {tags or ""}'
+                print(f'{label:34} first page  p50 {percentile(samples, 50) * 1e3:8.2f} ms   '
+                      f'p99 {percentile(samples, 99) * 1e3:8.2f} ms   {len(first)} hits')
+                if len(first) > args.page_size:
+                    after = encode_search_cursor(first[args.page_size - 1]['rank'], first[args.page_size - 1]['id'])
+                    samples = measure(
+                        lambda: search_messages(cursor, session_id, query, tags, args.page_size, after), args.repeat)
+                    print(f'{"":34} next page   p50 {percentile(samples, 50) * 1e3:8.2f} ms   '
+                          f'p99 {percentile(samples, 99) * 1e3:8.2f} ms')
+    finally:
+        conn.rollback()
+        cleanup(cursor, prefix)
+        conn.commit()
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+'''
+Hedged provider fallback of ai-chat's generation mode (generate() in
+backend/ai-chat/llm.py) against two local stub providers from llm_stub.py.
+Each scenario gives the primary and the secondary stub a latency and failure
+profile, runs --repeat generations and prints p50/p95 time to first token
+and total, which provider answered and how often the second one had to be
+started. A scenario fails when the answer comes from the wrong provider,
+when generation fails although one provider was healthy, when a slow
+primary was waited for instead of being hedged, or when a stream cut off
+midway is not reported as incomplete.
+
+Needs no database or network: python bench/llm_hedging.py
+Usage: python bench/llm_hedging.py [--repeat 20] [--hedge-after 0.3]
+'''
+import argparse
+import os
+import sys
+import time
+from typing import List, NamedTuple, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'ai-chat'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from llm import LLMError, Provider, build_messages, generate, pack_context  # noqa: E402
+from llm_stub import DEFAULT_ANSWER, StubConfig, base_url, start_stub  # noqa: E402
+
+class Profile(NamedTuple):
+    first_token_delay: float
+    token_delay: float = 0.005
+    fail_rate: float = 0.0
+    cut_after: int = 0
+
+class Scenario(NamedTuple):
+    name: str
+    primary: Profile
+    secondary: Profile
+    # Which stub should answer; None when generation has to fail
+    expected: Optional[str]
+    complete: bool = True
+
+SCENARIOS = [
+    Scenario('healthy primary', Profile(0.05), Profile(0.05), 'primary'),
+    Scenario('slow primary, hedged', Profile(2.0), Profile(0.05), 'secondary'),
+    Scenario('failing primary', Profile(0.05, fail_rate=1.0), Profile(0.05), 'secondary'),
+    Scenario('primary drops after hedge', Profile(0.5, fail_rate=1.0), Profile(0.6), 'secondary'),
+    Scenario('both failing', Profile(0.05, fail_rate=1.0), Profile(0.05, fail_rate=1.0), None),
+    Scenario('primary cut off midway', Profile(0.05, cut_after=3), Profile(0.05), 'primary', complete=False),
+]
+
+CHUNKS = [
+    'Доставка по Москве стоит 300 рублей и занимает один день.',
+    'По регионам доставка идёт транспортной компанией по её тарифам.',
+    'Оплата принимается картой или по счёту для юридических лиц.'
+]
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def provider(name: str, server, read_timeout: float) -> Provider:
+    return Provider(name, f'{base_url(server)}/chat/completions', 'stub', f'{name}-model', 1.0, read_timeout)
+
+def run(scenario: Scenario, repeat: int, hedge_after: float) -> bool:
+    configs = {
+        'primary': StubConfig('primary', **scenario.primary._asdict()),
+        'secondary': StubConfig('secondary', **scenario.secondary._asdict())
+    }
+    servers = {name: start_stub(config) for name, config in configs.items()}
+    providers = [provider(name, server, 5.0) for name, server in servers.items()]
+    messages = build_messages('Сколько стоит доставка?', pack_context(CHUNKS))
+
+    first_tokens, totals, hedged, failures, wrong = [], [], 0, 0, 0
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            try:
+                generation = generate(messages, providers, hedge_after=hedge_after, total_timeout=10)
+            except LLMError:
+                failures += 1
+                continue
+            totals.append(time.perf_counter() - started)
+            first_tokens.append(generation.first_token_seconds)
+            hedged += generation.hedged
+            # A cut-off stream keeps its partial text but must not claim to be the answer
+            wrong += (generation.provider != scenario.expected or generation.complete != scenario.complete
+                      or (generation.complete and generation.text != DEFAULT_ANSWER))
+    finally:
+        for server in servers.values():
+            server.shutdown()
+
+    ok = (failures == repeat) if scenario.expected is None else (not failures and not wrong)
+    if scenario.expected == 'secondary' and not scenario.primary.fail_rate and totals:
+        # The secondary answers before the primary would have sent its first byte
+        ok = ok and max(totals) < scenario.primary.first_token_delay
+    latency = (f"first token p50 {percentile(first_tokens, 50) * 1e3:7.1f} p95 {percentile(first_tokens, 95) * 1e3:7.1f}   "
+               f"total p50 {percentile(totals, 50) * 1e3:7.1f} p95 {percentile(totals, 95) * 1e3:7.1f} ms"
+               if totals else f"{'':72}")
+    print(f"{scenario.name:28} {latency}   hedged {hedged:3}   failed {failures:3}   "
+          f"requests {configs['primary'].requests}/{configs['secondary'].requests}   {'ok' if ok else 'FAIL'}")
+    return ok
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--hedge-after', type=float, default=0.3, help='seconds without a first token before hedging')
+    args = parser.parse_args()
+
+    results = [run(scenario, args.repeat, args.hedge_after) for scenario in SCENARIOS]
+    if not all(results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
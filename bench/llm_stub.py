@@ -0,0 +1,141 @@
+'''
+Local stand-in for an OpenAI-compatible /chat/completions endpoint, for
+exercising backend/ai-chat/llm.py without a real provider. Answers with a
+fixed text, streamed as server-sent events when the request asks for it.
+Latency and failures are configurable: --first-token-delay before the first
+byte, --token-delay between streamed tokens, --fail-rate of requests answered
+with --fail-status instead, --cut-after to drop the connection after that many
+streamed tokens, without [DONE].
+
+Usage: python bench/llm_stub.py [--port 8901] [--first-token-delay 0.2] [--token-delay 0.01]
+                                [--fail-rate 0] [--fail-status 503] [--cut-after 0]
+Then point a provider at it: DEEPSEEK_BASE_URL=http://127.0.0.1:8901 DEEPSEEK_API_KEY=stub
+'''
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+DEFAULT_ANSWER = 'Доставка по Москве стоит 300 рублей, по регионам - по тарифам транспортной компании.'
+
+class StubConfig:
+    def __init__(self, name: str = 'stub', first_token_delay: float = 0.0, token_delay: float = 0.0,
+                 fail_rate: float = 0.0, fail_status: int = 503, cut_after: int = 0,
+                 answer: str = DEFAULT_ANSWER):
+        self.name = name
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.cut_after = cut_after
+        self.answer = answer
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def tokens(self):
+        words = self.answer.split(' ')
+        return [word if number == 0 else ' ' + word for number, word in enumerate(words)]
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config: StubConfig
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def handle(self) -> None:
+        try:
+            super().handle()
+        except ConnectionResetError:
+            # A cancelled attempt closed its keep-alive connection
+            pass
+
+    def send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:
+        config = self.config
+        with config.lock:
+            config.requests += 1
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', '0'))) or b'{}')
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_json(404, {'error': {'message': 'not found'}})
+            return
+
+        time.sleep(config.first_token_delay)
+        if random.random() < config.fail_rate:
+            self.send_json(config.fail_status, {'error': {'message': f'{config.name} is unavailable'}})
+            return
+
+        model = request.get('model', 'stub')
+        if not request.get('stream'):
+            self.send_json(200, {'model': model, 'choices': [
+                {'index': 0, 'message': {'role': 'assistant', 'content': config.answer}, 'finish_reason': 'stop'}
+            ]})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for number, token in enumerate(config.tokens()):
+                if config.cut_after and number == config.cut_after:
+                    # Mid-stream failure: the chunked body never ends
+                    self.close_connection = True
+                    return
+                if number:
+                    time.sleep(config.token_delay)
+                event = {'model': model, 'choices': [{'index': 0, 'delta': {'content': token}}]}
+                self.write_chunk(f'data: {json.dumps(event, ensure_ascii=False)}\n\n'.encode('utf-8'))
+            self.write_chunk(b'data: [DONE]\n\n')
+            self.write_chunk(b'')
+        except (BrokenPipeError, ConnectionResetError):
+            # The client dropped the stream: a cancelled attempt
+            self.close_connection = True
+
+    def write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+def start_stub(config: StubConfig, port: int = 0, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Serves the stub in a daemon thread; base URL is http://host:server.server_port"""
+    handler = type('ConfiguredStubHandler', (StubHandler,), {'config': config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def base_url(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f'http://{host}:{port}'
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8901)
+    parser.add_argument('--first-token-delay', type=float, default=0.2, help='seconds before the first byte')
+    parser.add_argument('--token-delay', type=float, default=0.01, help='seconds between streamed tokens')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of requests that fail')
+    parser.add_argument('--fail-status', type=int, default=503)
+    parser.add_argument('--cut-after', type=int, default=0, help='tokens to stream before dropping the connection')
+    args = parser.parse_args(argv)
+
+    server = start_stub(StubConfig('stub', args.first_token_delay, args.token_delay, args.fail_rate, args.fail_status,
+                                   args.cut_after), args.port, args.host)
+    print(f'stub provider on {base_url(server)}/chat/completions')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+'''
+Load test of the backend functions driven by their tests.json specs.
+Every case of backend/<function>/tests.json is replayed against the function's
+handler at the given concurrency and reported as throughput and p50/p95/p99
+latency per endpoint, together with the status codes seen. Each function is
+imported in a spawned child process: the functions ship same-named modules
+(index, db, ...) that cannot share one interpreter.
+
+Before the replay a synthetic corpus is seeded: --files text files uploaded
+through the file-upload handler (so the search index is built by the real
+code), --chats chats with messages in the test session of chat-history, and
+the test user the auth login cases expect. Run it against a scratch
+database; seeded rows are kept so later runs can use --skip-seed.
+
+Register cases get a unique email and username per request, otherwise all
+but the first would measure the duplicate check; the seeded test user keeps
+its real email and username. The ai-chat rate limit for anonymous requests
+is off by default; set ANON_RATE_PER_MINUTE to measure it.
+
+auth and ai-chat need AUTH_SECRET; when it is unset a bench-only secret is
+used, the same in every child, so tokens issued by auth verify in ai-chat.
+Each child raises DB_POOL_MAX_SIZE to at least --concurrency, otherwise the
+run would measure requests queueing for the default pool of 4 connections.
+
+Needs a migrated database: DATABASE_URL=postgresql://... python bench/loadtest.py
+Usage: python bench/loadtest.py [--functions ai-chat,chat-history] [--requests 200] [--concurrency 8]
+                                [--files 200] [--chats 1000] [--skip-seed] [--output loadtest.json]
+                                [--compare previous.json]
+'''
+import argparse
+import copy
+import json
+import multiprocessing
+import os
+import random
+import secrets
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+FUNCTIONS = ('ai-chat', 'auth', 'chat-history', 'file-upload')
+SEED_SESSION = 'loadtest'
+SEED_TAG = 'loadtest'
+CHAT_SESSION = 'test-session'
+MESSAGES_PER_CHAT = 6
+# Unique per process, so register cases never collide with an earlier run
+RUN_ID = secrets.token_hex(3)
+TEST_USER = {'email': 'test@example.com', 'username': 'testuser', 'password': 'Test123456'}
+
+VOCABULARY = (
+    'доставка стоимость цена оплата заказ товар склад курьер москва регион гарантия возврат '
+    'договор поставка скидка клиент менеджер консультация документы реквизиты счёт доступ '
+    'delivery price order invoice warranty support account'
+).split()
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def load_cases(function: str) -> List[Dict[str, Any]]:
+    with open(os.path.join(BACKEND, function, 'tests.json'), encoding='utf-8') as spec:
+        return json.load(spec)['tests']
+
+def load_handler(function: str, concurrency: int = 1):
+    """Import the function's handler the way the platform does: its directory first on sys.path.
+    The pool size is read by db.py at import, so it is raised before"""
+    pool_size = max(concurrency, int(os.environ.get('DB_POOL_MAX_SIZE', '4')))
+    os.environ['DB_POOL_MAX_SIZE'] = str(pool_size)
+    sys.path.insert(0, os.path.join(BACKEND, function))
+    import index
+    return index.handler
+
+def build_event(case: Dict[str, Any], number: int, unique: bool = True) -> Dict[str, Any]:
+    body = case.get('body')
+    if unique and isinstance(body, dict) and body.get('action') == 'register':
+        body = copy.deepcopy(body)
+        body['email'] = f"lt{RUN_ID}_{number}_{body.get('email', '')}"
+        body['username'] = f"lt{RUN_ID}_{number}_{body.get('username', '')}"
+    event = {
+        'httpMethod': case.get('method', 'GET'),
+        'path': case.get('path', '/'),
+        'headers': dict(case.get('headers') or {}),
+        'queryStringParameters': case.get('queryStringParameters'),
+        'requestContext': {'identity': {'sourceIp': f'10.0.{number % 250}.{number % 200}'}}
+    }
+    if body is not None or event['httpMethod'] in ('POST', 'PUT'):
+        event['body'] = json.dumps(body or {}, ensure_ascii=False)
+    return event
+
+def call(handler, event: Dict[str, Any], number: int) -> int:
+    context = SimpleNamespace(request_id=f'loadtest-{RUN_ID}-{number}', function_name='loadtest')
+    try:
+        return handler(event, context).get('statusCode', 0)
+    except Exception:
+        # An exception escaping the handler is what the platform turns into a 502
+        return 502
+
+def replay(function: str, cases: List[Dict[str, Any]], requests: int, concurrency: int) -> List[Dict[str, Any]]:
+    """Runs in the function's child process: each case, requests times, concurrency at a time"""
+    handler = load_handler(function, concurrency)
+    results = []
+    for case in cases:
+        call(handler, build_event(case, 0), 0)
+
+        def timed(number: int) -> tuple:
+            event = build_event(case, number)
+            started = time.perf_counter()
+            status = call(handler, event, number)
+            return status, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(timed, range(1, requests + 1)))
+        elapsed = time.perf_counter() - started
+
+        latencies = [seconds for _, seconds in samples]
+        statuses: Dict[str, int] = {}
+        for status, _ in samples:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        expected = case.get('expectedStatus')
+        results.append({
+            'function': function,
+            'case': case['name'],
+            'method': case.get('method', 'GET'),
+            'requests': requests,
+            'concurrency': concurrency,
+            'throughput': requests / elapsed,
+            'mean_ms': statistics.mean(latencies) * 1e3,
+            'p50_ms': percentile(latencies, 50) * 1e3,
+            'p95_ms': percentile(latencies, 95) * 1e3,
+            'p99_ms': percentile(latencies, 99) * 1e3,
+            'statuses': statuses,
+            'expected_status': expected,
+            'unexpected': sum(count for status, count in statuses.items()
+                              if expected is not None and status != str(expected))
+        })
+    return results
+
+def synthetic_file(rng: random.Random, lines: int) -> str:
+    filler = [''.join(rng.choice('абвгдежзиклмнопрстуфхцчшэюя') for _ in range(rng.randint(3, 10)))
+              for _ in range(200)]
+    return '\n'.join(
+        ' '.join(rng.choice(VOCABULARY) if rng.random() < 0.2 else rng.choice(filler)
+                 for _ in range(rng.randint(4, 16))).capitalize() + '.'
+        for _ in range(lines)
+    )
+
+def seed_files(files: int) -> int:
+    """Runs in the file-upload child: uploads text files, then drains the jobs they queued"""
+    handler = load_handler('file-upload')
+    rng = random.Random(42)
+    uploaded = 0
+    for number in range(files):
+        content = synthetic_file(rng, rng.randint(20, 200))
+        status = call(handler, build_event({'method': 'POST', 'body': {
+            'filename': f'loadtest-{number}.txt',
+            'fileType': 'text/plain',
+            'fileSize': len(content.encode('utf-8')),
+            'content': content,
+            'description': ' '.join(rng.choice(VOCABULARY) for _ in range(5)),
+            'sessionId': SEED_SESSION
+        }}, number), number)
+        uploaded += status == 200
+    while True:
+        response = handler(build_event({'method': 'POST', 'body': {'action': 'process_jobs', 'limit': 100}}, 0),
+                           SimpleNamespace(request_id='loadtest-seed'))
+        if response['statusCode'] != 200 or not json.loads(response['body']).get('claimed'):
+            break
+    return uploaded
+
+def seed_user() -> int:
+    """Runs in the auth child: the user the login cases log in as. 400 means it exists already"""
+    handler = load_handler('auth')
+    return call(handler, build_event({'method': 'POST', 'body': {'action': 'register', **TEST_USER}}, 0, unique=False), 0)
+
+def seed_chats(dsn: str, chats: int) -> None:
+    import psycopg2
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """WITH new_chats AS (
+                     INSERT INTO chats (session_id, title, tags, updated_at)
+                     SELECT %s, 'Чат ' || n, ARRAY[%s, 'tag' || (n %% 7)], NOW() - n * INTERVAL '1 minute'
+                     FROM generate_series(1, %s) AS n
+                     RETURNING id
+                   )
+                   INSERT INTO messages (chat_id, role, content)
+                   SELECT c.id, CASE WHEN n %% 2 = 0 THEN 'ai' ELSE 'user' END,
+                          (SELECT string_agg((%s::text[])[1 + floor(random() * %s)::int], ' ')
+                           FROM generate_series(1, 10) WHERE n > 0)
+                   FROM new_chats c, generate_series(1, %s) AS n""",
+                (CHAT_SESSION, SEED_TAG, chats, VOCABULARY, len(VOCABULARY), MESSAGES_PER_CHAT)
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+def run_in_child(fn, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(fn, *args).result()
+
+def compare(results: List[Dict[str, Any]], previous_path: str) -> None:
+    with open(previous_path, encoding='utf-8') as previous_file:
+        previous = {(row['function'], row['case']): row for row in json.load(previous_file)['results']}
+    print(f'\nagainst {previous_path}')
+    for row in results:
+        before = previous.get((row['function'], row['case']))
+        if not before:
+            continue
+        deltas = '   '.join(
+            f"{key[:-3]} {(row[key] - before[key]) / before[key] * 100 if before[key] else 0:+7.1f}%"
+            for key in ('p50_ms', 'p95_ms', 'p99_ms')
+        )
+        throughput = (row['throughput'] - before['throughput']) / before['throughput'] * 100
+        print(f"{row['function'] + ': ' + row['case']:60} {deltas}   req/s {throughput:+7.1f}%")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--functions', default=','.join(FUNCTIONS), help='comma-separated function names')
+    parser.add_argument('--requests', type=int, default=200, help='requests per test case')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--files', type=int, default=200, help='text files to seed through file-upload')
+    parser.add_argument('--chats', type=int, default=1000, help='chats to seed into the chat-history test session')
+    parser.add_argument('--skip-seed', action='store_true')
+    parser.add_argument('--output', default='loadtest.json', help='where to write the results as JSON')
+    parser.add_argument('--compare', help='results JSON of an earlier run to print the difference against')
+    args = parser.parse_args()
+
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        sys.exit('DATABASE_URL is not set')
+    # Inherited by every spawned child
+    os.environ.setdefault('AUTH_SECRET', 'bench-only-secret')
+
+    functions = [name.strip() for name in args.functions.split(',') if name.strip()]
+    unknown = set(functions) - set(FUNCTIONS)
+    if unknown:
+        sys.exit(f"unknown functions: {', '.join(sorted(unknown))}")
+
+    if not args.skip_seed:
+        started = time.perf_counter()
+        uploaded = run_in_child(seed_files, args.files) if args.files else 0
+        if args.chats:
+            seed_chats(dsn, args.chats)
+        user_status = run_in_child(seed_user)
+        if user_status not in (201, 400):
+            sys.exit(f'seeding the test user failed with status {user_status}')
+        print(f'seeded {uploaded} files, {args.chats} chats, test user ({user_status}) '
+              f'in {time.perf_counter() - started:.1f} s')
+
+    print(f'{args.requests} requests per case, concurrency {args.concurrency}')
+    results: List[Dict[str, Any]] = []
+    for function in functions:
+        for row in run_in_child(replay, function, load_cases(function), args.requests, args.concurrency):
+            results.append(row)
+            statuses = ' '.join(f'{status}x{count}' for status, count in sorted(row['statuses'].items()))
+            flag = '' if not row['unexpected'] else f"   expected {row['expected_status']}"
+            print(f"{function + ': ' + row['case']:60} {row['throughput']:8.1f} req/s   "
+                  f"p50 {row['p50_ms']:8.2f}   p95 {row['p95_ms']:8.2f}   p99 {row['p99_ms']:8.2f} ms   "
+                  f"{statuses}{flag}")
+
+    report = {
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'results': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as output:
+        json.dump(report, output, ensure_ascii=False, indent=2)
+    print(f'results written to {args.output}')
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
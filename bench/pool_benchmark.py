@@ -0,0 +1,97 @@
+'''
+Latency of opening a PostgreSQL connection per request versus taking one
+from the module-level pool in backend/*/db.py. Each request runs the same
+short query the handlers start with; p50/p99 are reported for both modes.
+Then twice DB_POOL_MAX_SIZE threads each hold a pooled connection for
+--hold seconds: every one of them has to wait for a connection and succeed,
+otherwise the script exits non-zero.
+
+Needs a reachable database: DATABASE_URL=postgresql://... python bench/pool_benchmark.py
+Usage: python bench/pool_benchmark.py [--requests 500] [--threads 4] [--hold 0.3]
+'''
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'ai-chat'))
+
+import psycopg2  # noqa: E402
+from db import POOL_MAX_SIZE, connection  # noqa: E402
+
+QUERY = "SELECT doc_count FROM search_stats WHERE id = 1"
+
+def connect_per_request(dsn: str) -> None:
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(QUERY)
+            cursor.fetchall()
+    finally:
+        conn.close()
+
+def pooled(dsn: str) -> None:
+    with connection(dsn) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(QUERY)
+            cursor.fetchall()
+
+def measure(fn: Callable[[str], None], dsn: str, requests: int, threads: int) -> List[float]:
+    def timed(_: int) -> float:
+        started = time.perf_counter()
+        fn(dsn)
+        return time.perf_counter() - started
+
+    fn(dsn)  # warm-up: the pool is created on first use, as in a cold start
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(timed, range(requests)))
+
+def oversubscribe(dsn: str, threads: int, hold: float) -> List[str]:
+    """More threads than the pool has connections, each holding one; returns the errors"""
+    def hold_connection(_: int) -> str:
+        try:
+            with connection(dsn) as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT pg_sleep(%s)", (hold,))
+            return ''
+        except Exception as e:
+            return f'{type(e).__name__}: {e}'
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return [error for error in executor.map(hold_connection, range(threads)) if error]
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--hold', type=float, default=0.3, help='seconds each oversubscribing thread holds its connection')
+    args = parser.parse_args()
+
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        sys.exit('DATABASE_URL is not set')
+
+    print(f'{args.requests} requests, {args.threads} threads')
+    for name, fn in (('connect per request', connect_per_request), ('pooled', pooled)):
+        samples = measure(fn, dsn, args.requests, args.threads)
+        print(f'{name:20} p50 {percentile(samples, 50) * 1000:7.2f} ms   '
+              f'p99 {percentile(samples, 99) * 1000:7.2f} ms   '
+              f'mean {statistics.mean(samples) * 1000:7.2f} ms')
+
+    threads = 2 * POOL_MAX_SIZE
+    started = time.perf_counter()
+    errors = oversubscribe(dsn, threads, args.hold)
+    print(f'{threads} threads on a pool of {POOL_MAX_SIZE}: {threads - len(errors)} ok, {len(errors)} failed '
+          f'in {time.perf_counter() - started:.2f} s')
+    if errors:
+        sys.exit('\n'.join(sorted(set(errors))))
+
+if __name__ == '__main__':
+    main()
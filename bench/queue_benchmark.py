@@ -0,0 +1,95 @@
+'''
+Throughput of the file-upload job queue (backend/file-upload/job_queue.py).
+Enqueues no-op jobs, then drains them with an increasing number of workers,
+each claiming batches with FOR UPDATE SKIP LOCKED on its own connection, and
+reports jobs per second plus claim latency. Benchmark jobs use their own kind
+and are removed afterwards.
+
+Needs a migrated database: DATABASE_URL=postgresql://... python bench/queue_benchmark.py
+Usage: python bench/queue_benchmark.py [--jobs 2000] [--workers 1,2,4,8] [--batch-size 1] [--work-ms 0]
+'''
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'file-upload'))
+
+import psycopg2  # noqa: E402
+from job_queue import complete, dequeue, enqueue  # noqa: E402
+
+KIND = 'bench'
+
+def fill(dsn: str, count: int) -> None:
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM jobs WHERE kind = %s", (KIND,))
+            for number in range(count):
+                enqueue(cursor, KIND, {'n': number})
+        conn.commit()
+    finally:
+        conn.close()
+
+def drain(dsn: str, batch_size: int, work_seconds: float) -> Tuple[int, List[float]]:
+    """One worker: claim and complete until nothing is due. Returns jobs done and claim latencies"""
+    conn = psycopg2.connect(dsn)
+    done = 0
+    claims = []
+    try:
+        while True:
+            started = time.perf_counter()
+            jobs = dequeue(conn, batch_size)
+            claims.append(time.perf_counter() - started)
+            if not jobs:
+                return done, claims
+            with conn.cursor() as cursor:
+                for job in jobs:
+                    if work_seconds:
+                        time.sleep(work_seconds)
+                    complete(cursor, job)
+                    conn.commit()
+                    done += 1
+    finally:
+        conn.close()
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=2000)
+    parser.add_argument('--workers', default='1,2,4,8')
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--work-ms', type=float, default=0, help='simulated work per job')
+    args = parser.parse_args()
+
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        sys.exit('DATABASE_URL is not set')
+
+    print(f'{args.jobs} jobs, batch size {args.batch_size}, {args.work_ms} ms of work per job')
+    for workers in [int(value) for value in args.workers.split(',')]:
+        fill(dsn, args.jobs)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                lambda _: drain(dsn, args.batch_size, args.work_ms / 1000), range(workers)
+            ))
+        elapsed = time.perf_counter() - started
+        done = sum(result[0] for result in results)
+        claims = [sample for result in results for sample in result[1]]
+        print(f'{workers:3} workers  {done / elapsed:9.1f} jobs/s   '
+              f'claim p50 {percentile(claims, 50) * 1000:6.2f} ms   '
+              f'p99 {percentile(claims, 99) * 1000:6.2f} ms   '
+              f'mean {statistics.mean(claims) * 1000:6.2f} ms'
+              + ('' if done == args.jobs else f'   ({done} of {args.jobs} done)'))
+
+    fill(dsn, 0)
+
+if __name__ == '__main__':
+    main()
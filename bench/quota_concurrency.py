@@ -0,0 +1,133 @@
+'''
+Concurrency check for the daily message quota in backend/ai-chat/quota.py.
+Creates a throwaway user with a small daily_limit, fires many concurrent
+consume_message calls for that user from separate connections and checks that
+exactly daily_limit of them were allowed and that messages_sent and
+experience_points match. A second round backdates last_reset_date to check
+that the lazy daily reset lets exactly one new day's worth through.
+The user is deleted at the end.
+
+Needs a migrated database: DATABASE_URL=postgresql://... python bench/quota_concurrency.py
+Usage: python bench/quota_concurrency.py [--requests 200] [--threads 32] [--limit 10]
+'''
+import argparse
+import os
+import secrets
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'ai-chat'))
+
+import psycopg2  # noqa: E402
+from quota import XP_PER_MESSAGE, consume_message  # noqa: E402
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def create_user(dsn: str, limit: int) -> int:
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            name = f'quota_{secrets.token_hex(4)}'
+            cursor.execute(
+                "INSERT INTO users (email, username, password_hash) VALUES (%s, %s, 'x') RETURNING id",
+                (f'{name}@example.com', name)
+            )
+            user_id = cursor.fetchone()[0]
+            cursor.execute("INSERT INTO user_stats (user_id, daily_limit) VALUES (%s, %s)", (user_id, limit))
+        conn.commit()
+        return user_id
+    finally:
+        conn.close()
+
+def delete_user(dsn: str, user_id: int) -> None:
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM user_stats WHERE user_id = %s", (user_id,))
+            cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+def burst(dsn: str, user_id: int, requests: int, threads: int) -> List[tuple]:
+    """(allowed, seconds) per request; each worker thread keeps its own connection"""
+    def run(count: int) -> List[tuple]:
+        conn = psycopg2.connect(dsn)
+        results = []
+        try:
+            with conn.cursor() as cursor:
+                for _ in range(count):
+                    started = time.perf_counter()
+                    quota = consume_message(cursor, user_id)
+                    conn.commit()
+                    results.append((quota.allowed, time.perf_counter() - started))
+        finally:
+            conn.close()
+        return results
+
+    shares = [requests // threads + (1 if n < requests % threads else 0) for n in range(threads)]
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return [result for part in executor.map(run, shares) for result in part]
+
+def stats(dsn: str, user_id: int) -> tuple:
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT messages_today, messages_sent, experience_points FROM user_stats WHERE user_id = %s",
+                (user_id,)
+            )
+            return cursor.fetchone()
+    finally:
+        conn.close()
+
+def backdate(dsn: str, user_id: int) -> None:
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "UPDATE user_stats SET last_reset_date = CURRENT_DATE - 1 WHERE user_id = %s", (user_id,)
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--limit', type=int, default=10, help='daily_limit of the test user')
+    args = parser.parse_args()
+
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        sys.exit('DATABASE_URL is not set')
+
+    user_id = create_user(dsn, args.limit)
+    failures = 0
+    try:
+        for day in (1, 2):
+            if day == 2:
+                backdate(dsn, user_id)
+            results = burst(dsn, user_id, args.requests, args.threads)
+            allowed = sum(1 for ok, _ in results if ok)
+            latencies = [seconds for _, seconds in results]
+            messages_today, messages_sent, experience_points = stats(dsn, user_id)
+            expected = min(args.limit, args.requests)
+            ok = (allowed == expected and messages_today == expected
+                  and messages_sent == expected * day and experience_points == expected * day * XP_PER_MESSAGE)
+            failures += not ok
+            print(f'day {day}: {allowed}/{len(results)} allowed (expected {expected}), '
+                  f'messages_today {messages_today}, sent {messages_sent}, xp {experience_points}   '
+                  f'p50 {percentile(latencies, 50) * 1e3:.2f} ms   p99 {percentile(latencies, 99) * 1e3:.2f} ms   '
+                  f'{"OK" if ok else "MISMATCH"}')
+    finally:
+        delete_user(dsn, user_id)
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
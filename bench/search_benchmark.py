@@ -0,0 +1,108 @@
+'''
+Micro-benchmark of the linear knowledge-base search in ai-chat.
+Compares the original per-sentence loop (description bonus recomputed for
+every sentence) with the precomputed query plan on a synthetic 10k-line
+knowledge base, and checks that both return the same answer, including
+for a question with a punctuation-only word.
+
+Usage: python bench/search_benchmark.py [--lines 10000] [--descriptions 10] [--repeat 5]
+'''
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'ai-chat'))
+
+from search import simple_search_answer  # noqa: E402
+
+VOCABULARY = (
+    'доставка стоимость цена оплата заказ товар склад курьер москва регион гарантия возврат '
+    'договор поставка скидка клиент менеджер консультация документы реквизиты счёт доступ '
+    'delivery price order invoice warranty support account'
+).split()
+
+QUESTIONS = [
+    'Какая стоимость доставки по Москве?',
+    'Как оформить возврат товара по гарантии?',
+    'Где взять реквизиты для счёта?',
+    'What is the warranty policy?',
+    # A word of only '?.,!' strips to '' and matches every line
+    'Когда ????'
+]
+
+def legacy_search_answer(question: str, knowledge_base: str, descriptions: list) -> str:
+    """simple_search_answer as it was before the query plan"""
+    question_lower = question.lower()
+    words = [w.strip('?.,!') for w in question_lower.split() if len(w) > 3]
+    sentences = knowledge_base.split('\n')
+    relevant = []
+    for sentence in sentences:
+        if len(sentence.strip()) < 10:
+            continue
+        sentence_lower = sentence.lower()
+        score = sum(1 for word in words if word in sentence_lower)
+        for desc in descriptions:
+            if desc and any(word in desc.lower() for word in words):
+                score += 2
+        if score > 0:
+            relevant.append((score, sentence.strip()))
+    relevant.sort(reverse=True, key=lambda x: x[0])
+    if not relevant:
+        desc_matches = [desc for desc in descriptions if desc and any(word in desc.lower() for word in words)]
+        if desc_matches:
+            return "Информация по вашему запросу:\n\n" + "\n\n".join(desc_matches)
+        return "К сожалению, я не нашёл информацию по вашему вопросу в загруженных документах."
+    return "\n\n".join(s[1] for s in relevant[:7])
+
+def synthetic_corpus(lines: int, descriptions: int, seed: int = 42):
+    """Lines mix domain words (~20%) with random filler words"""
+    rng = random.Random(seed)
+    filler = [
+        ''.join(rng.choice('абвгдежзиклмнопрстуфхцчшэюя') for _ in range(rng.randint(3, 10)))
+        for _ in range(3000)
+    ]
+
+    def word():
+        return rng.choice(VOCABULARY) if rng.random() < 0.2 else rng.choice(filler)
+
+    kb_lines = [
+        ' '.join(word() for _ in range(rng.randint(4, 16))).capitalize() + '.'
+        for _ in range(lines)
+    ]
+    descs = [
+        ' '.join(rng.choice(VOCABULARY) for _ in range(rng.randint(3, 12)))
+        for _ in range(descriptions)
+    ]
+    return '\n'.join(kb_lines), descs
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lines', type=int, default=10000)
+    parser.add_argument('--descriptions', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    knowledge_base, descriptions = synthetic_corpus(args.lines, args.descriptions)
+
+    for question in QUESTIONS:
+        assert legacy_search_answer(question, knowledge_base, descriptions) == \
+            simple_search_answer(question, knowledge_base, descriptions), question
+
+    def run(fn):
+        return min(timeit.repeat(
+            lambda: [fn(q, knowledge_base, descriptions) for q in QUESTIONS],
+            number=1, repeat=args.repeat
+        )) / len(QUESTIONS)
+
+    legacy = run(legacy_search_answer)
+    planned = run(simple_search_answer)
+
+    print(f'{args.lines} lines, {args.descriptions} descriptions, {len(QUESTIONS)} questions')
+    print(f'legacy loop:   {legacy * 1000:8.2f} ms/question')
+    print(f'query plan:    {planned * 1000:8.2f} ms/question')
+    print(f'speedup:       {legacy / planned:8.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+-- Lines of uploaded files addressable by (file_id, line_no)
+CREATE TABLE IF NOT EXISTS file_lines (
+  file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+  line_no INTEGER NOT NULL,
+  content TEXT NOT NULL,
+  PRIMARY KEY (file_id, line_no)
+);
+
+-- Inverted index: term -> posting list of file/line offsets
+CREATE TABLE IF NOT EXISTS search_postings (
+  term VARCHAR(100) NOT NULL,
+  file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+  line_no INTEGER NOT NULL,
+  PRIMARY KEY (term, file_id, line_no)
+);
+
+-- text_pattern_ops lets prefix lookups (term LIKE 'цен%') use the index
+CREATE INDEX IF NOT EXISTS idx_search_postings_term_prefix ON search_postings(term text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_search_postings_file ON search_postings(file_id);
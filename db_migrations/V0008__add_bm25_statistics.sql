@@ -0,0 +1,36 @@
+-- Terms are now stemmed: drop postings built with the old tokenizer,
+-- POST action=reindex rebuilds them
+TRUNCATE search_postings;
+TRUNCATE file_lines;
+
+-- Term frequency per posting and document length per line for BM25
+ALTER TABLE search_postings ADD COLUMN IF NOT EXISTS tf SMALLINT NOT NULL DEFAULT 1;
+ALTER TABLE file_lines ADD COLUMN IF NOT EXISTS term_count INTEGER NOT NULL DEFAULT 0;
+
+-- Exact stem lookups replace prefix LIKE
+DROP INDEX IF EXISTS idx_search_postings_term_prefix;
+
+-- Document frequency of every term across the corpus
+CREATE TABLE IF NOT EXISTS search_terms (
+  term VARCHAR(100) PRIMARY KEY,
+  doc_freq INTEGER NOT NULL DEFAULT 0
+);
+
+-- Contribution of each file to search_terms, subtracted when the file is reindexed
+CREATE TABLE IF NOT EXISTS search_file_terms (
+  file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+  term VARCHAR(100) NOT NULL,
+  doc_count INTEGER NOT NULL,
+  PRIMARY KEY (file_id, term)
+);
+
+-- Corpus totals for length normalization (single row)
+CREATE TABLE IF NOT EXISTS search_stats (
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  doc_count BIGINT NOT NULL DEFAULT 0,
+  total_terms BIGINT NOT NULL DEFAULT 0,
+  desc_count BIGINT NOT NULL DEFAULT 0,
+  desc_terms BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO search_stats (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
@@ -0,0 +1,4 @@
+-- Text is extracted once at upload time; ai-chat reads it instead of decoding file_data
+ALTER TABLE files ADD COLUMN IF NOT EXISTS extracted_text TEXT;
+ALTER TABLE files ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+ALTER TABLE files ADD COLUMN IF NOT EXISTS extractor_version SMALLINT;
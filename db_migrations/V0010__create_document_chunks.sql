@@ -0,0 +1,18 @@
+-- Files are indexed as fixed-size overlapping chunks instead of single lines.
+-- Chunk 0 of a file is its description. POST action=reindex rebuilds everything
+CREATE TABLE IF NOT EXISTS document_chunks (
+  file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+  chunk_no INTEGER NOT NULL,
+  content TEXT NOT NULL,
+  term_count INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (file_id, chunk_no)
+);
+
+DROP TABLE IF EXISTS file_lines;
+
+TRUNCATE search_postings;
+TRUNCATE search_file_terms;
+TRUNCATE search_terms;
+UPDATE search_stats SET doc_count = 0, total_terms = 0, desc_count = 0, desc_terms = 0;
+
+ALTER TABLE search_postings RENAME COLUMN line_no TO chunk_no;
@@ -0,0 +1,7 @@
+-- Thumbnail generated at upload for the admin file list
+ALTER TABLE files ADD COLUMN IF NOT EXISTS thumbnail BYTEA;
+
+-- Keyset pagination of the file list by (uploaded_at, id)
+UPDATE files SET uploaded_at = CURRENT_TIMESTAMP WHERE uploaded_at IS NULL;
+ALTER TABLE files ALTER COLUMN uploaded_at SET NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_files_uploaded_at_id ON files(uploaded_at DESC, id DESC);
@@ -0,0 +1,7 @@
+-- Keyset pagination of chats by (updated_at, id) within a session
+UPDATE chats SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL;
+ALTER TABLE chats ALTER COLUMN updated_at SET NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_chats_session_updated ON chats(session_id, updated_at DESC, id DESC);
+
+-- Latest N messages of a chat without sorting the whole chat
+CREATE INDEX IF NOT EXISTS idx_messages_chat_created ON messages(chat_id, created_at, id);
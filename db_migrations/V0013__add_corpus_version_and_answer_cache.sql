@@ -0,0 +1,13 @@
+-- Corpus version: bumped by file-upload whenever files or descriptions change,
+-- ai-chat keys cached answers on it
+INSERT INTO settings (key, value) VALUES ('corpus_version', '0') ON CONFLICT (key) DO NOTHING;
+
+-- Optional shared tier of the ai-chat answer cache (ANSWER_CACHE_DB=1)
+CREATE TABLE IF NOT EXISTS answer_cache (
+  corpus_version BIGINT NOT NULL,
+  question TEXT NOT NULL,
+  answer TEXT NOT NULL,
+  images JSONB NOT NULL DEFAULT '[]'::jsonb,
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (corpus_version, question)
+);
@@ -0,0 +1,6 @@
+-- Change marker for the knowledge-base snapshot kept by warm ai-chat instances
+ALTER TABLE files ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;
+UPDATE files SET updated_at = uploaded_at WHERE updated_at IS NULL;
+ALTER TABLE files ALTER COLUMN updated_at SET DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE files ALTER COLUMN updated_at SET NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_files_updated_at ON files(updated_at);
@@ -0,0 +1,3 @@
+-- int8 embedding of every chunk for semantic and hybrid search in ai-chat;
+-- existing chunks get one on the next reindex
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS embedding BYTEA;
@@ -0,0 +1,24 @@
+-- Resumable multipart upload: parts are stored as they arrive and assembled
+-- into files.file_data by the database on completion
+CREATE TABLE IF NOT EXISTS upload_sessions (
+  id VARCHAR(64) PRIMARY KEY,
+  file_name VARCHAR(500) NOT NULL,
+  file_type VARCHAR(100),
+  session_id VARCHAR(200),
+  description TEXT,
+  part_count INTEGER NOT NULL,
+  file_id INTEGER REFERENCES files(id) ON DELETE SET NULL,
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS upload_parts (
+  upload_id VARCHAR(64) NOT NULL REFERENCES upload_sessions(id) ON DELETE CASCADE,
+  part_no INTEGER NOT NULL,
+  data BYTEA NOT NULL,
+  size INTEGER NOT NULL,
+  sha256 CHAR(64) NOT NULL,
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (upload_id, part_no)
+);
+
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_created ON upload_sessions(created_at);
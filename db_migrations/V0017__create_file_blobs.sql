@@ -0,0 +1,25 @@
+-- Content-addressed storage: identical uploads share one blob, and text
+-- extraction and thumbnails are computed once per distinct content
+CREATE TABLE IF NOT EXISTS file_blobs (
+  content_hash CHAR(64) PRIMARY KEY,
+  data BYTEA NOT NULL,
+  size BIGINT NOT NULL,
+  extracted_text TEXT,
+  thumbnail BYTEA,
+  extractor_version SMALLINT,
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO file_blobs (content_hash, data, size, extracted_text, thumbnail, extractor_version)
+SELECT DISTINCT ON (content_hash) content_hash, file_data, octet_length(file_data), extracted_text, thumbnail, extractor_version
+FROM files
+WHERE content_hash IS NOT NULL AND file_data IS NOT NULL
+ORDER BY content_hash, id
+ON CONFLICT (content_hash) DO NOTHING;
+
+-- Bytes live in file_blobs now; files.file_data stays only on rows never hashed
+UPDATE files SET file_data = NULL
+WHERE file_data IS NOT NULL AND content_hash IN (SELECT content_hash FROM file_blobs);
+
+-- Oldest file with the same content owns the indexed text
+CREATE INDEX IF NOT EXISTS idx_files_content_hash ON files(content_hash, id);
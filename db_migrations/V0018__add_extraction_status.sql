@@ -0,0 +1,6 @@
+-- PDF/DOCX/DOC text is extracted after upload by the file-upload extract action:
+-- pending -> processing -> done | failed. Existing rows were extracted inline
+ALTER TABLE files ADD COLUMN IF NOT EXISTS extraction_status VARCHAR(16) NOT NULL DEFAULT 'done';
+
+CREATE INDEX IF NOT EXISTS idx_files_extraction_queue ON files(id)
+WHERE extraction_status IN ('pending', 'processing');
@@ -0,0 +1,32 @@
+-- Background job queue of file-upload (job_queue.py): extraction, thumbnails, reindexing.
+-- Workers claim due jobs with FOR UPDATE SKIP LOCKED; finished jobs are deleted
+CREATE TABLE IF NOT EXISTS jobs (
+  id BIGSERIAL PRIMARY KEY,
+  kind VARCHAR(32) NOT NULL,
+  payload JSONB NOT NULL DEFAULT '{}',
+  dedup_key TEXT,
+  status VARCHAR(16) NOT NULL DEFAULT 'queued',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  max_attempts INTEGER NOT NULL DEFAULT 5,
+  run_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  locked_at TIMESTAMP,
+  last_error TEXT,
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs(run_at, id) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS idx_jobs_running ON jobs(locked_at) WHERE status = 'running';
+-- At most one queued job per piece of work
+CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_dedup ON jobs(kind, dedup_key) WHERE status = 'queued';
+
+-- Documents still waiting for the extract action become jobs
+UPDATE files SET extraction_status = 'pending' WHERE extraction_status = 'processing';
+
+INSERT INTO jobs (kind, payload, dedup_key)
+SELECT DISTINCT ON (content_hash) 'extract',
+       jsonb_build_object('contentHash', content_hash, 'fileName', file_name), content_hash
+FROM files
+WHERE extraction_status = 'pending' AND content_hash IS NOT NULL
+ORDER BY content_hash, id
+ON CONFLICT DO NOTHING;
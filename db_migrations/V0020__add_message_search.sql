@@ -0,0 +1,9 @@
+-- Full-text search over saved chats: Russian stems plus the raw words
+-- (simple config) for names, codes and English text the stemmer mangles
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector
+GENERATED ALWAYS AS (to_tsvector('russian', content) || to_tsvector('simple', content)) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_messages_search ON messages USING GIN (search_vector);
+
+-- Tag filter (tags @> ARRAY[...]) of chat search
+CREATE INDEX IF NOT EXISTS idx_chats_tags ON chats USING GIN (tags);
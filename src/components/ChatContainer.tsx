@@ -7,13 +7,14 @@ import ChatInput from './chat/ChatInput';
 import { useChatVoice } from './chat/useChatVoice';
 import { useChatSuggestions } from './chat/useChatSuggestions';
 import { processCommand } from '@/utils/commandProcessor';
+import { ImageRef } from '@/types/adminTypes';
 
 export interface Message {
   role: 'user' | 'ai';
   text: string;
   file?: any;
   imageUrl?: string;
-  images?: Array<{name: string; base64: string; mimeType: string}>;
+  images?: ImageRef[];
   isFavorite?: boolean;
   detectedLanguage?: string;
   translatedFrom?: string;
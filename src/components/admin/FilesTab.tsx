@@ -5,6 +5,7 @@ import { Input } from '@/components/ui/input';
 import { Textarea } from '@/components/ui/textarea';
 import Icon from '@/components/ui/icon';
 import { useToast } from '@/hooks/use-toast';
+import { getFileContentUrl } from '@/types/adminTypes';
 
 interface UploadedFile {
   id?: number;
@@ -14,10 +15,19 @@ interface UploadedFile {
   uploadedAt: string;
   isImage?: boolean;
   base64?: string;
+  thumbnail?: string;
+  thumbnailType?: string;
   mimeType?: string;
+  hash?: string | null;
   description?: string;
 }
 
+const getPreviewUrl = (file: UploadedFile) => {
+  if (file.thumbnail) return `data:${file.thumbnailType || 'image/webp'};base64,${file.thumbnail}`;
+  if (file.base64) return `data:${file.mimeType || 'image/jpeg'};base64,${file.base64}`;
+  return getFileContentUrl({ id: file.id!, name: file.name, mimeType: file.mimeType || 'image/jpeg', hash: file.hash });
+};
+
 interface FilesTabProps {
   files: UploadedFile[];
   isDragging: boolean;
@@ -126,10 +136,10 @@ export default function FilesTab({
                   <div className="flex gap-4">
                     {/* Preview */}
                     <div className="flex-shrink-0">
-                      {file.isImage && file.base64 ? (
+                      {file.isImage && (file.thumbnail || file.base64 || file.id) ? (
                         <div className="w-24 h-24 rounded-lg overflow-hidden border-2 border-purple-100">
                           <img 
-                            src={`data:${file.mimeType || 'image/jpeg'};base64,${file.base64}`}
+                            src={getPreviewUrl(file)}
                             alt={file.name}
                             className="w-full h-full object-cover"
                           />
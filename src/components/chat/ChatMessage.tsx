@@ -4,13 +4,14 @@ import ChatAvatar from '@/components/ChatAvatar';
 import RatingButtons from '@/components/RatingButtons';
 import ReactMarkdown from 'react-markdown';
 import { useLanguage } from '@/contexts/LanguageContext';
+import { ImageRef, getFileContentUrl } from '@/types/adminTypes';
 
 interface Message {
   role: 'user' | 'ai';
   text: string;
   file?: any;
   imageUrl?: string;
-  images?: Array<{name: string; base64: string; mimeType: string}>;
+  images?: ImageRef[];
   isFavorite?: boolean;
   detectedLanguage?: string;
   translatedFrom?: string;
@@ -95,7 +96,7 @@ export default function ChatMessage({
             {message.images.map((img, idx) => (
               <div key={idx} className="border border-purple-200 dark:border-purple-700 rounded-lg overflow-hidden">
                 <img 
-                  src={`data:${img.mimeType || 'image/jpeg'};base64,${img.base64}`} 
+                  src={getFileContentUrl(img)}
                   alt={img.name} 
                   className="max-w-full rounded-lg"
                 />
@@ -2,13 +2,14 @@ import Icon from '@/components/ui/icon';
 import ChatAvatar from '@/components/ChatAvatar';
 import ChatMessage from './ChatMessage';
 import { useLanguage } from '@/contexts/LanguageContext';
+import { ImageRef } from '@/types/adminTypes';
 
 interface Message {
   role: 'user' | 'ai';
   text: string;
   file?: any;
   imageUrl?: string;
-  images?: Array<{name: string; base64: string; mimeType: string}>;
+  images?: ImageRef[];
   isFavorite?: boolean;
   detectedLanguage?: string;
   translatedFrom?: string;
@@ -6,8 +6,10 @@ import {
   CustomPage, 
   AdminTabType,
   FILE_UPLOAD_URL,
-  getSessionId
+  getSessionId,
+  isDocumentFile
 } from '@/types/adminTypes';
+import { MULTIPART_THRESHOLD, uploadInParts } from '@/lib/multipartUpload';
 
 export function useAdminState() {
   const [uploadedFiles, setUploadedFiles] = useState<UploadedFile[]>([]);
@@ -79,27 +81,36 @@ export function useAdminState() {
 
   const loadFilesFromBackend = async () => {
     try {
-      const response = await fetch(FILE_UPLOAD_URL, {
-        method: 'GET',
-        headers: { 'Content-Type': 'application/json' }
-      });
+      const files: any[] = [];
+      let cursor: string | null = null;
       
-      if (response.ok) {
+      do {
+        const url = cursor ? `${FILE_UPLOAD_URL}?cursor=${encodeURIComponent(cursor)}` : FILE_UPLOAD_URL;
+        const response = await fetch(url, {
+          method: 'GET',
+          headers: { 'Content-Type': 'application/json' }
+        });
+        
+        if (!response.ok) break;
         const data = await response.json();
-        if (data.files) {
-          setUploadedFiles(data.files.map((f: any) => ({
-            id: f.id,
-            name: f.name,
-            size: f.size,
-            type: f.type,
-            uploadedAt: f.uploadedAt,
-            isImage: f.isImage,
-            base64: f.base64,
-            mimeType: f.mimeType,
-            description: f.description
-          })));
-        }
-      }
+        files.push(...(data.files || []));
+        cursor = data.nextCursor || null;
+      } while (cursor);
+      
+      setUploadedFiles(files.map((f: any) => ({
+        id: f.id,
+        name: f.name,
+        size: f.size,
+        type: f.type,
+        uploadedAt: f.uploadedAt,
+        isImage: f.isImage,
+        thumbnail: f.thumbnail,
+        thumbnailType: f.thumbnailType,
+        mimeType: f.mimeType,
+        hash: f.hash,
+        description: f.description,
+        extractionStatus: f.extractionStatus
+      })));
     } catch (error) {
       console.error('Error loading files:', error);
     }
@@ -128,12 +139,40 @@ export function useAdminState() {
     }
   };
 
+  // PDF/DOCX text and image thumbnails are produced by backend jobs after upload.
+  // Run a batch right away, so the list is complete without waiting for a worker
+  const processJobs = async () => {
+    try {
+      const response = await fetch(FILE_UPLOAD_URL, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ action: 'process_jobs' })
+      });
+      if (response.ok) await loadFilesFromBackend();
+    } catch (error) {
+      console.error('Job processing error:', error);
+    }
+  };
+
   const uploadFilesToBackend = async (files: File[]) => {
     let successCount = 0;
     
     for (const file of files) {
+      const isDocument = isDocumentFile(file.name);
       const isImage = file.type.startsWith('image/');
       
+      if (file.size > MULTIPART_THRESHOLD) {
+        try {
+          await uploadInParts(file);
+          successCount++;
+          await loadFilesFromBackend();
+          if (isDocument || isImage) processJobs();
+        } catch (error) {
+          console.error('Upload error:', error);
+        }
+        continue;
+      }
+      
       const reader = new FileReader();
       reader.onload = async (event) => {
         const content = event.target?.result as string;
@@ -146,7 +185,7 @@ export function useAdminState() {
               filename: file.name,
               fileType: file.type,
               fileSize: file.size,
-              content: isImage ? content.split(',')[1] : content.substring(0, 50000),
+              content: isImage || isDocument ? content.split(',')[1] : content.substring(0, 50000),
               sessionId: getSessionId()
             })
           });
@@ -154,13 +193,14 @@ export function useAdminState() {
           if (response.ok) {
             successCount++;
             await loadFilesFromBackend();
+            if (isDocument || isImage) processJobs();
           }
         } catch (error) {
           console.error('Upload error:', error);
         }
       };
       
-      if (isImage) {
+      if (isImage || isDocument) {
         reader.readAsDataURL(file);
       } else {
         reader.readAsText(file);
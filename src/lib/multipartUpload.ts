@@ -0,0 +1,94 @@
+import { FILE_UPLOAD_URL, getSessionId } from '@/types/adminTypes';
+
+// Files above this size go through the resumable multipart protocol of file-upload
+export const MULTIPART_THRESHOLD = 4 * 1024 * 1024;
+const PART_SIZE = 4 * 1024 * 1024;
+const PART_RETRIES = 3;
+
+interface StoredPart {
+  partNumber: number;
+  size: number;
+  sha256: string;
+}
+
+const storageKey = (file: File) => `upload:${file.name}:${file.size}:${file.lastModified}`;
+
+const postAction = async (payload: Record<string, unknown>) => {
+  const response = await fetch(FILE_UPLOAD_URL, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(payload)
+  });
+  const data = await response.json();
+  return { ok: response.ok, status: response.status, data };
+};
+
+const toHex = (buffer: ArrayBuffer) =>
+  Array.from(new Uint8Array(buffer), (byte) => byte.toString(16).padStart(2, '0')).join('');
+
+const toBase64 = (buffer: ArrayBuffer) => {
+  const bytes = new Uint8Array(buffer);
+  let binary = '';
+  for (let i = 0; i < bytes.length; i += 0x8000) {
+    binary += String.fromCharCode(...bytes.subarray(i, i + 0x8000));
+  }
+  return btoa(binary);
+};
+
+const loadStoredParts = async (uploadId: string): Promise<StoredPart[] | null> => {
+  const { ok, data } = await postAction({ action: 'upload_status', uploadId });
+  if (!ok || data.file_id) return null;
+  return data.parts as StoredPart[];
+};
+
+/**
+ * Upload a large file part by part. The upload id is kept in localStorage,
+ * so after a reload or a dropped connection only parts whose checksum the
+ * server does not have yet are sent again.
+ */
+export async function uploadInParts(file: File, description = ''): Promise<number> {
+  const partCount = Math.max(1, Math.ceil(file.size / PART_SIZE));
+  const key = storageKey(file);
+
+  let uploadId = localStorage.getItem(key);
+  let stored = uploadId ? await loadStoredParts(uploadId) : null;
+  if (!uploadId || !stored) {
+    const { ok, data } = await postAction({
+      action: 'upload_init',
+      filename: file.name,
+      fileType: file.type,
+      fileSize: file.size,
+      sessionId: getSessionId(),
+      description,
+      partCount
+    });
+    if (!ok) throw new Error(data.error || 'Upload init failed');
+    uploadId = data.uploadId as string;
+    stored = [];
+    localStorage.setItem(key, uploadId);
+  }
+
+  const storedHashes = new Map(stored.map((part) => [part.partNumber, part.sha256]));
+
+  for (let partNumber = 1; partNumber <= partCount; partNumber++) {
+    const buffer = await file.slice((partNumber - 1) * PART_SIZE, partNumber * PART_SIZE).arrayBuffer();
+    const sha256 = toHex(await crypto.subtle.digest('SHA-256', buffer));
+    if (storedHashes.get(partNumber) === sha256) continue;
+
+    const content = toBase64(buffer);
+    for (let attempt = 1; ; attempt++) {
+      try {
+        const { ok, data } = await postAction({ action: 'upload_part', uploadId, partNumber, content, sha256 });
+        if (ok) break;
+        if (attempt >= PART_RETRIES) throw new Error(data.error || `Part ${partNumber} failed`);
+      } catch (error) {
+        if (attempt >= PART_RETRIES) throw error;
+      }
+    }
+  }
+
+  const { ok, data } = await postAction({ action: 'upload_complete', uploadId });
+  if (!ok) throw new Error(data.error || 'Upload complete failed');
+  localStorage.removeItem(key);
+  return data.file_id as number;
+}
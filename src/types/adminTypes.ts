@@ -1,5 +1,19 @@
 export const FILE_UPLOAD_URL = 'https://functions.poehali.dev/b58abb29-2429-4b6e-aed0-e5aae54d2240';
 
+export interface ImageRef {
+  id: number;
+  name: string;
+  mimeType: string;
+  size?: number;
+  hash?: string | null;
+}
+
+export const getFileContentUrl = (image: ImageRef) =>
+  `${FILE_UPLOAD_URL}?id=${image.id}${image.hash ? `&v=${image.hash}` : ''}`;
+
+// Binary documents whose text file-upload extracts after the upload
+export const isDocumentFile = (fileName: string) => /\.(pdf|docx?)$/i.test(fileName);
+
 export const getSessionId = () => {
   let sessionId = localStorage.getItem('session_id');
   if (!sessionId) {
@@ -41,8 +55,12 @@ export interface UploadedFile {
   uploadedAt: string;
   isImage?: boolean;
   base64?: string;
+  thumbnail?: string;
+  thumbnailType?: string;
   mimeType?: string;
+  hash?: string | null;
   description?: string;
+  extractionStatus?: 'pending' | 'processing' | 'done' | 'failed';
 }
 
 export interface CustomPage {